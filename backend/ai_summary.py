@@ -57,8 +57,11 @@ BEDROCK_BASE_URL = os.getenv("BEDROCK_BASE_URL")
 DEFAULT_MODEL = os.getenv("BEDROCK_MODEL", "apac.anthropic.claude-sonnet-4-20250514-v1:0")
 USER_TOKEN = os.getenv("LLM_USER_TOKEN")
 
-def call_bedrock_llm(passenger_groups, weights, prediction_results, original_counts, top_nationalities=None):
-    """Call AWS Bedrock LLM API to analyze meal prediction trends."""
+class AISummaryUnavailable(Exception):
+    """ Raised by call_bedrock_llm when no summary could be generated; str() is the fallback text shown to users. """
+
+async def call_bedrock_llm(passenger_groups, weights, prediction_results, original_counts, top_nationalities=None):
+    """Call AWS Bedrock LLM API to analyze meal prediction trends (awaits the HTTP call, doesn't block the event loop)."""
     
     # Build feature weights text
     weights_text = "\n".join([f"- {k.replace('_', ' ').title()}: {v}%" for k, v in weights.items()])
@@ -197,20 +200,19 @@ BAD EXECUTIVE SUMMARY (don't do this):
         )
         
         # Call the LLM using the CallLLM class
-        summary = llm_client.call_llm(body=body)
-        
-        # Check if response is an error message
-        if summary.startswith("Error"):
-            logger.error(f"Bedrock API error: {summary}")
-            return "AI summary not available due to API error. Please check your configuration."
+        summary = await llm_client.acall_llm(body=body)
         
-        logger.info("AI summary generated successfully")
-        return summary
-            
     except Exception as e:
         logger.error(f"Request failed: {str(e)}")
+        raise AISummaryUnavailable("AI summary not available due to connection error. Please check network connectivity.") from e
+    
+    # Check if response is an error message
+    if summary.startswith("Error"):
+        logger.error(f"Bedrock API error: {summary}")
+        raise AISummaryUnavailable("AI summary not available due to API error. Please check your configuration.")
     
-    return "AI summary not available due to connection error. Please check network connectivity."
+    logger.info("AI summary generated successfully")
+    return summary
 
 
 @router.post("/api/ai-summary")
@@ -219,12 +221,15 @@ async def ai_prediction_summary(request: PredictionSummaryRequest):
     logger.info(f"AI summary request for {request.flight_number} on {request.flight_date}")
     logger.info(f"Top nationalities provided: {len(request.top_nationalities)}")
     
-    summary = call_bedrock_llm(
-        request.passenger_groups,
-        request.weights,
-        request.prediction_results,
-        request.original_counts,
-        request.top_nationalities
-    )
+    try:
+        summary = await call_bedrock_llm(
+            request.passenger_groups,
+            request.weights,
+            request.prediction_results,
+            request.original_counts,
+            request.top_nationalities
+        )
+    except AISummaryUnavailable as e:
+        summary = str(e)
     
     return {"summary": summary}
@@ -0,0 +1,231 @@
+"""
+Network-wide batch prediction.
+
+Predicts per-meal loading counts for every flight in a date range in one vectorized pass
+over the resident passenger manifest, using the same model as /api/predict with the CSV
+default probabilities (no session edits): same cabin rule, passenger groups, destination
+region from the segment, largest remainder rounding per group.
+
+Used by /api/predict-batch and runnable as a CLI:
+
+    python batch_prediction.py --start 2024-06-01 --end 2024-06-07 --segment "SIN JFK" -o loads.csv
+"""
+
+import argparse
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from customer_store import CustomerStore
+from factor_tables import airport_regions, load_factor_tables
+from meal_catalog import MealCatalog
+from scoring import PROTEINS, PROTEIN_INDEX, protein_slots, blend, apportion
+
+# Default importance weights (nationality, age, destination, meal time), as in /api/predict
+DEFAULT_WEIGHTS = (0.40, 0.20, 0.25, 0.15)
+
+RESULT_COLUMNS = ['flight_number', 'segment', 'segment_local_departure_date', 'weekday', 'cabin_class',
+                  'meal_time', 'protein_type', 'predicted_meal_count', 'passenger_count']
+
+OUTPUT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def _positions(table, keys: pd.Series) -> np.ndarray:
+    """Factor table row positions of every key, looking each distinct key up once"""
+    if table is None:
+        return np.full(len(keys), -1, dtype=np.int64)
+    codes, uniques = pd.factorize(keys, use_na_sentinel=False)
+    return table.positions(uniques)[codes]
+
+
+def predict_network(customer_store: CustomerStore, meal_catalog: MealCatalog, factor_tables: dict,
+                    start_date, end_date=None, segments=None, cabins=None,
+                    weights=DEFAULT_WEIGHTS) -> pd.DataFrame:
+    """
+    Predicted meal counts for every flight departing between start_date and end_date
+    (inclusive), one row per flight/date/cabin/meal time/protein (RESULT_COLUMNS).
+
+    segments: only these segments (e.g. ["SIN JFK"]); default all.
+    cabins: predict these cabins; default is the /api/predict rule (S on SIN JFK, otherwise Y).
+    """
+    df = customer_store.df
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize() if end_date is not None else start
+
+    rows = df[(df['departure_date'] >= start) & (df['departure_date'] <= end) & (df['age_group'] != 'Under 2')]
+    if rows.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # The manifest is sorted by (flight, date), so each flight+date is a contiguous block.
+    # Its segment is the first passenger's segment, as in /api/predict.
+    flights = rows['operating_flight_number'].to_numpy()
+    dates = rows['departure_date'].to_numpy()
+    block_start = np.r_[True, (flights[1:] != flights[:-1]) | (dates[1:] != dates[:-1])]
+    block_id = np.cumsum(block_start) - 1
+    flight_segment = rows['segment'].to_numpy(dtype=object)[block_start][block_id]
+
+    if cabins:
+        keep = rows['cabin_class'].isin(cabins).to_numpy()
+    else:
+        keep = rows['cabin_class'].to_numpy(dtype=object) == np.where(flight_segment == 'SIN JFK', 'S', 'Y')
+    keep &= pd.notna(flight_segment)
+    if segments:
+        keep &= pd.Series(flight_segment).isin(list(segments)).to_numpy()
+
+    rows = rows[keep].copy()
+    rows['flight_segment'] = flight_segment[keep]
+    if rows.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # Passenger groups (same grouping as /api/predict)
+    rows['feature_set'] = (
+        rows['nationality_code'].astype(str) + '_' +
+        rows['age_group'].astype(str) + '_' +
+        rows['destination_region'].astype(str) + '_' +
+        rows['meal_time'].astype(str)
+    )
+    grouped = rows.groupby([
+        'operating_flight_number', 'departure_date', 'flight_segment', 'segment', 'cabin_class', 'weekday', 'feature_set'
+    ], observed=True, sort=False).size().reset_index(name='passenger_count')
+    feature_details = rows.groupby('feature_set').agg({
+        'nationality_code': 'first',
+        'age_group': 'first',
+        'meal_time': 'first'
+    }).reset_index()
+    grouped = grouped.merge(feature_details, on='feature_set', how='left')
+    grouped['date'] = grouped['departure_date'].dt.date
+
+    # Meals served per (segment, date, cabin, meal time); groups without meals are not scored
+    meal_keys = ['flight_segment', 'date', 'cabin_class', 'meal_time']
+    meal_codes, meal_index = pd.factorize(pd.MultiIndex.from_frame(grouped[meal_keys].astype(object)))
+    meal_entries = [meal_catalog.lookup(*key) for key in meal_index]
+    served = np.array([entry is not None and bool(entry['proteins']) for entry in meal_entries], dtype=bool)
+    scored = served[meal_codes]
+    grouped = grouped[scored].reset_index(drop=True)
+    meal_codes = meal_codes[scored]
+    if grouped.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # Sorted proteins per meal (alphabetical tie-breaking), one slot row per group
+    meal_slots = protein_slots([entry['proteins'] if entry else [] for entry in meal_entries])
+    slots = meal_slots[meal_codes]
+
+    # CSV default factors gathered from the restricted tables; keys not found stay zero
+    region_by_airport = airport_regions(factor_tables)
+    destination = grouped['flight_segment'].map(lambda segment: region_by_airport.get(segment.split()[-1], segment.split()[-1]))
+    factor_keys = {
+        'nationality': grouped['nationality_code'].astype(str) + '_' + grouped['weekday'].astype(str),
+        'age': grouped['age_group'].astype(object),
+        'destination': destination,
+        'mealtime': grouped['meal_time'].astype(object),
+    }
+    factors = []
+    for metric in ['nationality', 'age', 'destination', 'mealtime']:
+        table = factor_tables.get(metric)
+        positions = _positions(table, factor_keys[metric])
+        if table is None:
+            factors.append(np.zeros((len(grouped), len(PROTEINS))))
+        else:
+            factors.append(np.where((positions >= 0)[:, None], table.gather(positions, slots), 0.0))
+
+    final_probs = blend(factors, list(weights), slots)
+    counts = apportion(final_probs, grouped['passenger_count'].to_numpy(), slots)
+
+    # Totals per flight/date/cabin/meal time
+    out_keys = ['operating_flight_number', 'departure_date', 'flight_segment', 'cabin_class', 'weekday', 'meal_time']
+    out_codes, out_index = pd.factorize(pd.MultiIndex.from_frame(grouped[out_keys].astype(object)))
+    meal_totals = np.zeros((len(out_index), len(PROTEINS)), dtype=np.int64)
+    np.add.at(meal_totals, out_codes, counts)
+    passengers = np.bincount(out_codes, weights=grouped['passenger_count'].to_numpy(), minlength=len(out_index))
+    out_meal = np.zeros(len(out_index), dtype=np.int64)
+    out_meal[out_codes] = meal_codes
+
+    records = []
+    for k, (flight_number, departure_date, segment, cabin_class, weekday, meal_time) in enumerate(out_index):
+        for protein in meal_entries[out_meal[k]]['proteins']:
+            records.append((flight_number, segment, departure_date.date(), weekday, cabin_class, meal_time,
+                            protein, int(meal_totals[k, PROTEIN_INDEX[protein]]), int(passengers[k])))
+
+    results = pd.DataFrame.from_records(records, columns=RESULT_COLUMNS)
+    return results.sort_values(['segment_local_departure_date', 'flight_number', 'cabin_class', 'meal_time',
+                                'protein_type']).reset_index(drop=True)
+
+
+def iter_csv(results: pd.DataFrame, chunk_rows: int = 50000):
+    """Yield the results as CSV text in chunks (header first)"""
+    yield ','.join(RESULT_COLUMNS) + '\n'
+    for start in range(0, len(results), chunk_rows):
+        yield results.iloc[start:start + chunk_rows].to_csv(index=False, header=False)
+
+
+def to_parquet_bytes(results: pd.DataFrame) -> bytes:
+    """Results as a Parquet file (needs pyarrow or fastparquet installed)"""
+    buffer = io.BytesIO()
+    results.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def parquet_available() -> bool:
+    """True if pandas has a Parquet engine"""
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return True
+        except ImportError:
+            continue
+    return False
+
+
+def main(argv=None):
+    default_data_dir = '/data' if os.path.exists('/data') else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+    parser = argparse.ArgumentParser(description="Predict meal loading counts for every flight in a date range")
+    parser.add_argument('--start', required=True, help="First departure date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Last departure date (YYYY-MM-DD), default: --start")
+    parser.add_argument('--segment', action='append', dest='segments', help='Segment to include, e.g. "SIN JFK" (repeatable)')
+    parser.add_argument('--cabin', action='append', dest='cabins', help="Cabin class to predict (repeatable), default: S on SIN JFK, otherwise Y")
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='csv')
+    parser.add_argument('-o', '--output', help="Output file (default: CSV to stdout)")
+    parser.add_argument('--data-dir', default=default_data_dir, help="Directory with customers.csv, meal_df_new.csv and the factor CSVs")
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and not args.output:
+        parser.error("--format parquet needs --output")
+    if args.format == 'parquet' and not parquet_available():
+        parser.error("Parquet output needs pyarrow (pip install pyarrow)")
+
+    # Progress goes to stderr so CSV on stdout stays clean
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        store = CustomerStore(os.path.join(args.data_dir, 'customers.csv')).load()
+        catalog = MealCatalog(os.path.join(args.data_dir, 'meal_df_new.csv')).load()
+        if store.df is None or catalog.df is None:
+            print(f"❌ {store.error or catalog.error}")
+            return 1
+        results = predict_network(store, catalog, load_factor_tables(args.data_dir),
+                                  args.start, args.end, args.segments, args.cabins)
+        print(f"✅ batch_prediction ----------- {len(results)} rows for "
+              f"{results[['flight_number', 'segment_local_departure_date']].drop_duplicates().shape[0]} flights")
+    finally:
+        sys.stdout = stdout
+
+    if args.format == 'parquet':
+        with open(args.output, 'wb') as f:
+            f.write(to_parquet_bytes(results))
+    elif args.output:
+        with open(args.output, 'w', newline='') as f:
+            f.writelines(iter_csv(results))
+    else:
+        sys.stdout.writelines(iter_csv(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Request coalescing (single flight).
+
+When several planners open the same flight at once, identical requests arrive while the
+first one is still being computed. The first caller for a key computes the result; callers
+that arrive before it finishes attach to that computation and get its result (or its
+exception) instead of computing it again. Nothing is kept once the computation finishes;
+caching results is up to the caller (see result_cache.py).
+
+run() is for sync code (followers block on the leader's Future), run_async() for async
+endpoints (followers await it). Both can be used for the same keys.
+
+Every SingleFlight registers itself by name; coalescing_stats() reports how many requests
+were computed and how many were coalesced, for /api/cache-stats.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+COALESCERS = {}  # name -> SingleFlight
+
+
+def coalescing_stats() -> dict:
+    """Stats of every registered SingleFlight, by name"""
+    return {name: flight.stats() for name, flight in COALESCERS.items()}
+
+
+class SingleFlight:
+    def __init__(self, name: str, register: bool = True):
+        """register: list it in coalescing_stats() (result caches report their own counters)"""
+        self.name = name
+        self._inflight = {}  # key -> Future of the leader's computation
+        self._lock = threading.Lock()
+        self.computations = 0
+        self.coalesced = 0
+        self.max_waiting = 0
+        self._waiting = {}  # key -> followers currently attached
+        if register:
+            COALESCERS[name] = self
+
+    def _join(self, key):
+        """(Future of the computation for key, True if the caller has to compute it)"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                self._waiting[key] = 0
+                self.computations += 1
+                return future, True
+            self.coalesced += 1
+            self._waiting[key] += 1
+            self.max_waiting = max(self.max_waiting, self._waiting[key])
+            return future, False
+
+    def _finish(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._waiting.pop(key, None)
+
+    def run(self, key, compute):
+        """compute() for key, or the result of the identical computation already in flight"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            value = compute()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._finish(key)
+
+    async def run_async(self, key, compute):
+        """await compute() for key (compute returns a coroutine), or the result already in flight"""
+        future, leader = self._join(key)
+        if not leader:
+            # Shielded: a follower whose client goes away must not cancel the leader's computation
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            value = await compute()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._finish(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "computations": self.computations,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._inflight),
+                "waiting": sum(self._waiting.values()),
+                "max_waiting": self.max_waiting,
+            }
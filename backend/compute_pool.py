@@ -0,0 +1,140 @@
+"""
+Bounded executor for the CPU-bound work of the async endpoints.
+
+pandas/numpy work called directly from an async def endpoint runs on the event loop, so one
+slow prediction stalls every other request (even cheap /api/flights hits). ComputePool.run()
+awaits that work in a fixed number of worker threads instead; the loop keeps serving other
+requests meanwhile (numpy and pandas release the GIL in their heavy loops).
+
+Every endpoint has a concurrency limit; requests over it wait in that endpoint's queue, so
+one burst of predictions can't take every worker. Work for the same serial key (a session)
+runs one at a time, in arrival order, like it did on the event loop, so an edit and a
+prediction of the same session never interleave.
+
+stats() reports per endpoint: running, queued (waiting for the limit or a worker), the
+deepest queue seen and average wait/run times, for /api/cache-stats.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EndpointStats:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = None  # created on first use, on the serving event loop
+        self.running = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        done = self.completed + self.failed
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.wait_seconds / done * 1000, 2) if done else 0.0,
+            "avg_run_ms": round(self.run_seconds / done * 1000, 2) if done else 0.0,
+        }
+
+
+class ComputePool:
+    def __init__(self, max_workers: int, limits: dict = None, default_limit: int = None):
+        """
+        max_workers: worker threads shared by every endpoint
+        limits: {endpoint: max concurrent requests}; other endpoints get default_limit
+            (default: max_workers)
+        """
+        self.max_workers = max_workers
+        self.limits = limits or {}
+        self.default_limit = default_limit or max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='compute')
+        self.endpoints = {}  # endpoint -> EndpointStats
+        self._serial = {}  # serial key -> [asyncio.Lock, users]
+        self._lock = threading.Lock()
+        self.busy = 0
+        self.max_busy = 0
+
+    def _endpoint(self, endpoint: str) -> EndpointStats:
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = EndpointStats(self.limits.get(endpoint, self.default_limit))
+        if stats.semaphore is None:
+            stats.semaphore = asyncio.Semaphore(stats.limit)
+        return stats
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self.busy += 1
+            self.max_busy = max(self.max_busy, self.busy)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.busy -= 1
+
+    async def run(self, endpoint: str, fn, *args, serial_key=None, **kwargs):
+        """
+        fn(*args, **kwargs) on a worker thread, at most the endpoint's limit at a time
+        (and one at a time per serial_key if given)
+        """
+        stats = self._endpoint(endpoint)
+        stats.queued += 1
+        stats.max_queued = max(stats.max_queued, stats.queued)
+        queued_at = time.perf_counter()
+        started_at = None
+        serial = None
+        if serial_key is not None:
+            serial = self._serial.setdefault(serial_key, [asyncio.Lock(), 0])
+            serial[1] += 1
+        try:
+            async with stats.semaphore:
+                if serial is not None:
+                    await serial[0].acquire()
+                try:
+                    started_at = time.perf_counter()
+                    stats.queued -= 1
+                    stats.running += 1
+                    stats.wait_seconds += started_at - queued_at
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(self.executor, self._call, fn, args, kwargs)
+                    stats.completed += 1
+                    return result
+                except BaseException:
+                    if started_at is not None:
+                        stats.failed += 1
+                    raise
+                finally:
+                    if started_at is not None:
+                        stats.running -= 1
+                        stats.run_seconds += time.perf_counter() - started_at
+                    if serial is not None:
+                        serial[0].release()
+        finally:
+            if started_at is None:
+                stats.queued -= 1  # cancelled while waiting
+            if serial is not None:
+                serial[1] -= 1
+                if serial[1] == 0:
+                    self._serial.pop(serial_key, None)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "busy": self.busy,
+            "max_busy": self.max_busy,
+            "queued": sum(stats.queued for stats in self.endpoints.values()),
+            "endpoints": {endpoint: stats.as_dict() for endpoint, stats in self.endpoints.items()},
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
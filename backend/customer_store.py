@@ -0,0 +1,298 @@
+"""
+Resident passenger manifest (customers.csv).
+
+The manifest is read once into typed columns (categoricals for the low-cardinality
+features, pre-parsed departure date and weekday) and shared by every endpoint that
+needs passengers, instead of each request re-reading and re-parsing the CSV.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Low-cardinality passenger features stored as pandas categoricals
+CATEGORICAL_COLUMNS = ['nationality_code', 'age_group', 'cabin_class', 'segment', 'meal_time',
+                       'destination_region', 'weekday']
+
+
+class CustomerStore:
+    def __init__(self, customers_file: str):
+        self.customers_file = customers_file
+        self.df = None
+        self.error = None
+        self.loaded = False
+        self._lock = threading.Lock()
+        # (flight_number, departure_date) index over the sorted manifest
+        self._flight_ranges = {}
+        self._segment_flights = {}
+        self._dates = np.empty(0, dtype='int64')
+        # Flight catalog served by /api/flights, built with the index
+        self.catalog = {'flights': [], 'categories': []}
+        # Materialized passenger summary per (flight_number, departure date as ns), see summary()
+        self.summaries = {}
+
+    def load(self):
+        """Read customers.csv into typed columns (replaces any previously loaded table)"""
+        if not os.path.exists(self.customers_file):
+            self.df = None
+            self.error = "customers.csv not found"
+            self.loaded = True
+            return self
+
+        print(f"📂 CustomerStore.load() ----------- Loading passenger manifest: {self.customers_file}")
+
+        # Read age_group as string to prevent Excel date conversion
+        df = pd.read_csv(self.customers_file, dtype={'age_group': str}, low_memory=False)
+
+        # Fix Excel's auto-conversion of "2-18" to "Feb-18"
+        if 'age_group' in df.columns:
+            df['age_group'] = df['age_group'].replace('Feb-18', '2-18')
+
+        df['operating_flight_number'] = df['operating_flight_number'].astype(str).str.strip()
+
+        # Pre-parse the local departure date (DD/MM/YYYY HH:MM) and its weekday once
+        departure_date = pd.to_datetime(
+            df['segment_local_departure_datetime'].str.split().str[0],
+            format='%d/%m/%Y',
+            errors='coerce'
+        )
+        df['departure_date'] = departure_date
+        df['weekday'] = departure_date.dt.day_name()
+
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+
+        # Sort once by (flight, date) so every flight+date is a contiguous row range.
+        # The multi-key sort is stable, so file order is kept within a flight+date.
+        df = df.sort_values(['operating_flight_number', 'departure_date'],
+                            na_position='first').reset_index(drop=True)
+        self._build_index(df)
+        self.catalog = self._build_catalog(df)
+        self.summaries = self._build_summaries(df)
+
+        self.df = df
+        self.error = None
+        self.loaded = True
+        print(f"✅ CustomerStore.load() ----------- {len(df)} rows, "
+              f"{df.memory_usage(deep=True).sum() / 1e6:.1f} MB resident")
+        return self
+
+    def ensure_loaded(self):
+        """Load the manifest on first use (thread-safe)"""
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        print(f"❌ CustomerStore.load() failed: {e}")
+                        self.df = None
+                        self.error = str(e)
+                        self.loaded = True
+        return self
+
+    def _build_index(self, df: pd.DataFrame):
+        """Index each flight's contiguous block; dates inside a block are sorted for binary search"""
+        flights = df['operating_flight_number'].to_numpy()
+        boundaries = np.flatnonzero(flights[1:] != flights[:-1]) + 1
+        starts = np.concatenate(([0], boundaries)) if len(df) else np.empty(0, dtype='int64')
+        ends = np.concatenate((boundaries, [len(df)])) if len(df) else np.empty(0, dtype='int64')
+        self._flight_ranges = {flights[start]: (int(start), int(end)) for start, end in zip(starts, ends)}
+        # NaT is stored as the smallest int64, matching na_position='first' in the sort
+        self._dates = df['departure_date'].to_numpy(dtype='datetime64[ns]').view('int64')
+
+        self._segment_flights = {}
+        if 'segment' in df.columns:
+            pairs = df[['segment', 'operating_flight_number']].drop_duplicates()
+            for segment, flight in zip(pairs['segment'], pairs['operating_flight_number']):
+                if pd.notna(segment):
+                    self._segment_flights.setdefault(segment, []).append(flight)
+
+    def _build_catalog(self, df: pd.DataFrame) -> dict:
+        """
+        Every operating flight with its route, destination region and available departure
+        dates (YYYY-MM-DD), plus the sorted destination regions (categories)
+        """
+        categories = sorted(df['destination_region'].dropna().unique().tolist())
+
+        firsts = df.groupby('operating_flight_number').agg(
+            origin=('departure_airport', 'first'),
+            destination=('arrival_airport', 'first'),
+            category=('destination_region', 'first'),
+        )
+        # Rows are sorted by (flight, date), so each flight's unique dates come out ascending
+        dated = df.loc[df['departure_date'].notna(), ['operating_flight_number', 'departure_date']].drop_duplicates()
+        dates = dated['departure_date'].dt.strftime('%Y-%m-%d').groupby(dated['operating_flight_number']).agg(list)
+
+        flights = []
+        for flight_num, origin, destination, category in zip(firsts.index, firsts['origin'],
+                                                             firsts['destination'], firsts['category']):
+            origin = str(origin)
+            destination = str(destination)
+            flights.append({
+                'flightNumber': flight_num,
+                'origin': origin,
+                'destination': destination,
+                'route': f"{origin}-{destination}",
+                'category': str(category) if pd.notna(category) else 'Unknown',
+                'availableDates': dates.get(flight_num, []),
+            })
+        return {'flights': flights, 'categories': categories}
+
+    def flights(self, category: str = None, route_prefix: str = None, date_from: str = None,
+                date_to: str = None) -> list:
+        """
+        Catalog flights, optionally only one category, routes starting with route_prefix
+        (e.g. "SIN" or "SIN-JFK") and dates inside [date_from, date_to] (YYYY-MM-DD).
+        Flights with no dates left in the window are dropped.
+        """
+        self.ensure_loaded()
+        flights = self.catalog['flights']
+        if category:
+            flights = [flight for flight in flights if flight['category'] == category]
+        if route_prefix:
+            prefix = route_prefix.strip().upper()
+            flights = [flight for flight in flights if flight['route'].upper().startswith(prefix)]
+        if date_from or date_to:
+            windowed = []
+            for flight in flights:
+                dates = [date for date in flight['availableDates']
+                         if (not date_from or date >= date_from) and (not date_to or date <= date_to)]
+                if dates:
+                    windowed.append({**flight, 'availableDates': dates})
+            flights = windowed
+        return flights
+
+    def _build_summaries(self, df: pd.DataFrame) -> dict:
+        """
+        Passenger summary of every (flight, departure date), in one grouped pass: unique passengers
+        (first row per customer_number), their cabin distribution, the destination airport, the
+        meal times, and nationality / age breakdowns for the analysis cabin (Y if present, else S).
+        Counts are ordered like value_counts() (most frequent first).
+        """
+        keys = ['operating_flight_number', 'departure_date']
+        dated = df[df['departure_date'].notna()]
+        if dated.empty:
+            return {}
+
+        # Each customer can have several meal times, so passengers are deduplicated by customer_number
+        if 'customer_number' in dated.columns:
+            unique = dated.drop_duplicates(subset=keys + ['customer_number'], keep='first')
+        else:
+            unique = dated.drop_duplicates(subset=[col for col in dated.columns if col != 'meal_time'], keep='first')
+
+        def count_table(frame: pd.DataFrame, column: str, by: list) -> pd.DataFrame:
+            """Rows: by (e.g. flight, date); columns: every category of column, in category order"""
+            counts = frame.groupby(by + [column], observed=True).size().unstack(fill_value=0)
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                counts = counts.reindex(columns=frame[column].cat.categories, fill_value=0)
+            return counts
+
+        def ordered(counts: np.ndarray, labels: list) -> dict:
+            # Non-zero counts in value_counts() order, i.e. Series.sort_values(ascending=False),
+            # which argsorts the reversed values and reverses the result
+            order = (len(counts) - 1 - counts[::-1].argsort(kind='quicksort'))[::-1]
+            return {labels[i]: int(counts[i]) for i in order if counts[i] > 0}
+
+        totals = unique.groupby(keys).size()
+        firsts = unique.drop_duplicates(subset=keys, keep='first').set_index(keys).reindex(totals.index)
+        if 'arrival_airport' in firsts.columns:
+            destinations = firsts['arrival_airport'].tolist()
+        elif 'segment' in firsts.columns:
+            destinations = [segment.split()[-1] if isinstance(segment, str) and ' ' in segment else 'Unknown'
+                            for segment in firsts['segment']]
+        else:
+            destinations = ['Unknown'] * len(totals)
+
+        cabins = None
+        if 'cabin_class' in unique.columns:
+            cabins = count_table(unique, 'cabin_class', keys).reindex(totals.index, fill_value=0)
+        cabin_counts = cabins.to_numpy() if cabins is not None else None
+        cabin_labels = cabins.columns.tolist() if cabins is not None else []
+
+        meal_times = {}
+        if 'meal_time' in dated.columns:
+            served = dated.loc[dated['meal_time'].notna(), keys + ['meal_time']].drop_duplicates()
+            for flight, date, meal_time in zip(served[keys[0]], served[keys[1]], served['meal_time']):
+                meal_times.setdefault((flight, date), []).append(meal_time)
+
+        summaries = {}
+        analysis_cabins = []
+        for i, (key, total) in enumerate(totals.items()):
+            cabin_distribution = ordered(cabin_counts[i], cabin_labels) if cabins is not None else {}
+            analysis_cabin = 'Y' if 'Y' in cabin_distribution else 'S' if 'S' in cabin_distribution else None
+            analysis_cabins.append(analysis_cabin)
+            summaries[(key[0], key[1].value)] = {
+                "total_customers": int(total),
+                "cabin_distribution": cabin_distribution,
+                "destination_airport": destinations[i],
+                "meal_times": sorted(meal_times.get(key, [])),
+                "analysis_cabin": analysis_cabin,
+                "nationality_breakdown": {},
+                "age_breakdown": {},
+            }
+
+        # Nationality / age counts of each flight's analysis cabin
+        analysed = [(flight, date, cabin) for (flight, date), cabin in zip(totals.index, analysis_cabins) if cabin]
+        if analysed:
+            analysed_index = pd.MultiIndex.from_tuples(analysed, names=keys + ['cabin_class'])
+            for column, field in (('nationality_code', 'nationality_breakdown'), ('age_group', 'age_breakdown')):
+                if column not in unique.columns:
+                    continue
+                table = count_table(unique, column, keys + ['cabin_class'])
+                counts = table.reindex(analysed_index, fill_value=0).to_numpy()
+                labels = table.columns.tolist()
+                for (flight, date, _), row in zip(analysed, counts):
+                    summaries[(flight, date.value)][field] = ordered(row, labels)
+        return summaries
+
+    def summary(self, flight_number: str, flight_date):
+        """Materialized passenger summary of one flight+date (None if it has no passengers)"""
+        self.ensure_loaded()
+        return self.summaries.get((flight_number.strip(), pd.Timestamp(flight_date).normalize().value))
+
+    def has_flight(self, flight_number: str) -> bool:
+        """True if the manifest has any rows for this operating flight number"""
+        self.ensure_loaded()
+        return flight_number.strip() in self._flight_ranges
+
+    def flight_range(self, flight_number: str, flight_date):
+        """(start, stop) row positions of one flight+date in the sorted manifest"""
+        self.ensure_loaded()
+        block = self._flight_ranges.get(flight_number.strip())
+        if block is None:
+            return 0, 0
+        start, end = block
+        target = pd.Timestamp(flight_date).normalize().value
+        dates = self._dates[start:end]
+        lo = start + int(np.searchsorted(dates, target, side='left'))
+        hi = start + int(np.searchsorted(dates, target, side='right'))
+        return lo, hi
+
+    def flight_rows(self, flight_number: str, flight_date) -> pd.DataFrame:
+        """All manifest rows for one operating flight on one local departure date"""
+        self.ensure_loaded()
+        if self.df is None:
+            return pd.DataFrame()
+
+        lo, hi = self.flight_range(flight_number, flight_date)
+        rows = self.df.iloc[lo:hi].copy()
+        rows['parsed_date'] = rows['departure_date'].dt.date
+        return rows
+
+    def segment_rows(self, segment: str, flight_date) -> pd.DataFrame:
+        """All manifest rows for every flight operating a segment (e.g. "SIN JFK") on one date"""
+        self.ensure_loaded()
+        if self.df is None:
+            return pd.DataFrame()
+
+        slices = [self.flight_range(flight, flight_date) for flight in self._segment_flights.get(segment, [])]
+        positions = np.concatenate([np.arange(lo, hi) for lo, hi in slices]) if slices else np.empty(0, dtype='int64')
+        rows = self.df.iloc[positions].copy()
+        # A flight can operate more than one segment, so keep only this one
+        rows = rows[rows['segment'] == segment]
+        rows['parsed_date'] = rows['departure_date'].dt.date
+        return rows
@@ -0,0 +1,192 @@
+"""
+Data file versioning.
+
+Every source file in the data directory is fingerprinted by (mtime, size, content hash).
+A background thread polls the fingerprints; when files change, only the indexes built
+from those files are rebuilt (off the request path) and then swapped in together, and
+the data version is bumped. Result caches key on the data version, so nothing computed
+from the old files is served once the new ones are live, and no restart is needed.
+
+The content hash is only recomputed when mtime or size change, and a changed file must
+keep the same mtime and size for two polls in a row before it is picked up (so a file
+still being copied into /data isn't loaded half-written). A file whose rebuild failed
+isn't retried until it changes again.
+"""
+
+import hashlib
+import os
+import threading
+import time
+import traceback
+
+
+def file_fingerprint(path: str, previous: tuple = None):
+    """(mtime_ns, size, content hash) of a file, None if it doesn't exist. The hash is reused
+    from previous when mtime and size are unchanged."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if previous is not None and previous[:2] == (stat.st_mtime_ns, stat.st_size):
+        return previous
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+
+
+class DataVersions:
+    def __init__(self, data_dir: str, indexes: dict, poll_seconds: float = 30.0, on_swap=None):
+        """
+        indexes: {index name: (file names, build, swap)}. build() loads a new index from its files
+            (raising if it can't), swap(index) installs it; only swap runs while the lock is held.
+        poll_seconds: how often the background thread checks the files (0 or None: never)
+        on_swap: called as on_swap(changed files, swapped index names) after a version bump
+        """
+        self.data_dir = data_dir
+        self.indexes = indexes
+        self.poll_seconds = poll_seconds
+        self.on_swap = on_swap
+        self.files = sorted({file_name for files, _, _ in indexes.values() for file_name in files})
+        self.fingerprints = {file_name: file_fingerprint(self._path(file_name)) for file_name in self.files}
+        self.version = self._version_id()
+        self.generation = 0
+        self._pending = {}  # file -> (mtime_ns, size) seen changed on the previous poll
+        self._failed = {}   # file -> fingerprint whose rebuild failed
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.checks = 0
+        self.rebuilds = {name: 0 for name in indexes}
+        self.failures = {name: 0 for name in indexes}
+        self.last_error = None
+        self.last_swap = None
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.data_dir, file_name)
+
+    def _version_id(self) -> str:
+        # Content-based (mtime left out), so every worker computes the same version for the same files
+        content = [(file_name, fingerprint[1:] if fingerprint else None)
+                   for file_name, fingerprint in sorted(self.fingerprints.items())]
+        return hashlib.sha1(repr(content).encode()).hexdigest()[:12]
+
+    def _changed_files(self) -> dict:
+        """{file: new fingerprint} of the files whose content changed and has settled"""
+        changed = {}
+        for file_name in self.files:
+            current = self.fingerprints.get(file_name)
+            try:
+                stat = os.stat(self._path(file_name))
+                quick = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                quick = None
+            if quick == (current[:2] if current else None):
+                self._pending.pop(file_name, None)
+                continue
+            if self._pending.get(file_name, 'unseen') != quick:
+                self._pending[file_name] = quick  # wait one more poll for the file to settle
+                continue
+            self._pending.pop(file_name, None)
+            fingerprint = file_fingerprint(self._path(file_name)) if quick else None
+            if fingerprint is not None and current is not None and fingerprint[1:] == current[1:]:
+                self.fingerprints[file_name] = fingerprint  # touched (or restored), same content
+                self._failed.pop(file_name, None)
+                continue
+            if self._failed.get(file_name) == fingerprint:
+                continue
+            changed[file_name] = fingerprint
+        return changed
+
+    def check(self, force: bool = False) -> list:
+        """
+        Rebuild and swap the indexes whose files changed; returns the swapped index names.
+        force skips the settle poll (e.g. an explicit reload request).
+        """
+        with self._check_lock:
+            self.checks += 1
+            if force:
+                for file_name in self.files:
+                    try:
+                        stat = os.stat(self._path(file_name))
+                        self._pending[file_name] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        self._pending[file_name] = None
+            changed = self._changed_files()
+            if not changed:
+                return []
+
+            affected = [name for name, (files, _, _) in self.indexes.items() if changed.keys() & set(files)]
+            print(f"🔄 DataVersions.check() ----------- Changed: {sorted(changed)}, rebuilding: {affected}")
+            built = {}
+            for name in affected:
+                files, build, _ = self.indexes[name]
+                try:
+                    built[name] = build()
+                    self.rebuilds[name] += 1
+                except Exception as e:
+                    print(f"❌ DataVersions.check() ----------- Rebuilding {name} failed, keeping the current one: {e}")
+                    traceback.print_exc()
+                    self.failures[name] += 1
+                    self.last_error = f"{name}: {e}"
+                    for file_name in files:
+                        if file_name in changed:
+                            self._failed[file_name] = changed.pop(file_name)
+            if not built:
+                return []
+
+            # Swap every rebuilt index and bump the version in one step
+            with self._lock:
+                for name, index in built.items():
+                    self.indexes[name][2](index)
+                for file_name, fingerprint in changed.items():
+                    self.fingerprints[file_name] = fingerprint
+                    self._failed.pop(file_name, None)
+                self.version = self._version_id()
+                self.generation += 1
+                self.last_swap = time.time()
+            print(f"✅ DataVersions.check() ----------- Swapped {sorted(built)}, data version {self.version}")
+            if self.on_swap is not None:
+                self.on_swap(sorted(changed), sorted(built))
+            return sorted(built)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"❌ DataVersions._run() ----------- {e}")
+                traceback.print_exc()
+
+    def start(self):
+        """Start polling in a daemon thread (no-op if polling is disabled or already running)"""
+        if not self.poll_seconds or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='data-versions', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "generation": self.generation,
+            "poll_seconds": self.poll_seconds,
+            "polling": self._thread is not None and self._thread.is_alive(),
+            "files": {file_name: ({"mtime_ns": fp[0], "size": fp[1], "hash": fp[2]} if fp else None)
+                      for file_name, fp in self.fingerprints.items()},
+            "pending": sorted(self._pending),
+            "failed": sorted(self._failed),
+            "checks": self.checks,
+            "rebuilds": self.rebuilds,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_swap": self.last_swap,
+        }
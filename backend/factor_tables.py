@@ -0,0 +1,160 @@
+"""
+Factor probability tables (Nationality / Age / Destination / MealTime).
+
+Each table keeps its protein columns as one [rows x proteins] matrix. A meal only serves
+some proteins, so every row has to be renormalized over that meal's available proteins
+before it can be blended. There are at most 63 availability patterns, so the renormalized
+table for a pattern is computed on first use and kept, keyed by (table version, pattern).
+Looking up factor probabilities for a batch of passenger groups is then an array gather.
+"""
+
+import itertools
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from scoring import PROTEINS, restrict
+
+# Every table (and every reload of a table) gets a new version, so cached
+# restricted tables can never be mixed up between versions
+_TABLE_VERSIONS = itertools.count(1)
+
+
+class FactorTable:
+    def __init__(self, df: pd.DataFrame, keys: list, keep: str = 'last'):
+        """
+        df: the factor CSV rows (protein columns Pork..Vegetarian)
+        keys: lookup key of every row, e.g. "CN_Monday" or ("CN", "Monday")
+        keep: which row wins when a key repeats ('last' like a dict built row by row, or 'first')
+        """
+        self.df = df.reset_index(drop=True)
+        self.keys = list(keys)
+        self.version = next(_TABLE_VERSIONS)
+        # One extra all-zero row at the end: position -1 (key not found) gathers it,
+        # and restricting a zero row gives an equal split over the available proteins
+        values = self.df[PROTEINS].to_numpy(dtype=float) if len(self.df) else np.empty((0, len(PROTEINS)))
+        self.raw = np.vstack([values, np.zeros((1, len(PROTEINS)))])
+
+        ordered = enumerate(self.keys) if keep == 'last' else reversed(list(enumerate(self.keys)))
+        self._positions = {key: pos for pos, key in ordered}
+        self._restricted = {}
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled (e.g. when sent to worker processes)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    def position(self, key) -> int:
+        """Row position of a key (-1 if not found)"""
+        return self._positions.get(key, -1)
+
+    def positions(self, keys) -> np.ndarray:
+        """Row positions of many keys (-1 where not found)"""
+        return np.array([self._positions.get(key, -1) for key in keys], dtype=np.int64)
+
+    def restricted(self, pattern) -> np.ndarray:
+        """
+        Every row renormalized over one availability pattern (protein column indices in the
+        order the caller sums them, -1 padding ignored). Computed once per (version, pattern).
+        """
+        cols = tuple(int(col) for col in pattern if col >= 0)
+        cache_key = (self.version, cols)
+        table = self._restricted.get(cache_key)
+        if table is None:
+            slots = np.tile(np.array(cols, dtype=np.int64), (len(self.raw), 1))
+            table = restrict(self.raw, slots)
+            table.setflags(write=False)
+            with self._lock:
+                self._restricted[cache_key] = table
+        return table
+
+    def normalized_records(self, pattern) -> list:
+        """
+        Every row as a record (all CSV columns) with the protein columns normalized over one
+        availability pattern the way the master metrics screen shows them: rows whose available
+        proteins sum to more than 0 are divided by that sum, others are left as they are, and
+        unavailable proteins are 0. Built once per (version, pattern); the records are shared,
+        so callers must not modify them.
+        """
+        cols = tuple(int(col) for col in pattern if col >= 0)
+        cache_key = (self.version, cols)
+        records = self._records.get(cache_key)
+        if records is None:
+            values = self.raw[:len(self.df)]
+            total = np.zeros(len(values))
+            for col in cols:  # summed in pattern order
+                total += values[:, col]
+            mask = np.zeros(len(PROTEINS), dtype=bool)
+            mask[list(cols)] = True
+            safe_total = np.where(total > 0, total, 1.0)
+            normalized = np.where(total[:, None] > 0, values / safe_total[:, None], values)
+            normalized = np.where(mask, normalized, 0.0)
+
+            df = self.df.copy()
+            df[PROTEINS] = normalized
+            records = df.to_dict('records')
+            with self._lock:
+                self._records[cache_key] = records
+        return records
+
+    def gather(self, positions: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        """
+        Restricted probabilities for a batch of groups: row positions[i] of the table restricted
+        to slots[i]. Groups whose key was not found (-1) get an equal split.
+        """
+        out = np.zeros((len(positions), len(PROTEINS)))
+        if len(positions) == 0:
+            return out
+        patterns, inverse = np.unique(slots, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for p, pattern in enumerate(patterns):
+            rows = inverse == p
+            out[rows] = self.restricted(pattern)[positions[rows]]
+        return out
+
+
+# Factor CSVs in DATA_DIR and how their rows are keyed (same keys as the API's CSV defaults)
+FACTOR_FILES = {
+    'nationality': 'Nationality.csv',
+    'age': 'Age.csv',
+    'destination': 'Destination.csv',
+    'mealtime': 'MealTime.csv',
+}
+
+
+def _factor_keys(metric: str, df: pd.DataFrame) -> list:
+    if metric == 'nationality':
+        return [f"{code}_{day}" for code, day in zip(df['nationality_code'], df['day_of_week'])]
+    column = {'age': 'age_group', 'destination': 'destination_region', 'mealtime': 'meal_time'}[metric]
+    return df[column].tolist()
+
+
+def load_factor_tables(data_dir: str) -> dict:
+    """{metric: FactorTable} for every factor CSV found in data_dir (missing files are skipped)"""
+    tables = {}
+    for metric, file_name in FACTOR_FILES.items():
+        path = os.path.join(data_dir, file_name)
+        if os.path.exists(path):
+            df = pd.read_csv(path)
+            tables[metric] = FactorTable(df, _factor_keys(metric, df))
+    return tables
+
+
+def airport_regions(tables: dict) -> dict:
+    """{airport_code: destination_region} from the Destination table (last row wins)"""
+    destination = tables.get('destination')
+    if destination is None:
+        return {}
+    return dict(zip(destination.df['airport_code'], destination.df['destination_region']))
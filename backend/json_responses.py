@@ -0,0 +1,70 @@
+"""
+Fast, cacheable JSON responses for the large read-mostly endpoints.
+
+Bodies are encoded with orjson when it is installed (the standard json module otherwise),
+skipping FastAPI's jsonable_encoder pass over big nested dicts. GET responses carry an
+ETag computed from the encoded body, and a request whose If-None-Match matches it gets
+an empty 304 instead of the body. Compression is done by GZipMiddleware (see main.py).
+"""
+
+import hashlib
+import json
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    # numpy/pandas scalars and anything else FastAPI knows how to encode
+    if hasattr(value, 'item'):
+        return value.item()
+    return jsonable_encoder(value)
+
+
+def dumps(content) -> bytes:
+    """Content as compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+
+def body_etag(body: bytes) -> str:
+    """Weak ETag of an encoded body (weak, so it stays valid once the body is gzipped)"""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """True if an If-None-Match header lists etag (weak comparison) or is *"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in tags]
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def cached_json_response(request: Request, content, cache_control: str = 'no-cache') -> Response:
+    """
+    JSON response with an ETag; 304 Not Modified if the client already has this body.
+    'no-cache' lets clients keep the body but revalidate it on every use.
+    """
+    body = dumps(content)
+    etag = body_etag(body)
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
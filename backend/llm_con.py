@@ -1,8 +1,11 @@
+import httpx
 import requests
 import os
 
 # AWS Bedrock Configuration
 LLM_API_URL = os.getenv("BEDROCK_BASE_URL")
+# Converse calls can take a while; httpx's 5 s default is too short
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
 
 #CallLLM Class for getting responses from LLMs using API
 class CallLLM:
@@ -16,6 +19,94 @@ class CallLLM:
         self.llm_model = DEFAULT_MODEL
         self.user_token = user_token
 
+    def converse_request(self, body, user_token=None):
+        """
+        Bedrock converse request for an OpenAI-style body
+
+        Returns:
+            (api_url, request_headers, bedrock_body)
+        """
+        # Extract model from body (check both 'engine' and 'model' keys)
+        model = body.get('engine') or body.get('model', self.llm_model)
+        
+        # Extract messages from body
+        messages = body.get('messages', [])
+        
+        # Convert messages to Bedrock format if needed
+        bedrock_messages = []
+        system_message = None
+        
+        for msg in messages:
+            # Handle system messages separately (Bedrock doesn't support system role in messages)
+            if msg.get("role") == "system":
+                if isinstance(msg.get("content"), str):
+                    system_message = msg["content"]
+                elif isinstance(msg.get("content"), list):
+                    system_message = msg["content"][0].get("text", "")
+                continue
+            
+            # Only process user and assistant messages
+            if msg.get("role") not in ["user", "assistant"]:
+                continue
+                
+            if isinstance(msg.get("content"), str):
+                # Convert string content to Bedrock format
+                bedrock_msg = {
+                    "role": msg["role"],
+                    "content": [{"text": msg["content"]}]
+                }
+            else:
+                # Assume it's already in correct format or handle list format
+                if isinstance(msg.get("content"), list):
+                    bedrock_msg = msg
+                else:
+                    bedrock_msg = {
+                        "role": msg["role"],
+                        "content": [{"text": str(msg.get("content", ""))}]
+                    }
+            bedrock_messages.append(bedrock_msg)
+        
+        # Build the API URL
+        api_url = f"{self.base_url}/model/{model}/converse"
+        
+        # Prepare headers
+        token = user_token or self.user_token
+        request_headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}"
+        }
+        
+        # Prepare the request body for Bedrock
+        bedrock_body = {
+            "messages": bedrock_messages
+        }
+        
+        # Add system message if present (as system parameter in Bedrock)
+        if system_message:
+            bedrock_body["system"] = [{"text": system_message}]
+        
+        # Add temperature if present in original body
+        if 'temperature' in body:
+            bedrock_body['inferenceConfig'] = {
+                'temperature': body['temperature']
+            }
+        
+        return api_url, request_headers, bedrock_body
+
+    @staticmethod
+    def response_text(response):
+        """Text of a converse response (requests or httpx), raises if the call failed"""
+        if response.status_code == 200:
+            try:
+                res = response.json()
+                # Extract content from Bedrock response format
+                return res["output"]["message"]["content"][0]["text"]
+                    
+            except Exception as e:
+                return f"Error parsing response: {str(e)}"
+        else:
+            raise Exception(f"API call failed with status {response.status_code}: {response.text}")
+
     def call_llm(self, body, headers=None, user_token=None):
         """
         Call LLM API
@@ -29,88 +120,28 @@ class CallLLM:
             Response content from the LLM
         """
         try:
-            # Extract model from body (check both 'engine' and 'model' keys)
-            model = body.get('engine') or body.get('model', self.llm_model)
-            
-            # Extract messages from body
-            messages = body.get('messages', [])
-            
-            # Convert messages to Bedrock format if needed
-            bedrock_messages = []
-            system_message = None
-            
-            for msg in messages:
-                # Handle system messages separately (Bedrock doesn't support system role in messages)
-                if msg.get("role") == "system":
-                    if isinstance(msg.get("content"), str):
-                        system_message = msg["content"]
-                    elif isinstance(msg.get("content"), list):
-                        system_message = msg["content"][0].get("text", "")
-                    continue
-                
-                # Only process user and assistant messages
-                if msg.get("role") not in ["user", "assistant"]:
-                    continue
-                    
-                if isinstance(msg.get("content"), str):
-                    # Convert string content to Bedrock format
-                    bedrock_msg = {
-                        "role": msg["role"],
-                        "content": [{"text": msg["content"]}]
-                    }
-                else:
-                    # Assume it's already in correct format or handle list format
-                    if isinstance(msg.get("content"), list):
-                        bedrock_msg = msg
-                    else:
-                        bedrock_msg = {
-                            "role": msg["role"],
-                            "content": [{"text": str(msg.get("content", ""))}]
-                        }
-                bedrock_messages.append(bedrock_msg)
-            
-            # Build the API URL
-            api_url = f"{self.base_url}/model/{model}/converse"
-            
-            # Prepare headers
-            token = user_token or self.user_token
-            request_headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-            
-            # Prepare the request body for Bedrock
-            bedrock_body = {
-                "messages": bedrock_messages
-            }
-            
-            # Add system message if present (as system parameter in Bedrock)
-            if system_message:
-                bedrock_body["system"] = [{"text": system_message}]
-            
-            # Add temperature if present in original body
-            if 'temperature' in body:
-                bedrock_body['inferenceConfig'] = {
-                    'temperature': body['temperature']
-                }
-            
+            api_url, request_headers, bedrock_body = self.converse_request(body, user_token)
             response = requests.post(
                 url=api_url,
                 headers=request_headers,
                 json=bedrock_body,
                 verify=False,
             )
+            return self.response_text(response)
+                
+        except Exception as e:
+            return f"Error calling Bedrock API: {str(e)}"
 
-            if response.status_code == 200:
-                try:
-                    res = response.json()
-                    # Extract content from Bedrock response format
-                    return res["output"]["message"]["content"][0]["text"]
-                        
-                except Exception as e:
-                    return f"Error parsing response: {str(e)}"
-            else:
-                raise Exception(f"API call failed with status {response.status_code}: {response.text}")
+    async def acall_llm(self, body, headers=None, user_token=None):
+        """
+        Same as call_llm, but awaits the HTTP call (for async endpoints: the event loop keeps
+        serving other requests while the LLM answers)
+        """
+        try:
+            api_url, request_headers, bedrock_body = self.converse_request(body, user_token)
+            async with httpx.AsyncClient(verify=False, timeout=LLM_TIMEOUT_SECONDS) as client:
+                response = await client.post(api_url, headers=request_headers, json=bedrock_body)
+            return self.response_text(response)
                 
         except Exception as e:
             return f"Error calling Bedrock API: {str(e)}"
@@ -156,17 +187,7 @@ class CallLLM:
                 json=body,
                 verify=False,
             )
-
-            if response.status_code == 200:
-                try:
-                    res = response.json()
-                    # Extract content from Bedrock response format
-                    return res["output"]["message"]["content"][0]["text"]
-                        
-                except Exception as e:
-                    return f"Error parsing response: {str(e)}"
-            else:
-                raise Exception(f"API call failed with status {response.status_code}: {response.text}")
+            return self.response_text(response)
                 
         except Exception as e:
             return f"Error calling Bedrock API: {str(e)}"
@@ -1,18 +1,49 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, List, Optional
 import pandas as pd
+import numpy as np
 import os
 import asyncio
+import hashlib
+import json
 from datetime import datetime
 from dotenv import load_dotenv
-from ai_summary import router as ai_summary_router, call_bedrock_llm, PassengerGroup, TopNationality
+from contextlib import asynccontextmanager
+from ai_summary import router as ai_summary_router, call_bedrock_llm, AISummaryUnavailable, PassengerGroup, TopNationality
+from customer_store import CustomerStore
+from data_versions import DataVersions
+from meal_catalog import MealCatalog
+from factor_tables import load_factor_tables, airport_regions
+from coalescing import SingleFlight, coalescing_stats
+from compute_pool import ComputePool
+from batch_prediction import predict_network, iter_csv, to_parquet_bytes, parquet_available, OUTPUT_FORMATS as BATCH_OUTPUT_FORMATS
+from json_responses import FastJSONResponse, cached_json_response
+from result_cache import ResultCache, cache_stats
+from scoring import PROTEINS, PROTEIN_INDEX, protein_slots, probability_matrix, availability_mask
+from session_prediction import SessionPrediction
+from session_manager import SessionManager, SharedSessionStore
+from session_rows import SessionRows, MODIFIED_TOLERANCE, scoped_positions, session_state, restore_session
+from state_backend import create_backend
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="Airline Meal Prediction API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the passenger manifest and meal catalog once at startup so requests never re-read the CSVs
+    CUSTOMER_STORE.ensure_loaded()
+    MEAL_CATALOG.ensure_loaded()
+    # Reload them (and the factor tables) in the background whenever their files change
+    DATA_VERSIONS.start()
+    yield
+    DATA_VERSIONS.stop()
+    COMPUTE_POOL.shutdown()
+
+app = FastAPI(title="Airline Meal Prediction API", lifespan=lifespan)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -23,46 +54,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses above GZIP_MINIMUM_SIZE bytes (flights, master metrics and predictions
+# are hundreds of KB of JSON; outstation terminals are on slow links)
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=int(os.getenv('GZIP_MINIMUM_SIZE', '1024')),
+    compresslevel=int(os.getenv('GZIP_LEVEL', '6')),
+)
+
 # Include the AI summary router
 app.include_router(ai_summary_router)
 
-# In-memory cache for CSV default probabilities (loaded once per server start)
+# Shared state backend (STATE_BACKEND_URL: memory://, sqlite:///path or redis://host:port/db).
+# Anything other than memory:// lets uvicorn run several workers with the same sessions and caches.
+STATE_BACKEND = create_backend()
+
+# In-memory cache for CSV default probabilities (loaded once, rebuilt and swapped in
+# by DATA_VERSIONS when a factor CSV changes)
+# Kept per worker: it is read-only, built from the CSVs and holds the factor table arrays
 CSV_DEFAULTS_CACHE = {
     'nationality': None,
     'age': None,
     'destination': None,
     'mealtime': None,
+    'tables': {},
     'loaded': False
 }
 
-# In-memory cache for flights data (loaded once per server start)
-FLIGHTS_CACHE = {
-    'flights': None,
-    'categories': None,
-    'loaded': False,
-    'error': None
-}
-
-# In-memory cache for customer summary (keyed by flight_number|flight_date)
-CUSTOMER_SUMMARY_CACHE = {}
-
-# In-memory cache for available meals (keyed by flight_number|flight_date)
-AVAILABLE_MEALS_CACHE = {}
-
 def load_csv_defaults_once():
-    """Load CSV defaults into memory cache (only once per server session)"""
+    """Load CSV defaults into memory cache (only once per server session, until the CSVs change)"""
+    global CSV_DEFAULTS_CACHE
     if CSV_DEFAULTS_CACHE['loaded']:
         print("✅ load_csv_defaults_once()---------- Using cached CSV defaults from memory")
         return CSV_DEFAULTS_CACHE
     
     print("📂load_csv_defaults_once()----------- Loading CSV defaults into memory cache (one-time operation)...")
+    CSV_DEFAULTS_CACHE = build_csv_defaults()
+    print("✅ CSV defaults cached in memory\n")
+    return CSV_DEFAULTS_CACHE
+
+def build_csv_defaults() -> dict:
+    """CSV default probabilities, reasoning and factor tables read from the factor CSVs"""
+    
+    # Factor tables (restricted probabilities per protein availability, filled lazily)
+    factor_tables = load_factor_tables(DATA_DIR)
     
     # Load Nationality CSV
     csv_nationality_probs = {}
     csv_nationality_reasoning = {}
-    nationality_file = os.path.join(DATA_DIR, 'Nationality.csv')
-    if os.path.exists(nationality_file):
-        nat_df = pd.read_csv(nationality_file)
+    csv_nationality_sources = {}
+    if 'nationality' in factor_tables:
+        nat_df = factor_tables['nationality'].df
         for _, row in nat_df.iterrows():
             key = f"{row['nationality_code']}_{row['day_of_week']}"
             csv_nationality_probs[key] = {
@@ -76,14 +118,16 @@ def load_csv_defaults_once():
             # Store reasoning if available
             if 'reasoning' in row and pd.notna(row['reasoning']):
                 csv_nationality_reasoning[key] = str(row['reasoning'])
+            # Sources of the first row for a key (shown with the top nationalities)
+            if key not in csv_nationality_sources:
+                csv_nationality_sources[key] = str(row['sources']) if 'sources' in row and pd.notna(row['sources']) else ""
         print(f"load_csv_defaults_once()--------  ✓ Loaded {len(csv_nationality_probs)} nationality defaults")
     
     # Load Age CSV
     csv_age_probs = {}
     csv_age_reasoning = {}
-    age_file = os.path.join(DATA_DIR, 'Age.csv')
-    if os.path.exists(age_file):
-        age_df = pd.read_csv(age_file)
+    if 'age' in factor_tables:
+        age_df = factor_tables['age'].df
         for _, row in age_df.iterrows():
             age_group = row['age_group']
             csv_age_probs[age_group] = {
@@ -102,9 +146,8 @@ def load_csv_defaults_once():
     # Load Destination CSV
     csv_destination_probs = {}
     csv_destination_reasoning = {}
-    destination_file = os.path.join(DATA_DIR, 'Destination.csv')
-    if os.path.exists(destination_file):
-        dest_df = pd.read_csv(destination_file)
+    if 'destination' in factor_tables:
+        dest_df = factor_tables['destination'].df
         for _, row in dest_df.iterrows():
             dest_region = row['destination_region']
             csv_destination_probs[dest_region] = {
@@ -123,9 +166,8 @@ def load_csv_defaults_once():
     # Load MealTime CSV
     csv_mealtime_probs = {}
     csv_mealtime_reasoning = {}
-    mealtime_file = os.path.join(DATA_DIR, 'MealTime.csv')
-    if os.path.exists(mealtime_file):
-        meal_df = pd.read_csv(mealtime_file)
+    if 'mealtime' in factor_tables:
+        meal_df = factor_tables['mealtime'].df
         for _, row in meal_df.iterrows():
             meal_time = row['meal_time']
             csv_mealtime_probs[meal_time] = {
@@ -141,19 +183,19 @@ def load_csv_defaults_once():
                 csv_mealtime_reasoning[meal_time] = str(row['reasoning'])
         print(f"load_csv_defaults_once() -----------  ✓ Loaded {len(csv_mealtime_probs)} mealtime defaults")
     
-    # Store in cache
-    CSV_DEFAULTS_CACHE['nationality'] = csv_nationality_probs
-    CSV_DEFAULTS_CACHE['age'] = csv_age_probs
-    CSV_DEFAULTS_CACHE['destination'] = csv_destination_probs
-    CSV_DEFAULTS_CACHE['mealtime'] = csv_mealtime_probs
-    CSV_DEFAULTS_CACHE['nationality_reasoning'] = csv_nationality_reasoning
-    CSV_DEFAULTS_CACHE['age_reasoning'] = csv_age_reasoning
-    CSV_DEFAULTS_CACHE['destination_reasoning'] = csv_destination_reasoning
-    CSV_DEFAULTS_CACHE['mealtime_reasoning'] = csv_mealtime_reasoning
-    CSV_DEFAULTS_CACHE['loaded'] = True
-    
-    print("✅ CSV defaults cached in memory\n")
-    return CSV_DEFAULTS_CACHE
+    return {
+        'nationality': csv_nationality_probs,
+        'age': csv_age_probs,
+        'destination': csv_destination_probs,
+        'mealtime': csv_mealtime_probs,
+        'nationality_reasoning': csv_nationality_reasoning,
+        'nationality_sources': csv_nationality_sources,
+        'age_reasoning': csv_age_reasoning,
+        'destination_reasoning': csv_destination_reasoning,
+        'mealtime_reasoning': csv_mealtime_reasoning,
+        'tables': factor_tables,
+        'loaded': True,
+    }
 
 # Data directory
 # Check if running in Docker by looking for /data directory
@@ -182,44 +224,206 @@ for csv_file in ['customers.csv', 'meal_df_new.csv', 'Age.csv', 'Destination.csv
     print(f"  {'✅' if exists else '❌'} {csv_file}: {full_path}")
 print(f"{'='*60}\n")
 
+# Resident passenger manifest shared by every endpoint (loaded once at startup)
+CUSTOMER_STORE = CustomerStore(os.path.join(DATA_DIR, 'customers.csv'))
+
+# Shared meal catalog indexed by (segment, date, cabin_class, meal_time) (loaded once at startup)
+MEAL_CATALOG = MealCatalog(os.path.join(DATA_DIR, 'meal_df_new.csv'))
+
 
 # TEMPORARY SESSION MEMORY - Cache for current flight+date session only
-# This is NOT persistent storage - it gets cleared when user returns to flight selection
-# Structure: {session_key: {metric_type: {row_key: {probabilities, marker, default_probabilities}}}}
+# This is NOT persistent storage - a session is cleared when its user returns to flight selection,
+# expires after SESSION_TTL_SECONDS idle, or is evicted (least recently used) above the caps
+# Structure: {session_key: {flight fields, metric_type: SessionRows, 'prediction': SessionPrediction}}
 # session_key format: "flight_number|flight_date"
-SESSION_MEMORY = {}
+# With a shared state backend sessions live there (TTL enforced by the backend) and each
+# worker keeps the ones it uses loaded. Every session init/edit gets a new version number
+# (SESSION_MEMORY.next_version(), part of the prediction cache key) and runs holding
+# SESSION_MEMORY.lock(session_key), so concurrent edits on different workers don't overwrite each other.
+def remove_session_predictions(key, session):
+    # Cached predictions of a removed session can't be requested again
+    invalidate_predictions(session['flight_number'], session['flight_date'])
+
+if STATE_BACKEND.shared:
+    SESSION_MEMORY = SharedSessionStore(
+        STATE_BACKEND,
+        hydrate=lambda state: restore_session(state, load_csv_defaults_once()['tables']),
+        dehydrate=session_state,
+        ttl_seconds=float(os.getenv('SESSION_TTL_SECONDS', '7200')),
+        max_local=int(os.getenv('SESSION_MAX_ENTRIES', '500')),
+        on_remove=remove_session_predictions,
+        lock_timeout_seconds=float(os.getenv('SESSION_LOCK_TIMEOUT_SECONDS', '30')),
+    )
+else:
+    SESSION_MEMORY = SessionManager(
+        ttl_seconds=float(os.getenv('SESSION_TTL_SECONDS', '7200')),
+        max_entries=int(os.getenv('SESSION_MAX_ENTRIES', '500')),
+        max_bytes=int(os.getenv('SESSION_MAX_MB', '256')) * 1024 * 1024,
+        on_remove=remove_session_predictions,
+    )
+
+# Cached /api/predict results (LRU, bounded by entry count and approximate size), shared by the
+# workers when the state backend is (session versions in the key are unique across workers)
+PREDICTION_CACHE = ResultCache(
+    'predict',
+    max_entries=int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', '128')),
+    max_bytes=int(os.getenv('PREDICTION_CACHE_MAX_MB', '64')) * 1024 * 1024,
+    ttl_seconds=float(os.getenv('PREDICTION_CACHE_TTL_SECONDS', '3600')),
+    backend=STATE_BACKEND if STATE_BACKEND.shared else None,
+)
+
+# Identical concurrent requests (same endpoint and normalized parameters) attach to the one
+# already being computed and share its result, e.g. when a briefing opens the same flight at once
+PREDICT_FLIGHTS = SingleFlight('predict')
+INITIALIZE_SESSION_FLIGHTS = SingleFlight('initialize_session')
+
+def coalescing_key(*parts) -> str:
+    """Normalized, hashable key of request parameters (dict keys sorted)"""
+    return json.dumps(parts, sort_keys=True, default=str)
+
+# The pandas/numpy work of the async endpoints runs on COMPUTE_WORKERS threads instead of the
+# event loop, so a slow prediction doesn't stall other requests. Each endpoint runs at most
+# its *_CONCURRENCY requests at once (the rest queue); predictions get half the workers by
+# default, so session edits always have room.
+COMPUTE_WORKERS = int(os.getenv('COMPUTE_WORKERS', str(min(4, os.cpu_count() or 1))))
+COMPUTE_POOL = ComputePool(
+    COMPUTE_WORKERS,
+    limits={
+        'predict': int(os.getenv('PREDICT_CONCURRENCY', str(max(1, COMPUTE_WORKERS // 2)))),
+        'initialize_session': int(os.getenv('INITIALIZE_SESSION_CONCURRENCY', str(COMPUTE_WORKERS))),
+        'update_session': int(os.getenv('UPDATE_SESSION_CONCURRENCY', str(COMPUTE_WORKERS))),
+        'save_custom_metrics': int(os.getenv('SAVE_CUSTOM_METRICS_CONCURRENCY', '1')),
+        'get_modified_rows': int(os.getenv('GET_MODIFIED_ROWS_CONCURRENCY', str(COMPUTE_WORKERS))),
+    },
+)
+
+IMPORTANCE_DEFAULTS = {
+    'nationality_importance': 40.0,
+    'age_importance': 20.0,
+    'destination_importance': 25.0,
+    'mealtime_importance': 15.0,
+}
+
+# Data file versioning: the files every resident index is built from. When a file changes,
+# DATA_VERSIONS rebuilds only the indexes that use it in the background, swaps them in and
+# bumps DATA_VERSIONS.version, which the result caches are keyed on.
+def build_customer_store() -> CustomerStore:
+    store = CustomerStore(os.path.join(DATA_DIR, 'customers.csv')).load()
+    if store.df is None:
+        raise RuntimeError(store.error)
+    return store
+
+def swap_customer_store(store: CustomerStore):
+    global CUSTOMER_STORE
+    CUSTOMER_STORE = store
 
-def clear_session_memory():
-    """Clear all session memory (called when returning to flight selection page)"""
-    global SESSION_MEMORY
-    SESSION_MEMORY = {}
-    print("🗑️  Session memory cleared")
+def build_meal_catalog() -> MealCatalog:
+    catalog = MealCatalog(os.path.join(DATA_DIR, 'meal_df_new.csv')).load()
+    if catalog.df is None:
+        raise RuntimeError(catalog.error)
+    return catalog
 
-def normalize_probabilities_for_proteins(row_dict: dict, available_proteins: list) -> dict:
+def swap_meal_catalog(catalog: MealCatalog):
+    global MEAL_CATALOG
+    MEAL_CATALOG = catalog
+
+def build_factor_defaults() -> dict:
+    print("📂 build_factor_defaults() ----------- Rebuilding CSV defaults and factor tables...")
+    return build_csv_defaults()
+
+def swap_factor_defaults(defaults: dict):
+    global CSV_DEFAULTS_CACHE
+    CSV_DEFAULTS_CACHE = defaults
+
+def on_data_swap(changed_files: list, indexes: list):
     """
-    Normalize probabilities to sum to 1.0 for only the available proteins.
-    Returns normalized probabilities for available proteins only.
+    After new data is swapped in: drop results computed from the old data and re-attach sessions.
+    Each session is rebuilt as a new object under its lock and swapped in, so an edit or
+    prediction never sees a half-refreshed session (one already reading keeps the old object).
     """
-    protein_columns = ['Pork', 'Chicken', 'Beef', 'Seafood', 'Lamb', 'Vegetarian']
-    
-    # Extract probabilities for available proteins
-    available_probs = {}
-    total = 0.0
-    for protein in available_proteins:
-        if protein in protein_columns:
-            prob = float(row_dict.get(protein, 0))
-            available_probs[protein] = prob
-            total += prob
-    
-    # Normalize to sum to 1.0
-    if total > 0:
-        normalized = {protein: prob/total for protein, prob in available_probs.items()}
+    dropped = PREDICTION_CACHE.invalidate() + AVAILABLE_MEALS_CACHE.invalidate()
+    factors_changed = 'factor_tables' in indexes
+    tables = load_csv_defaults_once()['tables']
+    refreshed_count = 0
+    for key, session in SESSION_MEMORY.loaded_sessions():
+        try:
+            with SESSION_MEMORY.lock(key):
+                # Scored groups come from the old manifest/meals/tables; rebuilt on next use
+                refreshed = {name: value for name, value in session.items() if name != 'prediction'}
+                if factors_changed:
+                    # Keep the user's edits, on top of the new defaults
+                    restored = restore_session(session_state(session), tables)
+                    for metric in SCORING_METRICS:
+                        refreshed[metric] = restored[metric]
+                # Not swapped if the session was re-initialized or re-loaded meanwhile (already on the new data)
+                refreshed_count += SESSION_MEMORY.replace(key, session, refreshed)
+        except TimeoutError:
+            print(f"⚠️  on_data_swap() ----------- {key} is locked, not refreshed")
+    print(f"✅ on_data_swap() ----------- {changed_files} changed: dropped {dropped} cached results, "
+          f"refreshed {refreshed_count} loaded sessions")
+
+DATA_VERSIONS = DataVersions(
+    DATA_DIR,
+    {
+        'customer_store': (['customers.csv'], build_customer_store, swap_customer_store),
+        'meal_catalog': (['meal_df_new.csv'], build_meal_catalog, swap_meal_catalog),
+        'factor_tables': (['Nationality.csv', 'Age.csv', 'Destination.csv', 'MealTime.csv'],
+                          build_factor_defaults, swap_factor_defaults),
+    },
+    poll_seconds=float(os.getenv('DATA_POLL_SECONDS', '30')),
+    on_swap=on_data_swap,
+)
+
+SHARED_CACHE_TTL = float(os.getenv('SHARED_CACHE_TTL_SECONDS', '86400'))
+# Error results ({"error": ...}) are only cached briefly, so a fixed data problem shows up quickly
+ERROR_CACHE_TTL = float(os.getenv('ERROR_CACHE_TTL_SECONDS', '30'))
+
+# Cache for available meals (keyed by data version|flight_number|flight_date), shared by the workers
+# when the state backend is
+AVAILABLE_MEALS_CACHE = ResultCache(
+    'available_meals',
+    max_entries=int(os.getenv('AVAILABLE_MEALS_CACHE_MAX_ENTRIES', '1024')),
+    max_bytes=int(os.getenv('AVAILABLE_MEALS_CACHE_MAX_MB', '16')) * 1024 * 1024,
+    ttl_seconds=SHARED_CACHE_TTL,
+    error_ttl_seconds=ERROR_CACHE_TTL,
+    backend=STATE_BACKEND if STATE_BACKEND.shared else None,
+)
+
+def prediction_cache_key(flight_number: str, flight_date: str, master_metrics: dict) -> tuple:
+    """
+    Fingerprint of everything a prediction depends on: flight, date, importance weights,
+    session version (None without a session), data version and any other request metrics.
+    """
+    weights = tuple(float(master_metrics.get(name, default)) for name, default in IMPORTANCE_DEFAULTS.items())
+    other_metrics = {k: v for k, v in master_metrics.items() if k not in IMPORTANCE_DEFAULTS}
+    metrics_hash = hashlib.sha1(json.dumps(other_metrics, sort_keys=True, default=str).encode()).hexdigest()
+    session = SESSION_MEMORY.get(f"{flight_number}|{flight_date}")
+    session_version = session.get('version') if session else None
+    return (flight_number, flight_date, weights, session_version, DATA_VERSIONS.version, metrics_hash)
+
+def invalidate_predictions(flight_number: str = None, flight_date: str = None) -> int:
+    """Drop cached predictions for one flight+date (or every session-based prediction if not given)"""
+    if flight_number is None:
+        return PREDICTION_CACHE.invalidate(lambda key: key[3] is not None)
+    return PREDICTION_CACHE.invalidate(lambda key: key[0] == flight_number and key[1] == flight_date)
+
+def locked_session_call(session_key: str, payload, request: dict) -> dict:
+    """payload(request) holding the session's lock (serializes a session's init and edits across workers)"""
+    try:
+        with SESSION_MEMORY.lock(session_key or ''):
+            return payload(request)
+    except TimeoutError:
+        raise HTTPException(status_code=409, detail="Session is being changed by another request. Please retry.")
+
+def clear_session_memory(session_key: Optional[str] = None) -> int:
+    """Clear one session (called when returning to flight selection page), or all sessions if no key"""
+    if session_key:
+        cleared = int(SESSION_MEMORY.pop(session_key))
+        print(f"🗑️  Session memory cleared for {session_key}" if cleared else f"🗑️  No session to clear for {session_key}")
     else:
-        # Equal distribution if all are zero
-        equal_prob = 1.0 / len(available_proteins)
-        normalized = {protein: equal_prob for protein in available_proteins}
-    
-    return normalized
+        cleared = SESSION_MEMORY.clear()
+        print(f"🗑️  Session memory cleared ({cleared} sessions)")
+    return cleared
 
 # Load prediction results for comparison
 def load_prediction_results(segment, date, cabin_class, meal_time):
@@ -304,257 +508,312 @@ class PredictionResult(BaseModel):
 # Default master metrics
 default_metrics = MasterMetrics()
 
+# Metric order of the weighted model (W1..W4)
+SCORING_METRICS = ['nationality', 'age', 'destination', 'mealtime']
+
+def flight_prediction_context(flight_number: str, flight_date: str) -> Optional[dict]:
+    """
+    Passengers and meals scored for a flight+date: Under 2 removed, cabin S on SIN JFK and
+    Y elsewhere, destination region from the segment. None if no passengers remain.
+    """
+    target_date = pd.to_datetime(flight_date).date()
+    
+    # Extract just the flight number from format "SQ 0024 (SIN → JFK)"
+    # The CSV contains just "SQ 0024" in operating_flight_number column
+    if '(' in flight_number:
+        actual_flight_number = flight_number.split('(')[0].strip()
+    else:
+        actual_flight_number = flight_number.strip()
+    
+    # Passengers for this flight+date from the resident manifest (dates pre-parsed at load)
+    flight_data = CUSTOMER_STORE.flight_rows(actual_flight_number, target_date)
+    flight_data = flight_data[flight_data['age_group'] != 'Under 2']
+    
+    # Select cabin class based on segment (matching meal_planning.py logic)
+    # SIN JFK uses S (business) class, all others use Y (economy) class
+    segment = flight_data['segment'].iloc[0] if not flight_data.empty else ""
+    if segment == "SIN JFK":
+        flight_data = flight_data[flight_data['cabin_class'] == 'S']
+    else:
+        flight_data = flight_data[flight_data['cabin_class'] == 'Y']
+    
+    if flight_data.empty:
+        return None
+    
+    # Destination region from the segment's destination airport (e.g., "SIN MAA" → "MAA")
+    destination_airport = segment.split()[-1] if ' ' in segment else segment
+    region_by_airport = airport_regions(load_csv_defaults_once()['tables'])
+    
+    meal_catalog = MEAL_CATALOG.ensure_loaded()
+    if meal_catalog.df is None:
+        raise HTTPException(status_code=404, detail=meal_catalog.error)
+    
+    # Meals for this flight, keyed by meal time
+    cabin = flight_data['cabin_class'].iloc[0]
+    flight_meals = {}
+    for meal_time in meal_catalog.meal_times(segment, target_date, cabin):
+        flight_meals[meal_time] = meal_catalog.lookup(segment, target_date, cabin, meal_time)
+    
+    return {
+        'target_date': target_date,
+        'flight_data': flight_data,
+        'segment': segment,
+        'cabin': cabin,
+        'destination_airport': destination_airport,
+        'destination_region': region_by_airport.get(destination_airport, destination_airport),
+        'flight_meals': flight_meals,
+    }
+
+# Factor rows sent by /api/master-metrics and kept by /api/initialize-session:
+# 'full' = every table row, 'flight' = only the rows the flight's passengers can use
+ROW_SCOPES = ('full', 'flight')
+
+def flight_row_scope(flight_number: str, flight_date: str) -> Optional[dict]:
+    """
+    Row key prefixes per metric that a flight's passengers use: their nationalities on the
+    flight's weekday, their age groups and the flight's destination region (meal time rows
+    are already limited to the served meal times). None if the flight has no scored passengers.
+    """
+    context = flight_prediction_context(flight_number, flight_date)
+    if context is None:
+        return None
+    flight_data = context['flight_data']
+    nationality_keys = flight_data['nationality_code'].astype(str) + '_' + flight_data['weekday'].astype(str)
+    return {
+        'nationality': sorted(nationality_keys.unique()),
+        'age': sorted(flight_data['age_group'].astype(str).unique()),
+        'destination': [str(context['destination_region'])],
+        'mealtime': None,
+    }
+
+def score_passenger_groups(context: dict, session: Optional[dict] = None) -> dict:
+    """
+    Group a flight's passengers (same grouping as meal_planning.py) and gather each metric's
+    restricted probabilities for every group whose meal time is served.
+    PRIORITY: session rows (already restricted) > CSV defaults (pre-restricted factor tables).
+    Returns the groups, their proteins and slots, the factor matrices and the session row
+    key each group used per metric (None where the CSV default was used).
+    """
+    flight_data = context['flight_data'].copy()
+    flight_meals = context['flight_meals']
+    destination = context['destination_region']  # from the segment, not the customer CSV
+    
+    flight_data['feature_set'] = (
+        flight_data['nationality_code'].astype(str) + '_' +
+        flight_data['age_group'].astype(str) + '_' +
+        flight_data['destination_region'].astype(str) + '_' +
+        flight_data['meal_time'].astype(str)
+    )
+    
+    # IMPORTANT: Order of groupby columns affects iteration order!
+    grouped = flight_data.groupby([
+        'segment', 'cabin_class', 'parsed_date', 'weekday', 'feature_set'
+    ], observed=True).size().reset_index(name='passenger_count')
+    feature_details = flight_data.groupby('feature_set').agg({
+        'nationality_code': 'first',
+        'age_group': 'first',
+        'destination_region': 'first',
+        'meal_time': 'first'
+    }).reset_index()
+    grouped = grouped.merge(feature_details, on='feature_set', how='left')
+    
+    # Only groups whose meal time is served in this cabin can be scored
+    scored_groups = grouped[grouped['meal_time'].isin(list(flight_meals.keys()))].reset_index(drop=True)
+    
+    # IMPORTANT: Proteins are sorted alphabetically (pre-sorted by the meal catalog)
+    # Alphabetical order gives consistent tie-breaking in largest remainder method
+    group_proteins = [flight_meals[meal_time]['proteins'] for meal_time in scored_groups['meal_time']]
+    slots = protein_slots(group_proteins)
+    
+    csv_tables = load_csv_defaults_once()['tables']
+    session_rows = {metric: [] for metric in SCORING_METRICS}
+    session_keys = {metric: [] for metric in SCORING_METRICS}
+    csv_keys = {metric: [] for metric in SCORING_METRICS}
+    missing_warned = set()
+    
+    for group in scored_groups.itertuples(index=False):
+        meal_time = group.meal_time
+        lookups = [
+            # (metric, session row key, CSV key, warning label)
+            ('nationality', f"{group.nationality_code}_{group.weekday}_{meal_time}",
+             f"{group.nationality_code}_{group.weekday}", f"{group.nationality_code}_{group.weekday}_{meal_time}"),
+            ('age', f"{group.age_group}_{meal_time}", group.age_group, f"age {group.age_group}"),
+            ('destination', f"{destination}_{meal_time}", destination, f"destination {destination}"),
+            ('mealtime', meal_time, meal_time, f"meal time {meal_time}"),
+        ]
+        for metric, session_row_key, csv_key, label in lookups:
+            csv_keys[metric].append(csv_key)
+            if session is not None and session_row_key in session[metric]:
+                session_rows[metric].append(session[metric].current(session_row_key))
+                session_keys[metric].append(session_row_key)
+            else:
+                # Fallback to CSV defaults (old format without meal_time)
+                session_rows[metric].append(None)
+                session_keys[metric].append(None)
+                table = csv_tables.get(metric)
+                if (table is None or table.position(csv_key) < 0) and label not in missing_warned:
+                    missing_warned.add(label)
+                    print(f"⚠️  WARNING: No probability data found for {label}")
+    
+    # Session rows pass through; CSV rows are gathered from the table restricted to
+    # each group's proteins; rows found in neither stay zero
+    available_mask = availability_mask(slots)
+    factors = []
+    for metric in SCORING_METRICS:
+        table = csv_tables.get(metric)
+        if table is not None:
+            positions = table.positions(csv_keys[metric])
+            csv_matrix = np.where((positions >= 0)[:, None], table.gather(positions, slots), 0.0)
+        else:
+            csv_matrix = np.zeros((len(scored_groups), len(PROTEINS)))
+        session_matrix = np.where(available_mask, probability_matrix(session_rows[metric]), 0.0)
+        from_session = np.array([key is not None for key in session_keys[metric]], dtype=bool).reshape(-1, 1)
+        factors.append(np.where(from_session, session_matrix, csv_matrix))
+    
+    return {
+        'groups': scored_groups,
+        'group_proteins': group_proteins,
+        'slots': slots,
+        'factors': factors,
+        'session_keys': session_keys,
+    }
+
+def session_prediction(session: dict, weights: Optional[list] = None) -> Optional[SessionPrediction]:
+    """
+    The session's scored passenger groups, built from its current rows on first use
+    (default weights unless given) and re-scored when different weights are given.
+    None if the flight has no passengers.
+    """
+    prediction = session.get('prediction')
+    if prediction is None:
+        context = flight_prediction_context(session['flight_number'], session['flight_date'])
+        if context is None:
+            return None
+        inputs = score_passenger_groups(context, session)
+        if weights is None:
+            weights = session.get('weights') or [value / 100.0 for value in IMPORTANCE_DEFAULTS.values()]
+        prediction = SessionPrediction(
+            inputs['groups']['meal_time'], inputs['groups']['passenger_count'], inputs['slots'], inputs['factors'],
+            inputs['session_keys'], weights,
+            {meal_time: entry['proteins'] for meal_time, entry in context['flight_meals'].items()}
+        )
+        session['prediction'] = prediction
+    elif weights is not None:
+        prediction.set_weights(weights)
+    session['weights'] = prediction.weights
+    return prediction
+
+def apply_session_edits(session_key: str, session: dict, edits: list, master_metrics: Optional[dict] = None) -> dict:
+    """
+    Book-keeping after session rows were edited: new session version (cached predictions are
+    stale), re-score only the passenger groups that use the edited rows, write the session back.
+    edits: (metric_type, row_key, probabilities); master_metrics optionally sets the weights.
+    Returns the number of re-scored groups and the per-meal-time counts (None if no passengers).
+    """
+    session['version'] = SESSION_MEMORY.next_version()
+    invalidate_predictions(session['flight_number'], session['flight_date'])
+    
+    master_metrics = master_metrics or {}
+    weights = None
+    if any(name in master_metrics for name in IMPORTANCE_DEFAULTS):
+        weights = [float(master_metrics.get(name, default)) / 100.0 for name, default in IMPORTANCE_DEFAULTS.items()]
+    had_prediction = 'prediction' in session
+    prediction = session_prediction(session, weights)
+    updated_groups = 0
+    meal_times = None
+    if prediction is not None:
+        # A freshly built prediction already includes the edits
+        updated_groups = prediction.update_rows(edits) if had_prediction else len(prediction.groups_for_rows(edits))
+        meal_times = {meal_time: dict(sorted(counts.items())) for meal_time, counts in prediction.meal_time_counts().items()}
+    
+    # Write the edits back so other workers see them (no-op for in-process sessions)
+    SESSION_MEMORY.save(session_key, session)
+    return {"updated_groups": updated_groups, "meal_times": meal_times}
+
 @app.get("/")
 def read_root():
     return {"message": "Airline Meal Prediction API", "status": "running"}
 
 @app.get("/api/flights")
-def get_flights():
-    """Get available flights with categories and dates from customers.csv (cached)"""
-    global FLIGHTS_CACHE
+def get_flights(request: Request, category: Optional[str] = None, route: Optional[str] = None,
+                date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """
+    Get available flights with categories and dates (ETag / If-None-Match aware).
+    Optional filters: category (destination region), route prefix (e.g. "SIN" or "SIN-JFK")
+    and a date window date_from..date_to (YYYY-MM-DD, inclusive).
+    """
+    return cached_json_response(request, flights_payload(category, route, date_from, date_to))
+
+def flights_payload(category: Optional[str] = None, route: Optional[str] = None,
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> dict:
+    """Flights with categories and dates from the flight catalog built when the manifest loads"""
+    window = []
+    for name, value in (('date_from', date_from), ('date_to', date_to)):
+        try:
+            window.append(pd.to_datetime(value, format='%Y-%m-%d').strftime('%Y-%m-%d') if value else None)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD, got {value!r}")
     
-    # Return cached data if available
-    if FLIGHTS_CACHE['loaded']:
-        print("✅ Returning cached flights data")
-        if FLIGHTS_CACHE['error']:
-            return {"flights": [], "categories": [], "error": FLIGHTS_CACHE['error']}
-        return {"flights": FLIGHTS_CACHE['flights'], "categories": FLIGHTS_CACHE['categories']}
+    store = CUSTOMER_STORE.ensure_loaded()
+    if store.df is None:
+        return {"flights": [], "categories": [], "error": store.error}
     
-    # Load flights data for the first time
-    print("📂 Loading flights data from customers.csv (one-time operation)...")
-    try:
-        customers_file = os.path.join(DATA_DIR, 'customers.csv')
-        if not os.path.exists(customers_file):
-            FLIGHTS_CACHE['loaded'] = True
-            FLIGHTS_CACHE['error'] = "customers.csv not found"
-            return {"flights": [], "categories": [], "error": "customers.csv not found"}
-        
-        df = pd.read_csv(customers_file, low_memory=False)
-        
-        # Get unique destination regions (categories)
-        categories = sorted(df['destination_region'].dropna().unique().tolist())
-        
-        # Get unique flights with their details
-        flight_groups = df.groupby('operating_flight_number').agg({
-            'departure_airport': 'first',
-            'arrival_airport': 'first',
-            'destination_region': 'first',
-            'segment_local_departure_datetime': lambda x: sorted(x.dropna().unique().tolist())
-        }).reset_index()
-        
-        flights = []
-        for _, row in flight_groups.iterrows():
-            flight_num = str(row['operating_flight_number']).strip()
-            origin = str(row['departure_airport'])
-            destination = str(row['arrival_airport'])
-            category = str(row['destination_region']) if pd.notna(row['destination_region']) else 'Unknown'
-            
-            # Extract dates
-            dates = []
-            for dt_str in row['segment_local_departure_datetime']:
-                try:
-                    if pd.notna(dt_str) and str(dt_str).strip() != '':
-                        # Extract date part (before time if present)
-                        date_part = str(dt_str).split()[0] if ' ' in str(dt_str) else str(dt_str)
-                        # Parse the date as DD/MM/YYYY format and convert to YYYY-MM-DD format
-                        parsed_date = pd.to_datetime(date_part, format='%d/%m/%Y', dayfirst=True)
-                        date_str = parsed_date.strftime('%Y-%m-%d')
-                        if date_str not in dates:
-                            dates.append(date_str)
-                except Exception as e:
-                    pass
-            
-            print(f"DEBUG: Flight {flight_num} has {len(dates)} valid dates")
-            
-            flights.append({
-                'flightNumber': flight_num,
-                'origin': origin,
-                'destination': destination,
-                'route': f"{origin}-{destination}",
-                'category': category,
-                'availableDates': sorted(dates)
-            })
-        
-        # Cache the results
-        FLIGHTS_CACHE['flights'] = flights
-        FLIGHTS_CACHE['categories'] = categories
-        FLIGHTS_CACHE['loaded'] = True
-        print(f"✅ Cached {len(flights)} flights and {len(categories)} categories")
-        
-        return {"flights": flights, "categories": categories}
-    except Exception as e:
-        print(f"Error loading flights: {e}")
-        import traceback
-        traceback.print_exc()
-        FLIGHTS_CACHE['loaded'] = True
-        FLIGHTS_CACHE['error'] = str(e)
-        return {"flights": [], "categories": [], "error": str(e)}
+    flights = store.flights(category, route, *window)
+    print(f"✅ flights_payload() ----------- {len(flights)} of {len(store.catalog['flights'])} flights")
+    return {"flights": flights, "categories": store.catalog['categories']}
 
 @app.get("/api/customer-summary")
 def get_customer_summary(flight_number: str, flight_date: str):
-    """Get customer summary for selected flight and date (cached)"""
-    global CUSTOMER_SUMMARY_CACHE
-    
-    # Create cache key
-    cache_key = f"{flight_number}|{flight_date}"
-    
-    # Return cached data if available
-    if cache_key in CUSTOMER_SUMMARY_CACHE:
-        print(f"✅ Returning cached customer summary for {cache_key}")
-        return CUSTOMER_SUMMARY_CACHE[cache_key]
-    
-    print(f"📂 Loading customer summary for {cache_key}...")
+    """Get customer summary for selected flight and date (materialized when the manifest loads)"""
     try:
-        customers_file = os.path.join(DATA_DIR, 'customers.csv')
-        
-        if not os.path.exists(customers_file):
-            result = {"error": "customers.csv not found"}
-            CUSTOMER_SUMMARY_CACHE[cache_key] = result
-            return result
-        
-        # Read CSV with age_group as string to prevent Excel date conversion
-        df = pd.read_csv(customers_file, dtype={'age_group': str}, low_memory=False)
+        store = CUSTOMER_STORE.ensure_loaded()
         
-        # Fix Excel's auto-conversion of "2-18" to "Feb-18"
-        if 'age_group' in df.columns:
-            df['age_group'] = df['age_group'].replace('Feb-18', '2-18')
-        
-        # Parse the flight date
-        target_date = pd.to_datetime(flight_date).date()
+        if store.df is None:
+            return {"error": store.error}
         
         # Filter by flight number
-        flight_data = df[df['operating_flight_number'].astype(str).str.strip() == flight_number.strip()]
-        
-        if flight_data.empty:
+        if not store.has_flight(flight_number):
             return {"error": f"No data found for flight {flight_number}"}
         
-        # Filter by date
-        flight_data['parsed_date'] = pd.to_datetime(
-            flight_data['segment_local_departure_datetime'].str.split().str[0],
-            format='%d/%m/%Y',
-            dayfirst=True,
-            errors='coerce'
-        ).dt.date
-        
-        flight_data = flight_data[flight_data['parsed_date'] == target_date]
-        
-        if flight_data.empty:
+        # Unique-passenger counts, cabins, meal times and breakdowns are precomputed per flight+date
+        summary = store.summary(flight_number, flight_date)
+        if summary is None:
             return {"error": f"No customers found for flight {flight_number} on {flight_date}"}
         
-        # Get unique passengers using customer_number if available
-        # Each customer can have multiple meal_times, so we deduplicate by customer_number
-        if 'customer_number' in flight_data.columns:
-            unique_passengers = flight_data.drop_duplicates(subset=['customer_number'], keep='first')
-        else:
-            # Fallback: drop duplicates on all columns except meal_time
-            passenger_id_cols = [col for col in flight_data.columns if col not in ['meal_time', 'parsed_date']]
-            unique_passengers = flight_data.drop_duplicates(subset=passenger_id_cols, keep='first')
-        
-        # Total customers (unique passengers)
-        total_customers = len(unique_passengers)
-        
-        # Cabin class distribution (using unique passengers)
-        cabin_distribution = {}
-        if 'cabin_class' in unique_passengers.columns:
-            cabin_distribution = unique_passengers['cabin_class'].value_counts().to_dict()
-        
-        # Destination airport code (extract from segment or arrival_airport)
-        destination_airport = 'Unknown'
-        if 'arrival_airport' in unique_passengers.columns and len(unique_passengers) > 0:
-            destination_airport = unique_passengers['arrival_airport'].iloc[0]
-        elif 'segment' in unique_passengers.columns and len(unique_passengers) > 0:
-            # Extract destination from segment (e.g., "AKL SIN" -> "SIN")
-            segment = unique_passengers['segment'].iloc[0]
-            if isinstance(segment, str) and ' ' in segment:
-                destination_airport = segment.split()[-1]
-        
-        # Unique meal times (from original flight_data)
-        meal_times = []
-        if 'meal_time' in flight_data.columns:
-            meal_times = sorted(flight_data['meal_time'].dropna().unique().tolist())
-        
-        # Determine cabin class for detailed analysis (Y first, then S)
-        analysis_cabin = None
-        if 'Y' in cabin_distribution:
-            analysis_cabin = 'Y'
-        elif 'S' in cabin_distribution:
-            analysis_cabin = 'S'
-        
-        # Nationality and Age breakdown for selected cabin (using unique passengers)
-        nationality_breakdown = {}
-        age_breakdown = {}
-        
-        if analysis_cabin:
-            cabin_data = unique_passengers[unique_passengers['cabin_class'] == analysis_cabin]
-            
-            # Nationality breakdown
-            if 'nationality_code' in cabin_data.columns:
-                nationality_breakdown = cabin_data['nationality_code'].value_counts().to_dict()
-            
-            # Age group breakdown
-            if 'age_group' in cabin_data.columns:
-                age_breakdown = cabin_data['age_group'].value_counts().to_dict()
-        
         # Get day of week from flight_date
         parsed_date = pd.to_datetime(flight_date)
         day_of_week = parsed_date.strftime('%A')  # Full weekday name (e.g., "Monday")
         
-        result = {
+        print(f"✅ Returning customer summary for {flight_number}|{flight_date}")
+        return {
             "flight_number": flight_number,
             "flight_date": flight_date,
             "day_of_week": day_of_week,
-            "total_customers": int(total_customers),
-            "cabin_distribution": {k: int(v) for k, v in cabin_distribution.items()},
-            "destination_airport": destination_airport,
-            "meal_times": meal_times,
-            "analysis_cabin": analysis_cabin,
-            "nationality_breakdown": {k: int(v) for k, v in nationality_breakdown.items()},
-            "age_breakdown": {k: int(v) for k, v in age_breakdown.items()}
+            **summary
         }
-        
-        # Cache the result
-        CUSTOMER_SUMMARY_CACHE[cache_key] = result
-        print(f"✅ Cached customer summary for {cache_key}")
-        
-        return result
     except Exception as e:
         print(f"Error loading customer summary: {e}")
         import traceback
         traceback.print_exc()
-        error_result = {"error": str(e)}
-        CUSTOMER_SUMMARY_CACHE[cache_key] = error_result
-        return error_result
+        return {"error": str(e)}
 
 @app.get("/api/available-meals")
 def get_available_meals(flight_number: str, flight_date: str):
     """Get available meals for a specific flight and date from meal_df_new.csv (cached)"""
-    global AVAILABLE_MEALS_CACHE
-    
-    # Create cache key
-    cache_key = f"{flight_number}|{flight_date}"
-    
-    # Return cached data if available
-    if cache_key in AVAILABLE_MEALS_CACHE:
-        print(f"✅ Returning cached available meals for {cache_key}")
-        return AVAILABLE_MEALS_CACHE[cache_key]
-    
-    print(f"📂 Loading available meals for {cache_key}...")
+    cache_key = f"{DATA_VERSIONS.version}|{flight_number}|{flight_date}"
+    return AVAILABLE_MEALS_CACHE.get_or_compute(cache_key, lambda: load_available_meals(flight_number, flight_date))
+
+def load_available_meals(flight_number: str, flight_date: str) -> dict:
+    """Available meals by meal time (errors are returned as {"error": ...} and cached briefly)"""
+    print(f"📂 Loading available meals for {flight_number}|{flight_date}...")
     try:
-        # Load meal data
-        meal_file = os.path.join(DATA_DIR, 'meal_df_new.csv')
-        if not os.path.exists(meal_file):
-            result = {"error": "Meal data file not found"}
-            AVAILABLE_MEALS_CACHE[cache_key] = result
-            return result
-        
-        df = pd.read_csv(meal_file)
+        meal_catalog = MEAL_CATALOG.ensure_loaded()
+        if meal_catalog.df is None:
+            return {"error": meal_catalog.error}
         
         # Parse the date from the request (YYYY-MM-DD format)
         target_date = pd.to_datetime(flight_date).date()
         
-        # Parse segment_local_departure_date column (already in datetime format)
-        df['parsed_date'] = pd.to_datetime(df['segment_local_departure_date'], errors='coerce').dt.date
-        
         # Extract flight route from segment column (e.g., "AKL SIN")
         # Match the flight route from the flight_number
         # flight_number format is like "SQ286 (AKL → SIN)"
@@ -567,37 +826,17 @@ def get_available_meals(flight_number: str, flight_date: str):
         else:
             return {"error": "Invalid flight number format"}
         
-        # Filter by segment and date
-        meal_data = df[(df['segment'] == segment_filter) & (df['parsed_date'] == target_date)]
+        # Meal times served on this segment and date
+        meal_times = meal_catalog.meal_times(segment_filter, target_date)
         
-        if meal_data.empty:
+        if not meal_times:
             return {"meals_by_time": {}, "message": "No meal data found for this flight and date"}
         
-        # Group meals by meal_time, prioritizing Y cabin, then S cabin
+        # Group meals by meal_time, prioritizing Y cabin, then S cabin (resolved by the catalog)
         meals_by_time = {}
-        for meal_time in meal_data['meal_time'].unique():
-            time_meals = meal_data[meal_data['meal_time'] == meal_time]
-            
-            # Check if Y cabin exists for this meal time
-            y_cabin_meals = time_meals[time_meals['cabin_class'] == 'Y']
-            
-            if not y_cabin_meals.empty:
-                # Use Y cabin meals
-                display_meals = y_cabin_meals
-            else:
-                # Use S cabin meals if Y cabin not present
-                s_cabin_meals = time_meals[time_meals['cabin_class'] == 'S']
-                display_meals = s_cabin_meals
-            
-            meals_list = []
-            for _, row in display_meals.iterrows():
-                meals_list.append({
-                    "cabin_class": row['cabin_class'],
-                    "meal_name": row['meal_name'],
-                    "meal_pref": row['meal_pref']
-                })
-            
-            meals_by_time[meal_time] = meals_list
+        for meal_time in meal_times:
+            display_entry = meal_catalog.display_entry(segment_filter, target_date, meal_time)
+            meals_by_time[meal_time] = [dict(meal) for meal in display_entry['meals']] if display_entry else []
         
         result = {
             "flight_number": flight_number,
@@ -605,35 +844,40 @@ def get_available_meals(flight_number: str, flight_date: str):
             "segment": segment_filter,
             "meals_by_time": meals_by_time
         }
-        
-        # Cache the result
-        AVAILABLE_MEALS_CACHE[cache_key] = result
-        print(f"✅ Cached available meals for {cache_key}")
+        print(f"✅ Loaded available meals for {flight_number}|{flight_date}")
         
         return result
     except Exception as e:
         print(f"Error loading available meals: {e}")
         import traceback
         traceback.print_exc()
-        error_result = {"error": str(e)}
-        AVAILABLE_MEALS_CACHE[cache_key] = error_result
-        return error_result
+        return {"error": str(e)}
 
 @app.post("/api/clear-session")
-def clear_session():
+def clear_session(session_key: Optional[str] = None):
     """
     Clear temporary session memory.
-    Called when user returns to flight selection page.
+    Called when user returns to flight selection page with the session_key being left;
+    without a session_key every session is cleared.
     """
     try:
-        clear_session_memory()
-        return {"success": True, "message": "Session memory cleared"}
+        cleared = clear_session_memory(session_key)
+        return {"success": True, "message": "Session memory cleared", "cleared": cleared}
     except Exception as e:
         print(f"Error clearing session: {e}")
         return {"success": False, "error": str(e)}
 
 @app.post("/api/initialize-session")
 async def initialize_session(request: dict):
+    """Initialize session memory for a flight+date (identical concurrent requests share one initialization)"""
+    key = coalescing_key(request.get("flight_number"), request.get("flight_date"), request.get("scope") or 'full',
+                         request.get("ttl_seconds"), DATA_VERSIONS.version)
+    session_key = f"{request.get('flight_number')}|{request.get('flight_date')}"
+    return await INITIALIZE_SESSION_FLIGHTS.run_async(key, lambda: COMPUTE_POOL.run(
+        'initialize_session', locked_session_call, session_key, initialize_session_payload, request,
+        serial_key=session_key))
+
+def initialize_session_payload(request: dict) -> dict:
     """
     Initialize session memory with normalized and restricted probabilities for a flight+date.
     This loads all CSV defaults, normalizes them for available proteins per meal time.
@@ -651,12 +895,10 @@ async def initialize_session(request: dict):
         print(f"\n🔄 initialize_session(request: dict) ----------- Session Init: {session_key}")
         
         # Get available proteins by meal time for this flight+date
-        meal_file = os.path.join(DATA_DIR, 'meal_df_new.csv')
-        if not os.path.exists(meal_file):
+        meal_catalog = MEAL_CATALOG.ensure_loaded()
+        if meal_catalog.df is None:
             raise HTTPException(status_code=404, detail="Meal data file not found")
         
-        meal_df = pd.read_csv(meal_file)
-        
         # Parse flight to get segment
         if '(' in flight_number and '→' in flight_number:
             route_part = flight_number.split('(')[1].split(')')[0]
@@ -668,126 +910,50 @@ async def initialize_session(request: dict):
         # Parse date and get weekday
         target_date = pd.to_datetime(flight_date).date()
         weekday = pd.to_datetime(flight_date).day_name()
-        meal_df['parsed_date'] = pd.to_datetime(meal_df['segment_local_departure_date'], errors='coerce').dt.date
         
-        # Filter meals for this flight+date
-        filtered_meals = meal_df[
-            (meal_df['segment'] == segment_filter) & 
-            (meal_df['parsed_date'] == target_date)
-        ]
-        
-        if filtered_meals.empty:
+        if not meal_catalog.meal_times(segment_filter, target_date):
             raise HTTPException(status_code=404, detail=f"No meals found for {segment_filter} on {flight_date}")
         
         # Get proteins per meal time (prioritize Y cabin, fallback to S)
-        available_proteins_by_mealtime = {}
-        for meal_time in filtered_meals['meal_time'].unique():
-            time_meals = filtered_meals[filtered_meals['meal_time'] == meal_time]
-            y_cabin = time_meals[time_meals['cabin_class'] == 'Y']
-            cabin_data = y_cabin if not y_cabin.empty else time_meals[time_meals['cabin_class'] == 'S']
-            
-            if not cabin_data.empty:
-                proteins = sorted(cabin_data['meal_pref'].unique().tolist())
-                available_proteins_by_mealtime[meal_time] = proteins
+        available_proteins_by_mealtime = meal_catalog.proteins_by_mealtime(segment_filter, target_date)
         
         if not available_proteins_by_mealtime:
             raise HTTPException(status_code=404, detail=f"No meals found for {segment_filter} on {flight_date}")
         
-        # Initialize session memory structure
-        SESSION_MEMORY[session_key] = {
+        # Restricted defaults come from the factor tables (normalized once per protein availability)
+        factor_tables = load_csv_defaults_once()['tables']
+        for metric, file_name in [('nationality', 'Nationality.csv'), ('age', 'Age.csv'),
+                                  ('destination', 'Destination.csv'), ('mealtime', 'MealTime.csv')]:
+            if metric not in factor_tables:
+                raise HTTPException(status_code=404, detail=f"{file_name} not found")
+        
+        # Optional flight scope: only the rows this flight's passengers use (falls back to
+        # every row if the flight has no passengers). Predictions are the same either way,
+        # groups without a session row use the identical restricted CSV default.
+        scope_name = request.get("scope") or 'full'
+        if scope_name not in ROW_SCOPES:
+            raise HTTPException(status_code=400, detail=f"Invalid scope: {scope_name} (expected one of {list(ROW_SCOPES)})")
+        row_scope = flight_row_scope(flight_number, flight_date) if scope_name == 'flight' else None
+        
+        # Initialize session memory structure: every metric's rows reference the shared
+        # defaults and only rows the user edits are stored in the session
+        session = {
             'flight_number': flight_number,
             'flight_date': flight_date,
             'weekday': weekday,
             'segment': segment_filter,
+            'version': SESSION_MEMORY.next_version(),
             'available_proteins_by_mealtime': available_proteins_by_mealtime,
-            'nationality': {},
-            'age': {},
-            'destination': {},
-            'mealtime': {}
+            'scope': row_scope,
+            **{metric: SessionRows(metric, factor_tables[metric], available_proteins_by_mealtime,
+                                   row_scope[metric] if row_scope else None)
+               for metric in SCORING_METRICS}
         }
-        
-        # Load and normalize NATIONALITY probabilities
-        nat_df = pd.read_csv(os.path.join(DATA_DIR, 'Nationality.csv'))
-        nat_count = 0
-        for _, row in nat_df.iterrows():
-            nat_code = row['nationality_code']
-            day_of_week = row['day_of_week']
-            
-            # Create entries for each meal time with restricted proteins
-            for meal_time, proteins in available_proteins_by_mealtime.items():
-                row_key = f"{nat_code}_{day_of_week}_{meal_time}"
-                normalized_probs = normalize_probabilities_for_proteins(row.to_dict(), proteins)
-                
-                SESSION_MEMORY[session_key]['nationality'][row_key] = {
-                    'nationality_code': nat_code,
-                    'day_of_week': day_of_week,
-                    'meal_time': meal_time,
-                    'current_probabilities': normalized_probs.copy(),
-                    'default_probabilities': normalized_probs.copy(),
-                    'marker': 'no_change',
-                    'available_proteins': proteins
-                }
-                nat_count += 1
-        
-        # Load and normalize AGE probabilities
-        age_df = pd.read_csv(os.path.join(DATA_DIR, 'Age.csv'))
-        age_count = 0
-        for _, row in age_df.iterrows():
-            age_group = row['age_group']
-            
-            for meal_time, proteins in available_proteins_by_mealtime.items():
-                row_key = f"{age_group}_{meal_time}"
-                normalized_probs = normalize_probabilities_for_proteins(row.to_dict(), proteins)
-                
-                SESSION_MEMORY[session_key]['age'][row_key] = {
-                    'age_group': age_group,
-                    'meal_time': meal_time,
-                    'current_probabilities': normalized_probs.copy(),
-                    'default_probabilities': normalized_probs.copy(),
-                    'marker': 'no_change',
-                    'available_proteins': proteins
-                }
-                age_count += 1
-        
-        # Load and normalize DESTINATION probabilities
-        dest_df = pd.read_csv(os.path.join(DATA_DIR, 'Destination.csv'))
-        dest_count = 0
-        for _, row in dest_df.iterrows():
-            dest_region = row['destination_region']
-            
-            for meal_time, proteins in available_proteins_by_mealtime.items():
-                row_key = f"{dest_region}_{meal_time}"
-                normalized_probs = normalize_probabilities_for_proteins(row.to_dict(), proteins)
-                
-                SESSION_MEMORY[session_key]['destination'][row_key] = {
-                    'destination_region': dest_region,
-                    'meal_time': meal_time,
-                    'current_probabilities': normalized_probs.copy(),
-                    'default_probabilities': normalized_probs.copy(),
-                    'marker': 'no_change',
-                    'available_proteins': proteins
-                }
-                dest_count += 1
-        
-        # Load and normalize MEALTIME probabilities
-        meal_df_probs = pd.read_csv(os.path.join(DATA_DIR, 'MealTime.csv'))
-        meal_count = 0
-        for _, row in meal_df_probs.iterrows():
-            meal_time = row['meal_time']
-            
-            if meal_time in available_proteins_by_mealtime:
-                proteins = available_proteins_by_mealtime[meal_time]
-                row_key = meal_time
-                normalized_probs = normalize_probabilities_for_proteins(row.to_dict(), proteins)
-                
-                SESSION_MEMORY[session_key]['mealtime'][row_key] = {
-                    'meal_time': meal_time,
-                    'current_probabilities': normalized_probs.copy(),
-                    'default_probabilities': normalized_probs.copy(),
-                    'marker': 'no_change',
-                    'available_proteins': proteins
-                }
-                meal_count += 1
+        SESSION_MEMORY.set(session_key, session, ttl_seconds=request.get("ttl_seconds"))
+        nat_count = session['nationality'].layout.assignments
+        age_count = session['age'].layout.assignments
+        dest_count = session['destination'].layout.assignments
+        meal_count = session['mealtime'].layout.assignments
         
         total_rows = nat_count + age_count + dest_count + meal_count
         print(f"Initialize_session(request: dict) --------------- ✅  Initialized {total_rows} rows (nat:{nat_count}, age:{age_count}, dest:{dest_count}, meal:{meal_count})\n")
@@ -802,9 +968,12 @@ async def initialize_session(request: dict):
                 "mealtime_rows": meal_count,
                 "total_rows": nat_count + age_count + dest_count + meal_count
             },
+            "scope": 'flight' if row_scope else 'full',
             "available_proteins_by_mealtime": available_proteins_by_mealtime
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error initializing session: {e}")
         import traceback
@@ -813,6 +982,11 @@ async def initialize_session(request: dict):
 
 @app.post("/api/update-session-probability")
 async def update_session_probability(request: dict):
+    """Update a single probability row in session memory (on COMPUTE_POOL, one edit of a session at a time)"""
+    return await COMPUTE_POOL.run('update_session', locked_session_call, request.get("session_key"),
+                                  update_session_probability_payload, request, serial_key=request.get("session_key"))
+
+def update_session_probability_payload(request: dict) -> dict:
     """
     Update a single probability row in session memory.
     Turns marker from 'no_change' to 'user_modified' and updates current_probabilities.
@@ -826,76 +1000,191 @@ async def update_session_probability(request: dict):
         if not session_key or session_key not in SESSION_MEMORY:
             raise HTTPException(status_code=404, detail="Session not found. Please reinitialize.")
         
-        if metric_type not in SESSION_MEMORY[session_key]:
+        if metric_type not in SCORING_METRICS:
             raise HTTPException(status_code=400, detail=f"Invalid metric_type: {metric_type}")
         
         if row_key not in SESSION_MEMORY[session_key][metric_type]:
             raise HTTPException(status_code=404, detail=f"Row key not found: {row_key}")
         
-        # Update the row
-        row = SESSION_MEMORY[session_key][metric_type][row_key]
-        row['current_probabilities'] = new_probabilities
-        
-        # Check if different from default to set marker
-        is_different = False
-        for protein, prob in new_probabilities.items():
-            default_prob = row['default_probabilities'].get(protein, 0)
-            if abs(prob - default_prob) > 0.001:  # Tolerance for floating point
-                is_different = True
-                break
-        
-        row['marker'] = 'user_modified' if is_different else 'no_change'
+        # Update the row (marker is 'user_modified' if it differs from the default)
+        session = SESSION_MEMORY[session_key]
+        marker = session[metric_type].update(row_key, new_probabilities)
         
-        if is_different:
+        if marker == 'user_modified':
             print(f"📝update_session_probability() --------------- Modified: {metric_type}/{row_key}")
         
+        # Re-score only the passenger groups that use this row (optional master_metrics sets the weights)
+        rescored = apply_session_edits(session_key, session, [(metric_type, row_key, new_probabilities)],
+                                       request.get("master_metrics"))
+        
         return {
             "success": True,
-            "marker": row['marker'],
-            "message": f"Row updated: {row_key}"
+            "marker": marker,
+            "message": f"Row updated: {row_key}",
+            "updated_groups": rescored['updated_groups'],
+            "meal_times": rescored['meal_times']  # Per-meal-time counts with this edit (None if no passengers)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error updating session probability: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/update-session-probabilities")
+async def update_session_probabilities(request: dict):
+    """Update many probability rows in session memory at once (on COMPUTE_POOL, see update_session_probabilities_payload)"""
+    return await COMPUTE_POOL.run('update_session', locked_session_call, request.get("session_key"),
+                                  update_session_probabilities_payload, request, serial_key=request.get("session_key"))
+
+def update_session_probabilities_payload(request: dict) -> dict:
+    """
+    Update many probability rows in session memory at once (e.g. a pasted table).
+    Request: {"session_key", "updates": [{"metric_type", "row_key", "probabilities"}, ...],
+              "master_metrics" (optional importance weights)}
+    All updates are validated first; if any is invalid nothing is applied (400 with the errors).
+    Returns the marker of every update (in request order) and the session's modified row count.
+    """
+    try:
+        session_key = request.get("session_key")
+        updates = request.get("updates")
+        
+        if not session_key or session_key not in SESSION_MEMORY:
+            raise HTTPException(status_code=404, detail="Session not found. Please reinitialize.")
+        if not isinstance(updates, list) or not updates:
+            raise HTTPException(status_code=400, detail="updates must be a non-empty list")
+        
+        session = SESSION_MEMORY[session_key]
+        
+        # Protein values of every update as one [updates x proteins] matrix (+ which proteins were sent)
+        errors = []
+        values = np.zeros((len(updates), len(PROTEINS)))
+        provided = np.zeros((len(updates), len(PROTEINS)), dtype=bool)
+        for i, update in enumerate(updates):
+            if not isinstance(update, dict):
+                errors.append({"index": i, "error": "update must be an object"})
+                continue
+            metric_type = update.get("metric_type")
+            probabilities = update.get("probabilities")
+            if metric_type not in SCORING_METRICS:
+                errors.append({"index": i, "error": f"Invalid metric_type: {metric_type}"})
+            elif update.get("row_key") not in session[metric_type]:
+                errors.append({"index": i, "error": f"Row key not found: {update.get('row_key')}"})
+            elif not isinstance(probabilities, dict):
+                errors.append({"index": i, "error": "probabilities must be an object"})
+            else:
+                for protein, prob in probabilities.items():
+                    col = PROTEIN_INDEX.get(protein)
+                    if col is None or isinstance(prob, bool) or not isinstance(prob, (int, float)):
+                        errors.append({"index": i, "error": f"Invalid probability for {protein}: {prob!r}"})
+                        break
+                    values[i, col] = prob
+                    provided[i, col] = True
+        
+        # Range check for all values at once
+        out_of_range = provided & ~(np.isfinite(values) & (values >= 0.0) & (values <= 1.0))
+        for i in np.flatnonzero(out_of_range.any(axis=1)):
+            errors.append({"index": int(i), "error": "probabilities must be between 0 and 1"})
+        if errors:
+            raise HTTPException(status_code=400, detail={"errors": sorted(errors, key=lambda error: error["index"])})
+        
+        # Markers in one pass: modified if any sent protein differs from the row's default
+        defaults = np.zeros_like(values)
+        metric_types = np.array([update["metric_type"] for update in updates], dtype=object)
+        for metric_type in SCORING_METRICS:
+            rows = np.flatnonzero(metric_types == metric_type)
+            if len(rows):
+                defaults[rows] = session[metric_type].defaults_matrix([updates[i]["row_key"] for i in rows])
+        is_different = (provided & (np.abs(values - defaults) > MODIFIED_TOLERANCE)).any(axis=1)
+        markers = np.where(is_different, 'user_modified', 'no_change').tolist()
+        
+        # Apply them all (later updates of the same row win)
+        edits = []
+        for update, marker in zip(updates, markers):
+            session[update["metric_type"]].set_override(update["row_key"], update["probabilities"], marker)
+            edits.append((update["metric_type"], update["row_key"], update["probabilities"]))
+        rescored = apply_session_edits(session_key, session, edits, request.get("master_metrics"))
+        
+        modified_count = sum(session[metric_type].modified_count() for metric_type in SCORING_METRICS)
+        print(f"📝update_session_probabilities() --------------- Applied {len(edits)} updates "
+              f"({sum(is_different)} modified), {modified_count} modified rows in session")
+        
+        return {
+            "success": True,
+            "markers": [
+                {"metric_type": update["metric_type"], "row_key": update["row_key"], "marker": marker}
+                for update, marker in zip(updates, markers)
+            ],
+            "updated": len(edits),
+            "modified_count": modified_count,
+            "updated_groups": rescored['updated_groups'],
+            "meal_times": rescored['meal_times']  # Per-meal-time counts with these edits (None if no passengers)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error updating session probabilities: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/get-modified-rows")
-async def get_modified_rows(session_key: str):
+async def get_modified_rows(session_key: str, since_version: Optional[int] = None):
+    """Modified rows of a session (on COMPUTE_POOL, serialized with the session's edits so rows aren't read mid-edit)"""
+    return await COMPUTE_POOL.run('get_modified_rows', modified_rows_payload, session_key, since_version,
+                                  serial_key=session_key)
+
+def modified_rows_payload(session_key: str, since_version: Optional[int] = None) -> dict:
     """
     Get all rows with marker='user_modified' for display in frontend.
     Shows both default and current probabilities for comparison.
     In frontend it is a table.
+    Each response carries the session version; pass it back as since_version and an
+    unchanged session answers {"unchanged": true} without the rows.
     """
     try:
         if not session_key or session_key not in SESSION_MEMORY:
             raise HTTPException(status_code=404, detail="Session not found")
         
         session = SESSION_MEMORY[session_key]
+        if since_version is not None and since_version == session['version']:
+            return {
+                "success": True,
+                "unchanged": True,
+                "version": session['version'],
+                "count": sum(session[metric_type].modified_count() for metric_type in SCORING_METRICS)
+            }
+        
+        # Only the indexed modified rows are materialized
         modified_rows = []
         
         # Check all metric types
         for metric_type in ['nationality', 'age', 'destination', 'mealtime']:
-            for row_key, row_data in session.get(metric_type, {}).items():
-                if row_data['marker'] == 'user_modified':
-                    modified_rows.append({
-                        'metric_type': metric_type,
-                        'row_key': row_key,
-                        'default_probabilities': row_data['default_probabilities'],
-                        'current_probabilities': row_data['current_probabilities'],
-                        'available_proteins': row_data['available_proteins'],
-                        'row_details': {k: v for k, v in row_data.items() 
-                                      if k not in ['current_probabilities', 'default_probabilities', 
-                                                   'marker', 'available_proteins']}
-                    })
+            for row_key in session[metric_type].modified_keys():
+                row_data = session[metric_type].row(row_key)
+                modified_rows.append({
+                    'metric_type': metric_type,
+                    'row_key': row_key,
+                    'default_probabilities': row_data['default_probabilities'],
+                    'current_probabilities': row_data['current_probabilities'],
+                    'available_proteins': row_data['available_proteins'],
+                    'row_details': {k: v for k, v in row_data.items() 
+                                  if k not in ['current_probabilities', 'default_probabilities', 
+                                               'marker', 'available_proteins']}
+                })
         
         return {
             "success": True,
             "modified_rows": modified_rows,
-            "count": len(modified_rows)
+            "count": len(modified_rows),
+            "version": session['version']
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error getting modified rows: {e}")
         import traceback
@@ -903,8 +1192,19 @@ async def get_modified_rows(session_key: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/master-metrics")
-def get_master_metrics(flight_number: Optional[str] = None, flight_date: Optional[str] = None):
-    """Get current master metrics configuration from CSV files, with meal-time-specific protein availability"""
+def get_master_metrics(request: Request, flight_number: Optional[str] = None, flight_date: Optional[str] = None,
+                       scope: str = 'full'):
+    """Master metrics for a flight (ETag / If-None-Match aware), see master_metrics_payload()"""
+    return cached_json_response(request, master_metrics_payload(flight_number, flight_date, scope))
+
+def master_metrics_payload(flight_number: Optional[str] = None, flight_date: Optional[str] = None,
+                           scope: str = 'full') -> dict:
+    """
+    Get current master metrics configuration from CSV files, with meal-time-specific protein availability.
+    scope='flight' sends only the factor rows the flight's passengers use; 'full' (default) sends every row.
+    """
+    if scope not in ROW_SCOPES:
+        raise HTTPException(status_code=400, detail=f"Invalid scope: {scope} (expected one of {list(ROW_SCOPES)})")
     try:
         response = {
             "nationality_importance": default_metrics.nationality_importance,
@@ -916,17 +1216,16 @@ def get_master_metrics(flight_number: Optional[str] = None, flight_date: Optiona
             "destination_sample": [],
             "mealtime_sample": [],
             "available_proteins": ['Pork', 'Chicken', 'Beef', 'Seafood', 'Lamb', 'Vegetarian'],
-            "available_proteins_by_mealtime": {}  # NEW: Meal-time-specific proteins
+            "available_proteins_by_mealtime": {},  # NEW: Meal-time-specific proteins
+            "scope": 'full'
         }
         
         # Determine available proteins BY MEAL TIME from meal data if flight info provided
         available_proteins_by_mealtime = {}
         if flight_number and flight_date:
             try:
-                meal_file = os.path.join(DATA_DIR, 'meal_df_new.csv')
-                if os.path.exists(meal_file):
-                    meal_df = pd.read_csv(meal_file)
-                    
+                meal_catalog = MEAL_CATALOG.ensure_loaded()
+                if meal_catalog.df is not None:
                     # Parse flight_number to extract origin and destination
                     if '(' in flight_number and '→' in flight_number:
                         route_part = flight_number.split('(')[1].split(')')[0]  # "AKL → SIN"
@@ -937,31 +1236,10 @@ def get_master_metrics(flight_number: Optional[str] = None, flight_date: Optiona
                         
                         # Parse date
                         target_date = pd.to_datetime(flight_date).date()
-                        meal_df['parsed_date'] = pd.to_datetime(meal_df['segment_local_departure_date'], errors='coerce').dt.date
-                        
-                        # Filter by segment and date
-                        filtered_meals = meal_df[
-                            (meal_df['segment'] == segment_filter) & 
-                            (meal_df['parsed_date'] == target_date)
-                        ]
                         
-                        if not filtered_meals.empty:
+                        if meal_catalog.meal_times(segment_filter, target_date):
                             # Get proteins PER MEAL TIME from Y cabin, or S cabin if Y not available
-                            for meal_time in filtered_meals['meal_time'].unique():
-                                time_meals = filtered_meals[filtered_meals['meal_time'] == meal_time]
-                                
-                                y_cabin_meals = time_meals[time_meals['cabin_class'] == 'Y']
-                                if not y_cabin_meals.empty:
-                                    proteins = sorted(y_cabin_meals['meal_pref'].unique().tolist())
-                                else:
-                                    s_cabin_meals = time_meals[time_meals['cabin_class'] == 'S']
-                                    if not s_cabin_meals.empty:
-                                        proteins = sorted(s_cabin_meals['meal_pref'].unique().tolist())
-                                    else:
-                                        proteins = []
-                                
-                                if proteins:
-                                    available_proteins_by_mealtime[meal_time] = proteins
+                            available_proteins_by_mealtime = meal_catalog.proteins_by_mealtime(segment_filter, target_date)
                             
                             print(f"\n=== MEAL-TIME-SPECIFIC PROTEINS ===")
                             print(f"Flight: {segment_filter} on {flight_date}")
@@ -980,72 +1258,33 @@ def get_master_metrics(flight_number: Optional[str] = None, flight_date: Optiona
                 import traceback
                 traceback.print_exc()
         
-        # Load CSV data and structure it BY MEAL TIME
-        # Each metric will be organized as: {meal_time: [rows filtered for that meal time]}
-        
-        # Define all protein columns for normalization
-        all_protein_columns = ['Pork', 'Chicken', 'Beef', 'Seafood', 'Lamb', 'Vegetarian']
-        
-        def normalize_probabilities_for_available_proteins(df, available_proteins_list):
-            """
-            Normalize protein probabilities to sum to 1.0 for each row,
-            considering only the proteins available for that specific meal time
-            """
-            df = df.copy()
-            for idx in range(len(df)):
-                # Only sum the available proteins for this meal time
-                row_total = sum(df.loc[idx, protein] for protein in available_proteins_list if protein in df.columns)
-                # Normalize only the available proteins
-                if row_total > 0:
-                    for protein in available_proteins_list:
-                        if protein in df.columns:
-                            df.loc[idx, protein] = df.loc[idx, protein] / row_total
-                # Zero out unavailable proteins
-                for protein in all_protein_columns:
-                    if protein not in available_proteins_list and protein in df.columns:
-                        df.loc[idx, protein] = 0.0
-            return df
-        
-        # Structure: response[metric_sample][meal_time] = normalized rows for that meal time
+        # Factor rows structured BY MEAL TIME: response[metric_sample][meal_time] = rows normalized
+        # over that meal time's proteins. Served from the in-memory factor tables; the normalized
+        # rows are built once per (table version, protein availability pattern) and reused.
+        factor_tables = load_csv_defaults_once()['tables']
+        row_scope = None
+        if scope == 'flight' and available_proteins_by_mealtime:
+            row_scope = flight_row_scope(flight_number, flight_date)
+            if row_scope:
+                response['scope'] = 'flight'
         response_structure = {
             'nationality_sample': {},
             'age_sample': {},
             'destination_sample': {},
             'mealtime_sample': {}
         }
-        
-        # Load Nationality.csv and split by meal time
-        nationality_file = os.path.join(DATA_DIR, 'Nationality.csv')
-        if os.path.exists(nationality_file):
-            nat_df = pd.read_csv(nationality_file)
-            for meal_time, proteins in available_proteins_by_mealtime.items():
-                # Normalize for this meal time's proteins
-                meal_time_df = normalize_probabilities_for_available_proteins(nat_df.copy(), proteins)
-                response_structure['nationality_sample'][meal_time] = meal_time_df.to_dict('records')
-        
-        # Load Age.csv and split by meal time
-        age_file = os.path.join(DATA_DIR, 'Age.csv')
-        if os.path.exists(age_file):
-            age_df = pd.read_csv(age_file)
-            for meal_time, proteins in available_proteins_by_mealtime.items():
-                meal_time_df = normalize_probabilities_for_available_proteins(age_df.copy(), proteins)
-                response_structure['age_sample'][meal_time] = meal_time_df.to_dict('records')
-        
-        # Load Destination.csv and split by meal time
-        destination_file = os.path.join(DATA_DIR, 'Destination.csv')
-        if os.path.exists(destination_file):
-            dest_df = pd.read_csv(destination_file)
-            for meal_time, proteins in available_proteins_by_mealtime.items():
-                meal_time_df = normalize_probabilities_for_available_proteins(dest_df.copy(), proteins)
-                response_structure['destination_sample'][meal_time] = meal_time_df.to_dict('records')
-        
-        # Load MealTime.csv and split by meal time (same structure for consistency)
-        mealtime_file = os.path.join(DATA_DIR, 'MealTime.csv')
-        if os.path.exists(mealtime_file):
-            meal_df = pd.read_csv(mealtime_file)
+        for metric, sample_key in (('nationality', 'nationality_sample'), ('age', 'age_sample'),
+                                   ('destination', 'destination_sample'), ('mealtime', 'mealtime_sample')):
+            table = factor_tables.get(metric)
+            if table is None:
+                continue
+            positions = scoped_positions(metric, table, row_scope[metric]) if row_scope else None
             for meal_time, proteins in available_proteins_by_mealtime.items():
-                meal_time_df = normalize_probabilities_for_available_proteins(meal_df.copy(), proteins)
-                response_structure['mealtime_sample'][meal_time] = meal_time_df.to_dict('records')
+                cols = [PROTEIN_INDEX[protein] for protein in proteins if protein in PROTEIN_INDEX]
+                records = table.normalized_records(cols)
+                response_structure[sample_key][meal_time] = (
+                    [records[pos] for pos in positions] if positions is not None else records
+                )
         
         # Update response with the meal-time-structured data
         response.update(response_structure)
@@ -1059,8 +1298,65 @@ def get_master_metrics(flight_number: Optional[str] = None, flight_date: Optiona
 
 @app.post("/api/predict")
 async def predict_meals(request: dict):
+    """Predict meal distribution (encoded directly, the result is a large nested dict)"""
+    try:
+        # Same fingerprint as the prediction cache: identical requests against the same session version
+        key = coalescing_key(*prediction_cache_key(request.get("flight_number"), request.get("flight_date"),
+                                                   request.get("master_metrics") or {}))
+    except Exception:
+        # Malformed metrics: not coalesced, prediction_payload reports the error
+        return FastJSONResponse(await prediction_payload(request))
+    return FastJSONResponse(await PREDICT_FLIGHTS.run_async(key, lambda: prediction_payload(request)))
+
+async def prediction_payload(request: dict) -> dict:
     """
-    Predict meal distribution based on master metrics
+    Predict meal distribution based on master metrics. The scoring runs on COMPUTE_POOL and the
+    per-meal-time AI summaries are awaited concurrently, so neither blocks the event loop.
+    """
+    session_key = f"{request.get('flight_number')}|{request.get('flight_date')}"
+    results, cache_key, summary_requests, ai_summary_failed = await COMPUTE_POOL.run(
+        'predict', compute_prediction, request, serial_key=session_key)
+    if cache_key is None:
+        return results
+    
+    try:
+        print(f"🤖 Generating AI summaries for each meal time...")
+        summaries = await asyncio.gather(*[call_bedrock_llm(*args) for args in summary_requests.values()],
+                                         return_exceptions=True)
+        ai_summaries = results['ai_summaries']
+        for mealTime, summary in zip(summary_requests, summaries):
+            if isinstance(summary, AISummaryUnavailable):
+                print(f"   ✗ AI summary unavailable for {mealTime}: {str(summary)}")
+                ai_summaries[mealTime] = str(summary)
+                ai_summary_failed = True
+            elif isinstance(summary, BaseException):
+                print(f"   ✗ Error generating AI summary for {mealTime}: {str(summary)}")
+                ai_summaries[mealTime] = "AI summary not available due to an error."
+                ai_summary_failed = True
+            else:
+                ai_summaries[mealTime] = summary
+                print(f"   ✓ Generated AI summary for {mealTime} ({len(summary)} chars)")
+        results['ai_summaries'] = {mealTime: ai_summaries[mealTime] for mealTime in results['meal_times']}
+        
+        print(f"✅ Step 8/8: Prediction complete!")
+        print(f"   → {results['total_passengers']} passengers, {len(results['meal_times'])} meal times")
+        print(f"   → Returning results to frontend...")
+        
+        # Don't cache a result with a failed AI summary, so the next request retries it
+        if not ai_summary_failed:
+            PREDICTION_CACHE.put(cache_key, results)
+        
+        return results
+        
+    except Exception as e:
+        print(f"Error in prediction: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def compute_prediction(request: dict) -> tuple:
+    """
+    Scoring part of a prediction (runs on a COMPUTE_POOL worker).
+    Returns (results, cache key, {meal time: call_bedrock_llm arguments}, whether building the
+    AI summary inputs failed); the cache key is None when results are final (cached or an error).
     """
     try:
         print("\n=== PREDICTION REQUEST RECEIVED ===")
@@ -1082,9 +1378,7 @@ async def predict_meals(request: dict):
             print(f"✅ USING SESSION MEMORY")
             print(f"Session Key: {session_key}")
             session = SESSION_MEMORY[session_key]
-            modified_count = sum(1 for metric_type in ['nationality', 'age', 'destination', 'mealtime']
-                               for row in session.get(metric_type, {}).values()
-                               if row['marker'] == 'user_modified')
+            modified_count = sum(session[metric_type].modified_count() for metric_type in SCORING_METRICS)
             print(f"Modified rows in session: {modified_count}")
             print(f"{'='*60}\n")
         else:
@@ -1093,6 +1387,14 @@ async def predict_meals(request: dict):
             print(f"Using CSV defaults as fallback")
             print(f"{'='*60}\n")
         
+        # Return the cached result if nothing it depends on has changed
+        cache_key = prediction_cache_key(flight_number, flight_date, master_metrics)
+        cached_result = PREDICTION_CACHE.get(cache_key)
+        if cached_result is not None:
+            print(f"✅ predict_meals() ----------- Returning cached prediction for {session_key} "
+                  f"(hits: {PREDICTION_CACHE.hits}, misses: {PREDICTION_CACHE.misses})")
+            return cached_result, None, {}, False
+        
         # Get weights (convert from percentage to decimal)
         nat_weight = master_metrics.get('nationality_importance', 40.0)
         age_weight = master_metrics.get('age_importance', 20.0)
@@ -1128,6 +1430,7 @@ async def predict_meals(request: dict):
         csv_destination_probs = csv_cache['destination']
         csv_mealtime_probs = csv_cache['mealtime']
         csv_nationality_reasoning = csv_cache.get('nationality_reasoning', {})
+        csv_nationality_sources = csv_cache.get('nationality_sources', {})
         csv_age_reasoning = csv_cache.get('age_reasoning', {})
         csv_destination_reasoning = csv_cache.get('destination_reasoning', {})
         csv_mealtime_reasoning = csv_cache.get('mealtime_reasoning', {})
@@ -1159,67 +1462,20 @@ async def predict_meals(request: dict):
             print(f"🔄 Using CSV defaults - {len(nationality_probs)} nationality entries loaded")
         print("=" * 50 + "\n")
         
-        # Load Destination.csv for airport code to region mapping
-        destination_file = os.path.join(DATA_DIR, 'Destination.csv')
-        destination_df = pd.read_csv(destination_file)
-        airport_to_region = dict(zip(destination_df['airport_code'], destination_df['destination_region']))
-        
-        # Load customer data
-        customers_file = os.path.join(DATA_DIR, 'customers.csv')
-        df = pd.read_csv(customers_file, dtype={'age_group': str}, low_memory=False)
-        
-        # Fix age group
-        if 'age_group' in df.columns:
-            df['age_group'] = df['age_group'].replace('Feb-18', '2-18')
-        
-        # Parse date
-        target_date = pd.to_datetime(flight_date).date()
-        
-        # Extract just the flight number from format "SQ 0024 (SIN → JFK)"
-        # The CSV contains just "SQ 0024" in operating_flight_number column
-        if '(' in flight_number:
-            actual_flight_number = flight_number.split('(')[0].strip()
-        else:
-            actual_flight_number = flight_number.strip()
+        # Passengers, segment, cabin and meals of this flight+date
+        context = flight_prediction_context(flight_number, flight_date)
+        if context is None:
+            return {"error": "No passenger data found"}, None, {}, False
+        target_date = context['target_date']
+        flight_data = context['flight_data']
+        segment = context['segment']
+        cabin = context['cabin']
+        destination_airport = context['destination_airport']
+        destination_region = context['destination_region']
+        flight_meals = context['flight_meals']
         
         print(f"Target date: {target_date}")
-        print(f"Looking for flight: '{actual_flight_number}'")
-        
-        # Filter by flight - just strip whitespace
-        flight_data = df[df['operating_flight_number'].astype(str).str.strip() == actual_flight_number]
-        
-        print(f"Found {len(flight_data)} rows before date filter")
-        
-        # Parse and filter by date
-        flight_data['parsed_date'] = pd.to_datetime(
-            flight_data['segment_local_departure_datetime'].str.split().str[0],
-            format='%d/%m/%Y',
-            dayfirst=True,
-            errors='coerce'
-        ).dt.date
-        
-        print(f"Sample dates from CSV: {flight_data['parsed_date'].head(5).tolist()}")
-        print(f"Looking for target date: {target_date}")
-        
-        flight_data = flight_data[flight_data['parsed_date'] == target_date]
-        
-        # Remove Under 2 age group
-        flight_data = flight_data[flight_data['age_group'] != 'Under 2']
-        
-        # Select cabin class based on segment (matching meal_planning.py logic)
-        # SIN JFK uses S (business) class, all others use Y (economy) class
-        segment = flight_data['segment'].iloc[0] if not flight_data.empty else ""
-        if segment == "SIN JFK":
-            flight_data = flight_data[flight_data['cabin_class'] == 'S']
-        else:
-            flight_data = flight_data[flight_data['cabin_class'] == 'Y']
-        
-        if flight_data.empty:
-            return {"error": "No passenger data found"}
-        
-        # Extract destination airport code from segment (e.g., "SIN MAA" → "MAA")
-        destination_airport = segment.split()[-1] if ' ' in segment else segment
-        destination_region = airport_to_region.get(destination_airport, destination_airport)
+        print(f"Found {len(flight_data)} {cabin} cabin passengers (Under 2 removed)")
         
         print(f"\n=== DESTINATION LOOKUP ===")
         print(f"Segment: {segment}")
@@ -1227,12 +1483,7 @@ async def predict_meals(request: dict):
         print(f"Destination Region: {destination_region}")
         print("=" * 50 + "\n")
         
-        # Add weekday
-        flight_data['weekday'] = pd.to_datetime(
-            flight_data['segment_local_departure_datetime'],
-            format='%d/%m/%Y %H:%M',
-            dayfirst=True
-        ).dt.day_name()
+        # Weekday is pre-computed from the departure date when the manifest is loaded
         
         print(f"\n=== FLIGHT DATE & WEEKDAY CALCULATION ===")
         print(f"Selected Date: {target_date}")
@@ -1240,192 +1491,33 @@ async def predict_meals(request: dict):
         print(f"This weekday will be used for nationality-based probability lookup")
         print("=" * 50 + "\n")
         
-        # Get available meals for this flight
-        meal_file = os.path.join(DATA_DIR, 'meal_df_new.csv')
-        meal_df = pd.read_csv(meal_file)
-        meal_df['parsed_date'] = pd.to_datetime(meal_df['segment_local_departure_date'], errors='coerce').dt.date
-        
-        # Get segment and cabin from flight (segment already extracted above)
-        cabin = flight_data['cabin_class'].iloc[0]
-        
-        # Get meals for this flight
-        flight_meals = meal_df[(meal_df['segment'] == segment) & 
-                               (meal_df['parsed_date'] == target_date) &
-                               (meal_df['cabin_class'] == cabin)]
-        
         print(f"\n=== AVAILABLE MEALS FOR THIS FLIGHT ===")
         print(f"Segment: {segment}, Date: {target_date}, Cabin: {cabin}")
-        print(f"Total meal records found: {len(flight_meals)}")
-        if not flight_meals.empty:
-            for meal_time in flight_meals['meal_time'].unique():
-                time_meals = flight_meals[flight_meals['meal_time'] == meal_time]
-                proteins = time_meals['meal_pref'].unique().tolist()
-                print(f"  {meal_time}: {proteins}")
+        print(f"Total meal records found: {sum(len(entry['meals']) for entry in flight_meals.values())}")
+        for meal_time, entry in flight_meals.items():
+            print(f"  {meal_time}: {list(dict.fromkeys(entry['meal_prefs']))}")
         print("=" * 50 + "\n")
         
-        # Create feature_set column (matching meal_planning.py line 218-222)
-        flight_data['feature_set'] = (
-            flight_data['nationality_code'].astype(str) + '_' +
-            flight_data['age_group'].astype(str) + '_' +
-            flight_data['destination_region'].astype(str) + '_' +
-            flight_data['meal_time'].astype(str)
+        # Group passengers and gather each metric's probabilities for every group
+        destination = destination_region
+        scoring_inputs = score_passenger_groups(context, session if use_session_memory else None)
+        scored_groups = scoring_inputs['groups']
+        group_proteins = scoring_inputs['group_proteins']
+        factors = scoring_inputs['factors']
+        
+        # Blend + largest remainder counts for every group, kept in the session so
+        # probability edits can re-score just the affected groups
+        print(f"🔄 Processing {len(scored_groups)} passenger groups...")
+        prediction = SessionPrediction(
+            scored_groups['meal_time'], scored_groups['passenger_count'], scoring_inputs['slots'], factors,
+            scoring_inputs['session_keys'], [W1, W2, W3, W4],
+            {meal_time: entry['proteins'] for meal_time, entry in flight_meals.items()}
         )
-        
-        # Group passengers (matching meal_planning.py line 211-213 exactly)
-        # IMPORTANT: Order of groupby columns affects iteration order!
-        grouped = flight_data.groupby([
-            'segment', 'cabin_class', 'parsed_date', 'weekday', 'feature_set'
-        ]).size().reset_index(name='passenger_count')
-        
-        # Get feature details for each feature_set
-        feature_details = flight_data.groupby('feature_set').agg({
-            'nationality_code': 'first',
-            'age_group': 'first',
-            'destination_region': 'first',
-            'meal_time': 'first'
-        }).reset_index()
-        
-        grouped = grouped.merge(feature_details, on='feature_set', how='left')
-        
-        # Process each group
-        results_by_mealtime = {}
-        print(f"🔄 Processing {len(grouped)} passenger groups...")
-        
-        # Track unique nationality+weekday combinations for logging
-        nat_weekday_combinations = set()
-        
-        # Track meal-time-specific proteins for logging
-        mealtime_proteins_used = {}
-        
-        for _, group in grouped.iterrows():
-            meal_time = group['meal_time']
-            nationality = group['nationality_code']
-            age_group = group['age_group']
-            # Use destination_region from segment lookup instead of customer CSV
-            destination = destination_region
-            weekday = group['weekday']
-            passenger_count = group['passenger_count']
-            
-            # Track for logging
-            nat_weekday_combinations.add(f"{nationality}_{weekday}")
-            
-            # Get available proteins for this meal time
-            time_meals = flight_meals[flight_meals['meal_time'] == meal_time]
-            if time_meals.empty:
-                continue
-            
-            # IMPORTANT: Sort alphabetically for deterministic ordering
-            # .unique().tolist() can have non-deterministic order in some pandas versions
-            # Alphabetical sort ensures consistent tie-breaking in largest remainder method
-            available_proteins = sorted(time_meals['meal_pref'].unique().tolist())
-            
-            # Track meal-time-specific proteins
-            if meal_time not in mealtime_proteins_used:
-                mealtime_proteins_used[meal_time] = sorted(available_proteins)
-            
-            # Get probabilities for each metric
-            # PRIORITY: Session Memory > CSV Cache
-            
-            # Nationality (with weekday and meal_time)
-            nat_key = f"{nationality}_{weekday}_{meal_time}"
-            if use_session_memory and nat_key in session['nationality']:
-                nat_prob_dict = session['nationality'][nat_key]['current_probabilities']
-            else:
-                # Fallback to CSV cache (old format without meal_time)
-                csv_key = f"{nationality}_{weekday}"
-                nat_prob_dict = csv_nationality_probs.get(csv_key, {})
-                # Normalize for available proteins
-                if nat_prob_dict:
-                    nat_prob_dict = normalize_probabilities_for_proteins(nat_prob_dict, available_proteins)
-                if not nat_prob_dict:
-                    print(f"⚠️  WARNING: No probability data found for {nat_key}")
-            
-            # Age (meal-time-specific)
-            age_key = f"{age_group}_{meal_time}"
-            if use_session_memory and age_key in session['age']:
-                age_prob_dict = session['age'][age_key]['current_probabilities']
-            else:
-                # Fallback to CSV cache
-                age_prob_dict = csv_age_probs.get(age_group, {})
-                # Normalize for available proteins
-                if age_prob_dict:
-                    age_prob_dict = normalize_probabilities_for_proteins(age_prob_dict, available_proteins)
-                if not age_prob_dict:
-                    print(f"⚠️  WARNING: No probability data found for age {age_group}")
-            
-            # Destination (meal-time-specific)
-            dest_key = f"{destination}_{meal_time}"
-            if use_session_memory and dest_key in session['destination']:
-                dest_prob_dict = session['destination'][dest_key]['current_probabilities']
-            else:
-                # Fallback to CSV cache
-                dest_prob_dict = csv_destination_probs.get(destination, {})
-                # Normalize for available proteins
-                if dest_prob_dict:
-                    dest_prob_dict = normalize_probabilities_for_proteins(dest_prob_dict, available_proteins)
-                if not dest_prob_dict:
-                    print(f"⚠️  WARNING: No probability data found for destination {destination}")
-            
-            # Meal time
-            if use_session_memory and meal_time in session['mealtime']:
-                meal_prob_dict = session['mealtime'][meal_time]['current_probabilities']
-            else:
-                # Fallback to CSV cache
-                meal_prob_dict = csv_mealtime_probs.get(meal_time, {})
-                # Normalize for available proteins
-                if meal_prob_dict:
-                    meal_prob_dict = normalize_probabilities_for_proteins(meal_prob_dict, available_proteins)
-                if not meal_prob_dict:
-                    print(f"⚠️  WARNING: No probability data found for meal time {meal_time}")
-            
-            # Calculate weighted probabilities
-            weighted_probs = {}
-            for protein in available_proteins:
-                weighted_prob = (
-                    nat_prob_dict.get(protein, 0) * W1 +
-                    age_prob_dict.get(protein, 0) * W2 +
-                    dest_prob_dict.get(protein, 0) * W3 +
-                    meal_prob_dict.get(protein, 0) * W4
-                )
-                weighted_probs[protein] = weighted_prob
-
-            # Normalize
-            total = sum(weighted_probs.values())
-            if total > 0:
-                final_probs = {p: v/total for p, v in weighted_probs.items()}
-            else:
-                final_probs = {p: 1.0/len(available_proteins) for p in available_proteins}
-            
-            # Calculate counts using largest remainder method
-            protein_counts = {}
-            remainders = {}
-            exact_counts = {}
-            
-            for protein in available_proteins:
-                exact = passenger_count * final_probs[protein]
-                exact_counts[protein] = exact
-                floor_count = int(exact)
-                protein_counts[protein] = floor_count
-                remainders[protein] = exact - floor_count
-            
-            # Distribute remaining passengers using largest remainder method
-            total_allocated = sum(protein_counts.values())
-            remaining = passenger_count - total_allocated
-            
-            if remaining > 0:
-                # Use stable sort (preserves input order on ties)
-                sorted_proteins = sorted(available_proteins, key=lambda p: remainders[p], reverse=True)
-                for i in range(remaining):
-                    protein_counts[sorted_proteins[i]] += 1
-            
-            # Add to results
-            if meal_time not in results_by_mealtime:
-                results_by_mealtime[meal_time] = {}
-            
-            for protein, count in protein_counts.items():
-                if protein not in results_by_mealtime[meal_time]:
-                    results_by_mealtime[meal_time][protein] = 0
-                results_by_mealtime[meal_time][protein] += count
+        if use_session_memory:
+            session['prediction'] = prediction
+            session['weights'] = prediction.weights
+        final_probs_matrix = prediction.final
+        results_by_mealtime = prediction.meal_time_counts()
         
         print(f"✅ Finished processing all passenger groups")
         
@@ -1449,7 +1541,7 @@ async def predict_meals(request: dict):
         sorted_original_counts = {meal_time: dict(sorted(proteins.items())) for meal_time, proteins in original_counts_by_mealtime.items()}
         
         # Calculate top nationalities with reasoning for AI summary
-        nationality_counts = flight_data.groupby('nationality_code').size().reset_index(name='count')
+        nationality_counts = flight_data.groupby('nationality_code', observed=True).size().reset_index(name='count')
         nationality_counts = nationality_counts.sort_values('count', ascending=False).head(5)
         total_passengers_count = len(flight_data)
         
@@ -1466,17 +1558,8 @@ async def predict_meals(request: dict):
             nat_key = f"{nat_code}_{flight_weekday}"
             reasoning = csv_nationality_reasoning.get(nat_key, "")
             
-            # Get sources if available (from Nationality.csv)
-            sources = ""
-            if nat_key in nationality_probs:
-                # Try to get sources from original CSV
-                nationality_file = os.path.join(DATA_DIR, 'Nationality.csv')
-                if os.path.exists(nationality_file):
-                    nat_df = pd.read_csv(nationality_file)
-                    nat_record = nat_df[(nat_df['nationality_code'] == nat_code) & 
-                                       (nat_df['day_of_week'] == flight_weekday)]
-                    if not nat_record.empty and 'sources' in nat_record.columns:
-                        sources = str(nat_record.iloc[0]['sources']) if pd.notna(nat_record.iloc[0]['sources']) else ""
+            # Get sources if available (from Nationality.csv, loaded with the factor tables)
+            sources = csv_nationality_sources.get(nat_key, "") if nat_key in nationality_probs else ""
             
             top_nationalities.append({
                 'nationality_code': nat_code,
@@ -1493,102 +1576,54 @@ async def predict_meals(request: dict):
                 print(f"    Reasoning: {nat['reasoning'][:100]}...")
         print("=" * 50 + "\n")
         
-        # Format passenger details for AI summary
+        # Format passenger details for AI summary from the same arrays that produced the counts
+        # (session-aware factor rows, alphabetical proteins)
         passenger_details_list = []
-        for _, group in grouped.iterrows():
-            meal_time = group['meal_time']
-            nationality = group['nationality_code']
-            age_group = group['age_group']
-            # Use destination_region from segment lookup instead of customer CSV
-            destination = destination_region
-            weekday = group['weekday']
-            passenger_count = group['passenger_count']
-            
-            # Get available proteins for this meal time
-            time_meals = flight_meals[flight_meals['meal_time'] == meal_time]
-            if time_meals.empty:
-                continue
+        final_rows = final_probs_matrix.tolist()
+        metric_rows = {metric: factor.tolist() for metric, factor in zip(SCORING_METRICS, factors)}
+        for i, group in enumerate(scored_groups.itertuples(index=False)):
+            meal_time = group.meal_time
+            nationality = group.nationality_code
+            age_group = group.age_group
+            weekday = group.weekday
+            available_proteins = group_proteins[i]
+            cols = [PROTEIN_INDEX[protein] for protein in available_proteins]
             
-            available_proteins = time_meals['meal_pref'].unique().tolist()
+            def by_protein(row):
+                return {protein: row[col] for protein, col in zip(available_proteins, cols)}
             
-            # Get probabilities for each metric
+            final_probs = by_protein(final_rows[i])
+            metric_probabilities = {  # Individual metric probabilities for AI analysis
+                'nationality': by_protein(metric_rows['nationality'][i]),
+                'age': by_protein(metric_rows['age'][i]),
+                'destination': by_protein(metric_rows['destination'][i]),
+                'meal_time': by_protein(metric_rows['mealtime'][i])
+            }
             nat_key = f"{nationality}_{weekday}"
-            nat_prob_dict = nationality_probs.get(nat_key, {})
-            # Normalize for available proteins if using CSV defaults
-            if nat_prob_dict and not has_custom_probs:
-                nat_prob_dict = normalize_probabilities_for_proteins(nat_prob_dict, available_proteins)
-            
-            age_key = f"{age_group}_{meal_time}"
-            age_prob_dict = age_probs.get(age_key, {})
-            if not age_prob_dict:
-                age_prob_dict = age_probs.get(age_group, {})
-            # Normalize for available proteins if using CSV defaults
-            if age_prob_dict and not has_custom_probs:
-                age_prob_dict = normalize_probabilities_for_proteins(age_prob_dict, available_proteins)
-            
-            dest_key = f"{destination}_{meal_time}"
-            dest_prob_dict = destination_probs.get(dest_key, {})
-            if not dest_prob_dict:
-                dest_prob_dict = destination_probs.get(destination, {})
-            # Normalize for available proteins if using CSV defaults
-            if dest_prob_dict and not has_custom_probs:
-                dest_prob_dict = normalize_probabilities_for_proteins(dest_prob_dict, available_proteins)
-            
-            meal_prob_dict = mealtime_probs.get(meal_time, {})
-            # Normalize for available proteins if using CSV defaults
-            if meal_prob_dict and not has_custom_probs:
-                meal_prob_dict = normalize_probabilities_for_proteins(meal_prob_dict, available_proteins)
             
             # DEBUG: Log first group's probabilities
-            if len(passenger_details_list) == 0:  # Log only for the very first group
+            if i == 0:
                 print(f"\n🔍 DEBUG: Probabilities for FIRST passenger group:")
                 print(f"   Nationality: {nationality}, Weekday: {weekday}")
-                print(f"   Nationality key: {nat_key}")
-                print(f"   Nationality probs: {nat_prob_dict}")
+                print(f"   Nationality probs: {metric_probabilities['nationality']}")
                 print(f"   Age: {age_group}, Meal time: {meal_time}")
-                print(f"   Age key: {age_key}")
-                print(f"   Age probs: {age_prob_dict}")
+                print(f"   Age probs: {metric_probabilities['age']}")
                 print(f"   Destination: {destination}")
-                print(f"   Dest key: {dest_key}")
-                print(f"   Dest probs: {dest_prob_dict}")
-                print(f"   Meal time: {meal_time}")
-                print(f"   Meal probs: {meal_prob_dict}")
+                print(f"   Dest probs: {metric_probabilities['destination']}")
+                print(f"   Meal probs: {metric_probabilities['meal_time']}")
                 print(f"   Available proteins: {available_proteins}")
                 print(f"   Weights: W1={W1}, W2={W2}, W3={W3}, W4={W4}\n")
             
-            # Calculate weighted probabilities for this group
-            weighted_probs = {}
-            for protein in available_proteins:
-                weighted_prob = (
-                    nat_prob_dict.get(protein, 0) * W1 +
-                    age_prob_dict.get(protein, 0) * W2 +
-                    dest_prob_dict.get(protein, 0) * W3 +
-                    meal_prob_dict.get(protein, 0) * W4
-                )
-                weighted_probs[protein] = weighted_prob
-            
-            # Normalize
-            total = sum(weighted_probs.values())
-            if total > 0:
-                final_probs = {p: v/total for p, v in weighted_probs.items()}
-            else:
-                final_probs = {p: 1.0/len(available_proteins) for p in available_proteins}
-            
             passenger_details_list.append({
                 'nationality': nationality,
                 'age_group': age_group,
                 'destination': f"{destination_airport} ({destination})",  # e.g., "MAA (South Asia)"
                 'meal_time': meal_time,
                 'weekday': weekday,
-                'count': int(passenger_count),
+                'count': int(group.passenger_count),
                 'probabilities': final_probs,
-                'metric_probabilities': {  # NEW: Individual metric probabilities for AI analysis
-                    'nationality': {protein: nat_prob_dict.get(protein, 0) for protein in available_proteins},
-                    'age': {protein: age_prob_dict.get(protein, 0) for protein in available_proteins},
-                    'destination': {protein: dest_prob_dict.get(protein, 0) for protein in available_proteins},
-                    'meal_time': {protein: meal_prob_dict.get(protein, 0) for protein in available_proteins}
-                },
-                'reasoning': {  # NEW: Cultural/behavioral insights from CSV reasoning columns
+                'metric_probabilities': metric_probabilities,
+                'reasoning': {  # Cultural/behavioral insights from CSV reasoning columns
                     'nationality': csv_nationality_reasoning.get(nat_key, ''),
                     'age': csv_age_reasoning.get(age_group, ''),
                     'destination': csv_destination_reasoning.get(destination, ''),
@@ -1596,9 +1631,11 @@ async def predict_meals(request: dict):
                 }
             })
         
-        # Generate AI summaries for each meal time (do this during prediction for faster UX)
-        print(f"🤖 Generating AI summaries for each meal time...")
+        # Inputs of the AI summary for each meal time (generated during prediction for faster UX,
+        # awaited by prediction_payload once the scoring is done)
+        summary_requests = {}
         ai_summaries = {}
+        ai_summary_failed = False
         for mealTime in sorted_meal_times.keys():
             try:
                 # Build passenger groups for this meal time - convert dicts to Pydantic models
@@ -1635,8 +1672,7 @@ async def predict_meals(request: dict):
                 # Get original counts for this meal time
                 originalCountsForMealTime = sorted_original_counts.get(mealTime, {})
                 
-                # Call AI summary generation
-                summary = call_bedrock_llm(
+                summary_requests[mealTime] = (
                     passengerGroups,
                     {
                         "nationality_importance": nat_weight,
@@ -1648,11 +1684,10 @@ async def predict_meals(request: dict):
                     originalCountsForMealTime,
                     topNationalitiesModels
                 )
-                ai_summaries[mealTime] = summary
-                print(f"   ✓ Generated AI summary for {mealTime} ({len(summary)} chars)")
             except Exception as e:
                 print(f"   ✗ Error generating AI summary for {mealTime}: {str(e)}")
                 ai_summaries[mealTime] = "AI summary not available due to an error."
+                ai_summary_failed = True
         
         # Format results
         print(f"📊 Formatting final results...")
@@ -1672,19 +1707,95 @@ async def predict_meals(request: dict):
                 "mealtime_importance": meal_weight
             },
             "top_nationalities": top_nationalities,  # Add top nationalities with reasoning
-            "ai_summaries": ai_summaries  # Add pre-generated AI summaries
+            "ai_summaries": ai_summaries  # Add pre-generated AI summaries (filled in by prediction_payload)
         }
         
-        print(f"✅ Step 8/8: Prediction complete!")
-        print(f"   → {results['total_passengers']} passengers, {len(results['meal_times'])} meal times")
-        print(f"   → Returning results to frontend...")
-        
-        return results
+        return results, cache_key, summary_requests, ai_summary_failed
         
     except Exception as e:
         print(f"Error in prediction: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/predict-batch")
+def predict_batch(request: dict):
+    """
+    Predict per-meal loading counts for every flight in a date range (whole network in one pass).
+    Uses the CSV default probabilities (session edits are per flight and not applied).
+    Request: {"start_date", "end_date" (optional), "segments" (optional), "cabins" (optional),
+              "format": "csv" | "parquet", "master_metrics" (optional importance weights)}
+    Streams one row per flight/date/cabin/meal time/protein.
+    """
+    try:
+        start_date = request.get("start_date")
+        end_date = request.get("end_date") or start_date
+        segments = request.get("segments") or None
+        cabins = request.get("cabins") or None
+        output_format = (request.get("format") or "csv").lower()
+        master_metrics = request.get("master_metrics") or {}
+
+        if not start_date:
+            raise HTTPException(status_code=400, detail="start_date required")
+        if output_format not in BATCH_OUTPUT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format: {output_format} (use csv or parquet)")
+        if output_format == 'parquet' and not parquet_available():
+            raise HTTPException(status_code=400, detail="Parquet output needs pyarrow installed on the server")
+
+        # Same weights as /api/predict (percentages)
+        weights = (
+            master_metrics.get('nationality_importance', 40.0) / 100.0,
+            master_metrics.get('age_importance', 20.0) / 100.0,
+            master_metrics.get('destination_importance', 25.0) / 100.0,
+            master_metrics.get('mealtime_importance', 15.0) / 100.0,
+        )
+
+        store = CUSTOMER_STORE.ensure_loaded()
+        if store.df is None:
+            raise HTTPException(status_code=404, detail=store.error)
+        meal_catalog = MEAL_CATALOG.ensure_loaded()
+        if meal_catalog.df is None:
+            raise HTTPException(status_code=404, detail=meal_catalog.error)
+        factor_tables = load_csv_defaults_once()['tables']
+
+        print(f"\n🔄 predict_batch() ----------- {start_date} → {end_date}, segments={segments}, cabins={cabins}")
+        results = predict_network(store, meal_catalog, factor_tables, start_date, end_date,
+                                  segments=segments, cabins=cabins, weights=weights)
+        print(f"✅ predict_batch() ----------- {len(results)} rows")
+
+        media_type, extension = BATCH_OUTPUT_FORMATS[output_format]
+        headers = {"Content-Disposition": f'attachment; filename="meal_predictions_{start_date}_{end_date}.{extension}"'}
+        if output_format == 'parquet':
+            return Response(content=to_parquet_bytes(results), media_type=media_type, headers=headers)
+        return StreamingResponse(iter_csv(results), media_type=media_type, headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in batch prediction: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/cache-stats")
+def get_cache_stats():
+    """
+    Hit/miss/eviction counters and size of every result cache (by name) and of session memory,
+    how many identical concurrent requests were coalesced per endpoint, and the compute pool's
+    running/queued requests per endpoint
+    """
+    return {**cache_stats(), "sessions": SESSION_MEMORY.stats(), "coalescing": coalescing_stats(),
+            "compute": COMPUTE_POOL.stats()}
+
+@app.get("/api/data-versions")
+def get_data_versions():
+    """Data version, per-file fingerprints (mtime, size, content hash) and rebuild counters"""
+    return DATA_VERSIONS.stats()
+
+@app.post("/api/data-versions/check")
+def check_data_versions():
+    """Check the data files now (without waiting for them to settle) and swap in any changes"""
+    swapped = DATA_VERSIONS.check(force=True)
+    return {"swapped": swapped, **DATA_VERSIONS.stats()}
+
 @app.get("/api/workflow-steps")
 async def get_workflow_steps():
     """Get the workflow steps for the prediction process"""
@@ -1703,6 +1814,10 @@ async def get_workflow_steps():
 
 @app.post("/api/save-custom-metrics")
 async def save_custom_metrics(request: dict):
+    """Validate user-customized probability metrics (on COMPUTE_POOL, see save_custom_metrics_payload)"""
+    return await COMPUTE_POOL.run('save_custom_metrics', save_custom_metrics_payload, request)
+
+def save_custom_metrics_payload(request: dict) -> dict:
     """
     Save user-customized probability metrics to persistent storage.
     NOTE: This NEVER modifies the original CSV files - only saves to JSON.
@@ -1898,6 +2013,8 @@ async def save_custom_metrics(request: dict):
             "success": True, 
             "message": "Metrics validated successfully"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error validating custom metrics: {str(e)}")
         import traceback
@@ -1906,4 +2023,12 @@ async def save_custom_metrics(request: dict):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # UVICORN_WORKERS > 1 needs a shared STATE_BACKEND_URL (sqlite:// or redis://)
+    workers = int(os.getenv('UVICORN_WORKERS', '1'))
+    if workers > 1 and not STATE_BACKEND.shared:
+        print("⚠️  UVICORN_WORKERS > 1 with memory:// state: sessions and caches are not shared, using 1 worker")
+        workers = 1
+    if workers > 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=8001, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
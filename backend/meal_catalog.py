@@ -0,0 +1,134 @@
+"""
+Shared meal catalog (meal_df_new.csv).
+
+Loaded once and indexed by (segment, date, cabin_class, meal_time) so endpoints and the
+batch engine look meals up by key instead of re-reading the CSV and boolean-filtering it.
+Each entry holds the meal rows in file order, their protein list (file order, duplicates
+kept) and the sorted unique proteins. The Y-then-S display cabin used by the flight
+screens is resolved once at load.
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+
+class MealCatalog:
+    def __init__(self, meal_file: str = None):
+        self.meal_file = meal_file
+        self.df = None
+        self.error = None
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._entries = {}        # (segment, date, cabin_class, meal_time) -> entry
+        self._meal_times = {}     # (segment, date) -> meal times in file order
+        self._cabin_meal_times = {}  # (segment, date, cabin_class) -> meal times in file order
+        self._display = {}        # (segment, date, meal_time) -> Y entry, else S entry
+
+    def __getstate__(self):
+        # Locks can't be pickled (e.g. when sent to worker processes)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, meal_df: pd.DataFrame):
+        """Build a catalog from an already loaded meal frame (dates already parsed to date objects)"""
+        catalog = cls()
+        catalog._build(meal_df.reset_index(drop=True))
+        catalog.loaded = True
+        return catalog
+
+    def load(self):
+        """Read meal_df_new.csv and build the index (replaces any previously loaded catalog)"""
+        if not os.path.exists(self.meal_file):
+            self.df = None
+            self.error = "Meal data file not found"
+            self.loaded = True
+            return self
+
+        print(f"📂 MealCatalog.load() ----------- Loading meal catalog: {self.meal_file}")
+        df = pd.read_csv(self.meal_file)
+        # Parse the departure date once (stored as datetime strings in the CSV)
+        df['segment_local_departure_date'] = pd.to_datetime(df['segment_local_departure_date'], errors='coerce').dt.date
+        self._build(df)
+        self.error = None
+        self.loaded = True
+        print(f"✅ MealCatalog.load() ----------- {len(df)} meals, {len(self._entries)} (segment, date, cabin, meal time) keys")
+        return self
+
+    def ensure_loaded(self):
+        """Load the catalog on first use (thread-safe)"""
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        print(f"❌ MealCatalog.load() failed: {e}")
+                        self.df = None
+                        self.error = str(e)
+                        self.loaded = True
+        return self
+
+    def _build(self, df: pd.DataFrame):
+        entries = {}
+        meal_times = {}
+        cabin_meal_times = {}
+        records = df[['segment', 'segment_local_departure_date', 'cabin_class', 'meal_time',
+                      'meal_name', 'meal_pref']].itertuples(index=False, name=None)
+        for segment, date, cabin_class, meal_time, meal_name, meal_pref in records:
+            key = (segment, date, cabin_class, meal_time)
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = {'meals': [], 'meal_prefs': []}
+                times = meal_times.setdefault((segment, date), [])
+                if meal_time not in times:
+                    times.append(meal_time)
+                cabin_meal_times.setdefault((segment, date, cabin_class), []).append(meal_time)
+            entry['meals'].append({"cabin_class": cabin_class, "meal_name": meal_name, "meal_pref": meal_pref})
+            entry['meal_prefs'].append(meal_pref)
+
+        for entry in entries.values():
+            entry['proteins'] = sorted(set(entry['meal_prefs']))
+
+        # Resolve the display cabin once: Y if it has meals for that meal time, otherwise S
+        display = {}
+        for (segment, date), times in meal_times.items():
+            for meal_time in times:
+                entry = entries.get((segment, date, 'Y', meal_time)) or entries.get((segment, date, 'S', meal_time))
+                display[(segment, date, meal_time)] = entry
+
+        self.df = df
+        self._entries = entries
+        self._meal_times = meal_times
+        self._cabin_meal_times = cabin_meal_times
+        self._display = display
+
+    def lookup(self, segment: str, date, cabin_class: str, meal_time: str):
+        """Catalog entry for one segment/date/cabin/meal time, or None"""
+        return self._entries.get((segment, date, cabin_class, meal_time))
+
+    def meal_times(self, segment: str, date, cabin_class: str = None) -> list:
+        """Meal times served on a segment+date (optionally for one cabin), in file order"""
+        if cabin_class is None:
+            return list(self._meal_times.get((segment, date), []))
+        return list(self._cabin_meal_times.get((segment, date, cabin_class), []))
+
+    def display_entry(self, segment: str, date, meal_time: str):
+        """Y cabin entry for a meal time, falling back to S cabin (None if neither exists)"""
+        return self._display.get((segment, date, meal_time))
+
+    def proteins_by_mealtime(self, segment: str, date) -> dict:
+        """{meal_time: sorted proteins} for a segment+date using the Y-then-S display cabin"""
+        proteins_by_mealtime = {}
+        for meal_time in self._meal_times.get((segment, date), []):
+            entry = self._display.get((segment, date, meal_time))
+            if entry and entry['proteins']:
+                proteins_by_mealtime[meal_time] = entry['proteins']
+        return proteins_by_mealtime
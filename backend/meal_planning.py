@@ -2,8 +2,8 @@
 ##Mains logics that are used from here are
 '''
 
-1. _get_restricted_probabilities()
-Note: _get_restricted_probabilities_with_weekday() --> note have change this in main.py use. 
+1. Restricted probabilities per feature (now factor_tables.FactorTable, also used by main.py)
+Note: nationality is looked up by (nationality_code, weekday).
 
 2. process_passengers(self, passenger_df: pd.DataFrame) --> this where the main probability X weights happen. 
  Though the purpose of this function is the same, the way the logic is used and rendered is different in main.py Here it is processing whole csv. In main.py it is looking at individual flights and dates.
@@ -14,8 +14,29 @@ Note: _get_restricted_probabilities_with_weekday() --> note have change this in
 
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Tuple
 
+from meal_catalog import MealCatalog
+from factor_tables import FactorTable
+from scoring import PROTEIN_INDEX, protein_slots, blend, apportion
+
+
+# Columns identifying one result row group (flight segment, cabin, date, meal time)
+RESULT_KEYS = ['segment', 'cabin_class', 'segment_local_departure_date', 'weekday', 'meal_time']
+
+# Set once in each worker process by _init_worker (parallel process_passengers)
+_WORKER_SYSTEM = None
+
+
+def _init_worker(system):
+    global _WORKER_SYSTEM
+    _WORKER_SYSTEM = system
+
+
+def _process_shard(shard_df: pd.DataFrame) -> pd.DataFrame:
+    return _WORKER_SYSTEM._process_prepared(shard_df)
+
 
 class MealPlanningSystem:
     def __init__(self, 
@@ -23,7 +44,8 @@ class MealPlanningSystem:
                  nationality_weights_path: str,
                  age_weights_path: str,
                  destination_weights_path: str,
-                 mealtime_weights_path: str):
+                 mealtime_weights_path: str,
+                 meal_catalog: MealCatalog = None):
         
         # Load weight data
         self.nationality_w = pd.read_csv(nationality_weights_path)
@@ -31,162 +53,94 @@ class MealPlanningSystem:
         self.destination_w = pd.read_csv(destination_weights_path)
         self.mealtime_w = pd.read_csv(mealtime_weights_path)
         
-        # Load meal data
-        self.meal_df = pd.read_excel(meal_df_path)
-        ## change dt format to match customer df
-        self.meal_df['segment_local_departure_date'] = pd.to_datetime(self.meal_df['segment_local_departure_date']).dt.date
+        # Load meal data (or share an already loaded catalog, e.g. the API's)
+        if meal_catalog is None:
+            self.meal_df = pd.read_excel(meal_df_path)
+            ## change dt format to match customer df
+            self.meal_df['segment_local_departure_date'] = pd.to_datetime(self.meal_df['segment_local_departure_date']).dt.date
+            meal_catalog = MealCatalog.from_frame(self.meal_df)
+        self.meal_catalog = meal_catalog
+        self.meal_df = meal_catalog.df
         
         # Extract unique destination regions
         self.destination_regions_unique = self.destination_w[['destination_region', 'Pork', 'Chicken', 'Beef', 'Seafood', 'Lamb', 'Vegetarian']].drop_duplicates()
         
+        # Factor tables with restricted probabilities cached per protein availability
+        # (first row wins for a repeated key; rows without a key are skipped)
+        self.nationality_table = self._factor_table(self.nationality_w, ['nationality_code', 'day_of_week'])
+        self.age_table = self._factor_table(self.age_w, ['age_group'])
+        self.destination_table = self._factor_table(self.destination_regions_unique, ['destination_region'])
+        self.mealtime_table = self._factor_table(self.mealtime_w, ['meal_time'])
+        
         # Feature weights
         self.W1 = 0.40  # Nationality
         self.W2 = 0.20  # Age Group
         self.W3 = 0.25  # Destination
         self.W4 = 0.15  # Meal Time
         
-    def _get_restricted_probabilities(self, feature_value: str, weight_df: pd.DataFrame, feature_column: str, available_proteins: List[str]) -> Dict[str, float]:
-
-        # Get the row for this feature value...in the weight_df 
-        feature_row = weight_df[weight_df[feature_column] == feature_value]
-        
-        if feature_row.empty:
-            # Return equal probabilities if feature not found
-            equal_prob = 1.0 / len(available_proteins)
-            return {protein: equal_prob for protein in available_proteins}
-        
-        protein_columns = ['Pork', 'Chicken', 'Beef', 'Seafood', 'Lamb', 'Vegetarian']
-        available_probs = {}
-        total_prob = 0
-        
-        for protein in available_proteins:
-            if protein in protein_columns:
-                prob = feature_row[protein].iloc[0]
-                available_probs[protein] = prob
-                total_prob += prob
-        
-        # Normalize probabilities to sum to 1
-        if total_prob > 0:
-            normalized_probs = {
-                protein: prob/total_prob 
-                for protein, prob in available_probs.items()
-            }
-        else:
-            equal_prob = 1.0 / len(available_proteins)
-            normalized_probs = {protein: equal_prob for protein in available_proteins}
-        
-        return normalized_probs
-    
-    def _get_restricted_probabilities_with_weekday(self,
-                                                   nationality_code: str,
-                                                   weekday: str,
-                                                   available_proteins: List[str]) -> Dict[str, float]:
-        
-        feature_row = self.nationality_w[(self.nationality_w['nationality_code'] == nationality_code) & (self.nationality_w['day_of_week'] == weekday)]
-        
-        if feature_row.empty:
-            equal_prob = 1.0 / len(available_proteins)
-            return {protein: equal_prob for protein in available_proteins}
-        
-        protein_columns = ['Pork', 'Chicken', 'Beef', 'Seafood', 'Lamb', 'Vegetarian']
-        available_probs = {}
-        total_prob = 0
-        
-        for protein in available_proteins:
-            if protein in protein_columns:
-                prob = feature_row[protein].iloc[0]
-                available_probs[protein] = prob
-                total_prob += prob
-        
-        if total_prob > 0:
-            normalized_probs = {
-                protein: prob/total_prob 
-                for protein, prob in available_probs.items()
-            }
-        else:
-            equal_prob = 1.0 / len(available_proteins)
-            normalized_probs = {protein: equal_prob for protein in available_proteins}
-        
-        return normalized_probs
+    def _factor_table(self, weight_df: pd.DataFrame, key_columns: List[str]) -> FactorTable:
+        """Factor table of a weight CSV keyed by the tuple of its key columns"""
+        keyed = weight_df.dropna(subset=key_columns)
+        return FactorTable(keyed, keyed[key_columns].itertuples(index=False, name=None), keep='first')
     
     def _get_meal_info(self, segment: str,cabin_class: str,date,meal_time: str) -> Tuple[List[Dict], List[str]]:
         """
         Get available meals and proteins for a specific flight segment.  
         Returns:Tuple of (meal_info_list, protein_list)
         """
-        matching_meals = self.meal_df[
-            (self.meal_df['segment'] == segment) & 
-            (self.meal_df['cabin_class'] == cabin_class) & 
-            (self.meal_df['segment_local_departure_date'] == date) & 
-            (self.meal_df['meal_time'] == meal_time)
-        ]
+        entry = self.meal_catalog.lookup(segment, date, cabin_class, meal_time)
         
-        if matching_meals.empty:
+        if entry is None:
             return [], []
         
-        meal_info_list = []
-        protein_list = []
-        
-        for _, meal_row in matching_meals.iterrows():
-            meal_dict = {
-                "meal_name": meal_row['meal_name'],
-                "protein": meal_row['meal_pref']
-            }
-            meal_info_list.append(meal_dict)
-            protein_list.append(meal_row['meal_pref'])
+        meal_info_list = [
+            {"meal_name": meal['meal_name'], "protein": meal['meal_pref']}
+            for meal in entry['meals']
+        ]
+        protein_list = list(entry['meal_prefs'])
         
         return meal_info_list, protein_list
     
-    def _calculate_protein_counts(self,passenger_count: int,final_protein_probs: Dict[str, float],available_proteins: List[str]) -> Dict[str, Dict]:
+    def process_passengers(self, passenger_df: pd.DataFrame, workers: int = 1, shard_by: str = 'segment') -> pd.DataFrame:
         """
-        Calculate final passenger counts per protein using largest remainder method.
-        
-        Args:
-            passenger_count: Total number of passengers
-            final_protein_probs: Final probabilities for each protein
-            available_proteins: List of available proteins
-            
-        Returns:
-            Dictionary with protein counts and probabilities
+        Process passenger data and calculate meal distribution.
+        Args: passenger_df: DataFrame with passenger information
+              workers: number of processes; above 1 the manifest is split into shards that are
+                       planned in parallel and merged (same result as a serial run)
+              shard_by: 'segment' or 'segment_month' (finer shards for better load balance)
+        Returns:Transposed DataFrame with meal counts per flight
         """
-        protein_counts = {}
-        remainders = {}
-        
-        # Calculate exact counts and floor them
-        for protein in available_proteins:
-            count_exact = passenger_count * final_protein_probs[protein]
-            floor_count = int(count_exact)
-            remainder = count_exact - floor_count
-            
-            protein_counts[protein] = {
-                'probability': round(final_protein_probs[protein], 4),
-                'count_exact': round(count_exact, 2),
-                'count_final': floor_count
-            }
-            remainders[protein] = remainder
-        
-        # Distribute remaining passengers
-        total_allocated = sum([protein_counts[p]['count_final'] for p in available_proteins])
-        remaining_passengers = passenger_count - total_allocated
+        df = self._prepare_passengers(passenger_df)
         
-        if remaining_passengers > 0:
-            sorted_proteins = sorted(
-                available_proteins, 
-                key=lambda p: remainders[p], 
-                reverse=True
-            )
-            
-            for i in range(min(remaining_passengers, len(sorted_proteins))):
-                protein = sorted_proteins[i]
-                protein_counts[protein]['count_final'] += 1
+        if not workers or workers <= 1:
+            return self._process_prepared(df)
         
-        return protein_counts
+        # Results are aggregated per segment/date, so a shard never splits a result row
+        if shard_by == 'segment_month':
+            shard_keys = [df['segment'], df['segment_local_departure_datetime'].dt.to_period('M')]
+        elif shard_by == 'segment':
+            shard_keys = [df['segment']]
+        else:
+            raise ValueError(f"Unknown shard_by: {shard_by}")
+        shards = [shard for _, shard in df.groupby(shard_keys, sort=True)]
+        print(f"Planning {len(shards)} shards on {workers} worker processes")
+        
+        # The system (factor tables, meal catalog) is sent to each worker once, not with every shard
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as executor:
+            shard_results = list(executor.map(_process_shard, shards))
+        
+        shard_results = [result for result in shard_results if not result.empty]
+        if not shard_results:
+            return pd.DataFrame()
+        merged = pd.concat(shard_results, ignore_index=True)
+        # Same row order as a serial run (multi-key sort is stable, keeping meal order)
+        return merged.sort_values(RESULT_KEYS).reset_index(drop=True)
     
-    def process_passengers(self, passenger_df: pd.DataFrame) -> pd.DataFrame:
+    def _prepare_passengers(self, passenger_df: pd.DataFrame) -> pd.DataFrame:
         """
-        Process passenger data and calculate meal distribution.
+        Clean passenger data: cabin selection, dates, weekday and destination region.
         Args: passenger_df: DataFrame with passenger information
-        Returns:Transposed DataFrame with meal counts per flight
+        Returns: Prepared DataFrame (one row per passenger meal)
         """
         # Clean and prepare data
         df = passenger_df.copy()
@@ -217,6 +171,14 @@ class MealPlanningSystem:
             how='left'
         )
         
+        return df
+    
+    def _process_prepared(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Calculate meal distribution for prepared passenger rows (all of them, or one shard).
+        Args: df: DataFrame from _prepare_passengers
+        Returns: Transposed DataFrame with meal counts per flight
+        """
         # Create feature sets
         df['feature_set'] = (
             df['nationality_code'] + '_' + 
@@ -260,69 +222,30 @@ class MealPlanningSystem:
         # calculate final probabilities and counts
         final_results = []
         
+        # Only feature groups with meals available can be scored
+        daily_feature_counts = daily_feature_counts[
+            daily_feature_counts['proteins_available'].map(len) > 0
+        ].reset_index(drop=True)
+        
+        # Score every feature group at once: restricted probabilities per feature,
+        # weighted blend and final normalization as whole-array operations
+        slots = protein_slots(daily_feature_counts['proteins_available'].tolist())
+        factors = [
+            self.nationality_table.gather(self.nationality_table.positions(
+                zip(daily_feature_counts['nationality_code'], daily_feature_counts['weekday'])), slots),
+            self.age_table.gather(self.age_table.positions(zip(daily_feature_counts['age_group'])), slots),
+            self.destination_table.gather(self.destination_table.positions(
+                zip(daily_feature_counts['destination_region'])), slots),
+            self.mealtime_table.gather(self.mealtime_table.positions(zip(daily_feature_counts['meal_time'])), slots),
+        ]
+        final_probs_matrix = blend(factors, [self.W1, self.W2, self.W3, self.W4], slots)
+        
+        # Calculate passenger counts (largest remainder method, all groups at once)
+        protein_counts = apportion(final_probs_matrix, daily_feature_counts['passenger_count'].to_numpy(), slots)
+        
         for idx, row in daily_feature_counts.iterrows():
             available_proteins = row['proteins_available']
             
-            if not available_proteins or len(available_proteins) == 0:
-                continue
-            
-            # Get normalized probabilities for each feature
-            nat_probs = self._get_restricted_probabilities_with_weekday(
-                row['nationality_code'], 
-                row['weekday'], 
-                available_proteins
-            )
-            age_probs = self._get_restricted_probabilities(
-                row['age_group'], 
-                self.age_w, 
-                'age_group', 
-                available_proteins
-            )
-            dest_probs = self._get_restricted_probabilities(
-                row['destination_region'], 
-                self.destination_regions_unique, 
-                'destination_region', 
-                available_proteins
-            )
-            meal_probs = self._get_restricted_probabilities(
-                row['meal_time'], 
-                self.mealtime_w, 
-                'meal_time', 
-                available_proteins
-            )
-            
-            # Calculate weighted probabilities
-            weighted_protein_probs = {}
-            for protein in available_proteins:
-                weighted_prob = (
-                    nat_probs.get(protein, 0) * self.W1 + 
-                    age_probs.get(protein, 0) * self.W2 + 
-                    dest_probs.get(protein, 0) * self.W3 + 
-                    meal_probs.get(protein, 0) * self.W4
-                )
-                weighted_protein_probs[protein] = weighted_prob
-            
-            # Normalize final probabilities
-            total_final_prob = sum(weighted_protein_probs.values())
-            if total_final_prob > 0:
-                final_protein_probs = {
-                    protein: prob/total_final_prob 
-                    for protein, prob in weighted_protein_probs.items()
-                }
-            else:
-                equal_prob = 1.0 / len(available_proteins)
-                final_protein_probs = {
-                    protein: equal_prob 
-                    for protein in available_proteins
-                }
-            
-            # Calculate passenger counts
-            protein_counts = self._calculate_protein_counts(
-                row['passenger_count'],
-                final_protein_probs,
-                available_proteins
-            )
-            
             # Create result dictionary
             result_dict = {
                 'segment': row['segment'],
@@ -337,12 +260,14 @@ class MealPlanningSystem:
             # Add protein counts
             for protein in available_proteins:
                 result_dict[f'{protein.lower()}_count_final'] = (
-                    protein_counts[protein]['count_final']
+                    int(protein_counts[idx, PROTEIN_INDEX[protein]])
                 )
             
             final_results.append(result_dict)
         
         final_results_df = pd.DataFrame(final_results)
+        if final_results_df.empty:
+            return pd.DataFrame()
         
         # Aggregate by flight
         aggregated_results = self._aggregate_results(final_results_df)
@@ -376,6 +301,8 @@ class MealPlanningSystem:
             'weekday',
             'meal_time'
         ]).agg(agg_dict).reset_index()
+        # Counts are whole meals; proteins missing from some groups would otherwise come back as float
+        aggregated_results[protein_count_columns] = aggregated_results[protein_count_columns].astype('int64')
         
         # Get meals_available
         meals_available_df = final_results_df.groupby([
@@ -460,9 +387,13 @@ def calculate_meal_distribution(passenger_df: pd.DataFrame,
                                nationality_weights_path: str,
                                age_weights_path: str,
                                destination_weights_path: str,
-                               mealtime_weights_path: str) -> pd.DataFrame:
+                               mealtime_weights_path: str,
+                               meal_catalog: MealCatalog = None,
+                               workers: int = 1,
+                               shard_by: str = 'segment') -> pd.DataFrame:
     """
     Main function to calculate meal distribution for flights.
+    workers > 1 plans the shards (per segment, or per segment and month) on a process pool.
         
     Returns:
         DataFrame with meal counts per flight (transposed view)
@@ -482,10 +413,11 @@ def calculate_meal_distribution(passenger_df: pd.DataFrame,
         nationality_weights_path=nationality_weights_path,
         age_weights_path=age_weights_path,
         destination_weights_path=destination_weights_path,
-        mealtime_weights_path=mealtime_weights_path
+        mealtime_weights_path=mealtime_weights_path,
+        meal_catalog=meal_catalog
     )
     
-    return system.process_passengers(passenger_df)
+    return system.process_passengers(passenger_df, workers=workers, shard_by=shard_by)
 
 
 if __name__ == "__main__":
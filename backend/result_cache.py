@@ -0,0 +1,210 @@
+"""
+Bounded, observable result caches.
+
+Least-recently-used entries are evicted once a cache holds more than max_entries
+results or more than max_bytes of (approximate) JSON size. Entries expire after
+ttl_seconds; error results ({"error": ...}) get their own, usually much shorter,
+error_ttl_seconds so a transient failure isn't served until restart.
+
+get_or_compute() fills a missing entry once: concurrent callers for the same key
+wait for the first caller's result instead of computing it again (single flight).
+
+With a shared state backend (see state_backend.py) results are also written there,
+so a result computed by one uvicorn worker is a hit in the others.
+
+Every cache registers itself by name; cache_stats() reports hit/miss/eviction/size
+counters of all of them for /api/cache-stats.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from coalescing import SingleFlight
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CACHES = {}  # name -> ResultCache
+
+
+def json_size(value) -> int:
+    """Approximate memory footprint of a JSON-able result (its serialized length)"""
+    if orjson is not None:
+        try:
+            return len(orjson.dumps(value, default=str,
+                                    option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+        except TypeError:
+            pass
+    return len(json.dumps(value, default=str))
+
+
+def is_error_result(value) -> bool:
+    """Endpoint results report failures as {"error": ...}"""
+    return isinstance(value, dict) and 'error' in value
+
+
+def cache_stats() -> dict:
+    """Stats of every registered cache, by name"""
+    return {name: cache.stats() for name, cache in CACHES.items()}
+
+
+class ResultCache:
+    def __init__(self, name: str, max_entries: int = 128, max_bytes: int = None, sizeof=json_size,
+                 ttl_seconds: float = None, error_ttl_seconds: float = None, is_error=is_error_result,
+                 backend=None, namespace: str = None):
+        """
+        max_entries / max_bytes: LRU bounds of this process's entries (max_bytes None: unbounded)
+        ttl_seconds: how long a result stays valid (None: until evicted or invalidated)
+        error_ttl_seconds: how long a result for which is_error() holds stays cached (0: not cached)
+        backend / namespace: shared state backend the results are also written to (keys hashed
+            under namespace, which defaults to the cache name); invalidate() only drops local entries
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl_seconds = ttl_seconds
+        self.error_ttl_seconds = error_ttl_seconds
+        self.is_error = is_error
+        self.backend = backend
+        self.prefix = f"cache:{namespace or name}:"
+        self._entries = OrderedDict()  # key -> (value, size, expires_at), oldest first
+        self._flight = SingleFlight(name, register=False)  # computations filling missing keys
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.errors_cached = 0
+        CACHES[name] = self
+
+    def _backend_key(self, key) -> str:
+        text = key if isinstance(key, str) else repr(key)
+        return self.prefix + hashlib.sha1(text.encode()).hexdigest()
+
+    def _ttl(self, value):
+        if self.error_ttl_seconds is not None and self.is_error(value):
+            return self.error_ttl_seconds
+        return self.ttl_seconds
+
+    def get(self, key, default=None):
+        """Cached value for key (marks it most recently used), or default"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self.bytes -= self._entries.pop(key)[1]
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        if self.backend is not None:
+            value = self.backend.get(self._backend_key(key))
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store a value (error results with error_ttl_seconds), evicting LRU entries to stay within bounds"""
+        ttl = self._ttl(value)
+        if ttl is not None and ttl <= 0:
+            return
+        if self._store(key, value) and self.backend is not None:
+            self.backend.set(self._backend_key(key), value, ttl)
+
+    def _store(self, key, value) -> bool:
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return False
+        ttl = self._ttl(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size, time.monotonic() + ttl if ttl is not None else None)
+            self.bytes += size
+            if self.error_ttl_seconds is not None and self.is_error(value):
+                self.errors_cached += 1
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_bytes and self.bytes > self.max_bytes)):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached value for key, or compute() stored and returned. Concurrent callers for the same
+        missing key wait for the first caller's computation (and share its result or exception).
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        def fill():
+            value = compute()
+            self.put(key, value)
+            return value
+        return self._flight.run(key, fill)
+
+    def invalidate(self, predicate=None) -> int:
+        """Drop every entry whose key matches predicate (all entries if None); returns the count"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                self.bytes -= self._entries.pop(key)[1]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def sweep(self) -> int:
+        """Drop expired entries; returns how many expired"""
+        with self._lock:
+            now = time.monotonic()
+            expired = [key for key, entry in self._entries.items() if entry[2] is not None and entry[2] <= now]
+            for key in expired:
+                self.bytes -= self._entries.pop(key)[1]
+            self.expirations += len(expired)
+            return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        self.sweep()
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "error_ttl_seconds": self.error_ttl_seconds,
+            "shared": self.backend is not None,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "errors_cached": self.errors_cached,
+            "computations": self._flight.computations,
+            "coalesced": self._flight.coalesced,
+            "in_flight": self._flight.stats()["in_flight"],
+        }
@@ -0,0 +1,159 @@
+"""
+Vectorized scoring kernel for the weighted protein model.
+
+Every passenger group is a row and every protein a column, so the per-group Python loops
+(restrict to available proteins -> renormalize -> weighted blend -> renormalize) become
+whole-array operations over a [groups x proteins] matrix.
+
+Available proteins are passed as "slots": one row per group listing protein column indices
+in the order the caller iterates them (-1 pads short rows). Sums are accumulated slot by
+slot in that order, so results are bit-for-bit identical to the original dict loops,
+including the batch engine's meal lists where a protein can appear more than once.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Column order of every probability matrix. Alphabetical, which is also the
+# tie-breaking order of the largest remainder method in main.py.
+PROTEINS = ['Beef', 'Chicken', 'Lamb', 'Pork', 'Seafood', 'Vegetarian']
+PROTEIN_INDEX = {protein: idx for idx, protein in enumerate(PROTEINS)}
+
+
+def protein_slots(protein_lists: Sequence[Sequence[str]]) -> np.ndarray:
+    """[groups x max_len] protein column indices for each group's available proteins (-1 padded)"""
+    width = max((len(proteins) for proteins in protein_lists), default=0)
+    slots = np.full((len(protein_lists), width), -1, dtype=np.int64)
+    for row, proteins in enumerate(protein_lists):
+        cols = [PROTEIN_INDEX[protein] for protein in proteins if protein in PROTEIN_INDEX]
+        slots[row, :len(cols)] = cols
+    return slots
+
+
+def probability_matrix(prob_dicts: Sequence[Optional[Dict[str, float]]]) -> np.ndarray:
+    """[groups x proteins] matrix from per-group {protein: probability} dicts (missing -> 0)"""
+    matrix = np.zeros((len(prob_dicts), len(PROTEINS)))
+    for row, probs in enumerate(prob_dicts):
+        if probs:
+            for protein, prob in probs.items():
+                col = PROTEIN_INDEX.get(protein)
+                if col is not None:
+                    matrix[row, col] = float(prob)
+    return matrix
+
+
+def _slot_values(matrix: np.ndarray, slots: np.ndarray, k: int):
+    """Values of slot k for every group (0 where the slot is padding)"""
+    cols = slots[:, k]
+    valid = cols >= 0
+    values = matrix[np.arange(len(matrix)), np.where(valid, cols, 0)]
+    return np.where(valid, values, 0.0), valid
+
+
+def _first_occurrence(slots: np.ndarray) -> np.ndarray:
+    """True for the first slot of each protein within a group (duplicates False)"""
+    first = slots >= 0
+    for k in range(1, slots.shape[1]):
+        first[:, k] &= ~(slots[:, :k] == slots[:, k:k + 1]).any(axis=1)
+    return first
+
+
+def availability_mask(slots: np.ndarray) -> np.ndarray:
+    """[groups x proteins] boolean mask of the available proteins"""
+    mask = np.zeros((len(slots), len(PROTEINS)), dtype=bool)
+    rows, ks = np.nonzero(slots >= 0)
+    mask[rows, slots[rows, ks]] = True
+    return mask
+
+
+def restrict(raw: np.ndarray, slots: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Restrict factor probabilities to each group's available proteins and renormalize to 1.0.
+    Groups whose available proteins all have zero probability get an equal split.
+    If `rows` is given, only those groups are renormalized; the rest are passed through
+    unchanged apart from zeroing unavailable proteins (e.g. already-restricted session rows).
+    """
+    n_groups = len(raw)
+    total = np.zeros(n_groups)
+    n_slots = (slots >= 0).sum(axis=1)
+    for k in range(slots.shape[1]):
+        values, _ = _slot_values(raw, slots, k)
+        total += values
+
+    mask = availability_mask(slots)
+    safe_total = np.where(total > 0, total, 1.0)
+    equal = 1.0 / np.maximum(n_slots, 1)
+    restricted = np.where(total[:, None] > 0, raw / safe_total[:, None], equal[:, None])
+    restricted = np.where(mask, restricted, 0.0)
+
+    if rows is not None:
+        restricted = np.where(rows[:, None], restricted, np.where(mask, raw, 0.0))
+    return restricted
+
+
+def blend(factors: List[np.ndarray], weights: Sequence[float], slots: np.ndarray) -> np.ndarray:
+    """
+    Weighted blend of the restricted factor matrices (nationality, age, destination, meal time),
+    renormalized over each group's available proteins.
+    """
+    mask = availability_mask(slots)
+    weighted = factors[0] * weights[0]
+    for factor, weight in zip(factors[1:], weights[1:]):
+        weighted = weighted + factor * weight
+    weighted = np.where(mask, weighted, 0.0)
+
+    # Sum each available protein once, in slot order
+    first = _first_occurrence(slots)
+    total = np.zeros(len(weighted))
+    for k in range(slots.shape[1]):
+        values, _ = _slot_values(weighted, slots, k)
+        total += np.where(first[:, k], values, 0.0)
+
+    n_slots = (slots >= 0).sum(axis=1)
+    safe_total = np.where(total > 0, total, 1.0)
+    equal = 1.0 / np.maximum(n_slots, 1)
+    final = np.where(total[:, None] > 0, weighted / safe_total[:, None], equal[:, None])
+    return np.where(mask, final, 0.0)
+
+
+def apportion(probs: np.ndarray, counts: np.ndarray, slots: np.ndarray) -> np.ndarray:
+    """
+    Largest remainder method for every group at once.
+
+    Each group's passenger count is split by its probabilities: floor the exact counts, then
+    hand the leftover passengers to the slots with the largest remainders. Ties keep slot
+    order (a stable sort), so alphabetical slots give alphabetical tie-breaking. A protein
+    listed twice in a group's slots gets a share per slot, as the per-group loops did.
+    Returns [groups x proteins] integer counts.
+    """
+    n_groups, width = slots.shape
+    result = np.zeros((n_groups, len(PROTEINS)), dtype=np.int64)
+    if n_groups == 0 or width == 0:
+        return result
+
+    valid = slots >= 0
+    rows = np.arange(n_groups)[:, None]
+    cols = np.where(valid, slots, 0)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    exact = counts[:, None] * probs[rows, cols]
+    floors = np.where(valid, np.floor(exact), 0.0).astype(np.int64)
+    remainders = np.where(valid, exact - floors, -np.inf)
+    remaining = counts - floors.sum(axis=1)
+
+    # Rank slots by remainder (largest first), keeping slot order on ties
+    order = np.argsort(-remainders, axis=1, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(width)[None, :].repeat(n_groups, axis=0), axis=1)
+    bonus = (valid & (rank < remaining[:, None])).astype(np.int64)
+
+    r, k = np.nonzero(valid)
+    result[r, slots[r, k]] = floors[r, k]
+    np.add.at(result, (r, slots[r, k]), bonus[r, k])
+    return result
+
+
+def row_probabilities(matrix: np.ndarray, row: int, proteins: Sequence[str]) -> Dict[str, float]:
+    """{protein: probability} for one group, in the given protein order"""
+    return {protein: float(matrix[row, PROTEIN_INDEX[protein]]) for protein in proteins}
@@ -0,0 +1,349 @@
+"""
+Session lifecycle for SESSION_MEMORY.
+
+Sessions expire after their TTL (refreshed on every access), and once there are more than
+max_entries sessions or their approximate size exceeds max_bytes the least recently used
+ones are evicted. Sessions can be cleared one key at a time, so one user returning to
+flight selection no longer wipes everyone else's. Counters are kept for monitoring.
+
+SharedSessionStore keeps the sessions in a shared state backend instead (see state_backend.py),
+so every uvicorn worker sees the same sessions; each worker keeps the sessions it has used
+recently (with their scored groups) and re-loads one when another worker changed its version.
+Edits hold lock(key) from loading the session to saving it, so two workers editing the same
+session can't overwrite each other's changes.
+"""
+
+import itertools
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from result_cache import json_size
+
+
+def session_size(session: dict) -> int:
+    """Approximate size of a session: array-backed parts report nbytes(), the rest its JSON size"""
+    size = 0
+    for value in session.values():
+        nbytes = getattr(value, 'nbytes', None)
+        size += nbytes() if callable(nbytes) else json_size(value)
+    return size
+
+
+class SessionManager:
+    def __init__(self, ttl_seconds: float = None, max_entries: int = None, max_bytes: int = None,
+                 sizeof=session_size, on_remove=None):
+        """
+        ttl_seconds: default idle time before a session expires (None: never)
+        max_entries / max_bytes: LRU eviction limits (None: unbounded)
+        on_remove: called as on_remove(key, session) whenever a session is expired, evicted or cleared
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_remove = on_remove
+        self._sessions = OrderedDict()  # key -> [session, ttl, expires_at, size], least recently used first
+        self._bytes = 0  # running total of the entries' sizes
+        self._lock = threading.RLock()
+        self._key_locks = weakref.WeakValueDictionary()  # key -> lock, dropped once nobody holds it
+        self._versions = itertools.count(1)
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.cleared = 0
+
+    def _remove(self, key):
+        session, _, _, size = self._sessions.pop(key)
+        self._bytes -= size
+        if self.on_remove is not None:
+            self.on_remove(key, session)
+
+    def _live(self, key, now: float):
+        """Entry for key if it exists and hasn't expired (expired entries are removed)"""
+        entry = self._sessions.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """Session for key (refreshes its TTL and marks it most recently used), or default"""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._live(key, now)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] is not None:
+                entry[2] = now + entry[1]
+            self._sessions.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, session: dict, ttl_seconds: float = None):
+        """Store a session (replacing any previous one for key), then enforce the limits"""
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        with self._lock:
+            if key in self._sessions:
+                self._remove(key)
+            size = self.sizeof(session)
+            self._sessions[key] = [session, ttl, time.monotonic() + ttl if ttl is not None else None, size]
+            self._bytes += size
+            self.created += 1
+            self._enforce_limits(keep=key)
+
+    def _resize(self, entry):
+        size = self.sizeof(entry[0])
+        self._bytes += size - entry[3]
+        entry[3] = size
+
+    def save(self, key, session: dict):
+        """
+        Record changes made to a session (in process memory they are already visible): its size
+        is re-measured, e.g. once its scored groups are attached, and the limits enforced
+        """
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[0] is not session:
+                return
+            self._resize(entry)
+            self._enforce_limits(keep=key)
+
+    def replace(self, key, old: dict, new: dict) -> bool:
+        """Swap in a rebuilt session object if key still holds old (keeps its TTL and LRU position)"""
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[0] is not old:
+                return False
+            entry[0] = new
+            self._resize(entry)
+            return True
+
+    def next_version(self) -> int:
+        """New session version number (part of the prediction cache key)"""
+        return next(self._versions)
+
+    def lock(self, key):
+        """Lock serializing the changes to one session (hold it from reading the session to saving it)"""
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def pop(self, key) -> bool:
+        """Clear one session; True if it existed"""
+        with self._lock:
+            if key not in self._sessions:
+                return False
+            self._remove(key)
+            self.cleared += 1
+            return True
+
+    def clear(self) -> int:
+        """Clear every session; returns how many were cleared"""
+        with self._lock:
+            keys = list(self._sessions)
+            for key in keys:
+                self._remove(key)
+            self.cleared += len(keys)
+            return len(keys)
+
+    def sweep(self) -> int:
+        """Remove every expired session; returns how many expired"""
+        with self._lock:
+            now = time.monotonic()
+            expired = [key for key in list(self._sessions) if self._live(key, now) is None]
+            return len(expired)
+
+    def loaded_sessions(self) -> list:
+        """(key, session) of every live session (e.g. to refresh them after a data reload)"""
+        with self._lock:
+            now = time.monotonic()
+            return [(key, entry[0]) for key, entry in list(self._sessions.items())
+                    if entry[2] is None or entry[2] > now]
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def _enforce_limits(self, keep=None):
+        self.sweep()
+        if self.max_entries is not None:
+            while len(self._sessions) > self.max_entries and next(iter(self._sessions)) != keep:
+                self._remove(next(iter(self._sessions)))
+                self.evictions += 1
+        if self.max_bytes is not None:
+            while self._bytes > self.max_bytes and next(iter(self._sessions)) != keep:
+                self._remove(next(iter(self._sessions)))
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key, time.monotonic()) is not None
+
+    def __getitem__(self, key):
+        session = self.get(key)
+        if session is None:
+            raise KeyError(key)
+        return session
+
+    def __setitem__(self, key, session: dict):
+        self.set(key, session)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self.sweep()
+            lookups = self.hits + self.misses
+            return {
+                "live_sessions": len(self._sessions),
+                "bytes": self.total_bytes(),
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "cleared": self.cleared,
+            }
+
+
+class SharedSessionStore:
+    def __init__(self, backend, hydrate, dehydrate, ttl_seconds: float = None, max_local: int = 256,
+                 on_remove=None, lock_ttl_seconds: float = 60.0, lock_timeout_seconds: float = 30.0):
+        """
+        backend: shared state backend (SQLite or Redis protocol)
+        hydrate / dehydrate: session <-> JSON-able state (edits only, the defaults are shared)
+        ttl_seconds: default idle time before a session expires (enforced by the backend)
+        max_local: sessions each worker keeps loaded (least recently used evicted)
+        on_remove: called as on_remove(key, session) when a session is cleared
+        lock_ttl_seconds: how long lock(key) stays held if its worker dies without releasing it
+        lock_timeout_seconds: how long lock(key) waits for another worker before raising TimeoutError
+        """
+        self.backend = backend
+        self.hydrate = hydrate
+        self.dehydrate = dehydrate
+        self.ttl_seconds = ttl_seconds
+        self.on_remove = on_remove
+        self.prefix = 'session:'
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.lock_timeout_seconds = lock_timeout_seconds
+        self._local = SessionManager(max_entries=max_local)
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.cleared = 0
+
+    def get(self, key, default=None):
+        """Session for key (refreshes its TTL), re-loaded if another worker changed it, or default"""
+        state = self.backend.get(self.prefix + key)
+        if state is None:
+            self._local.pop(key)
+            self.misses += 1
+            return default
+        ttl = state.get('ttl_seconds')
+        if ttl:
+            self.backend.touch(self.prefix + key, ttl)
+        self.hits += 1
+        session = self._local.get(key)
+        if session is None or session.get('version') != state.get('version'):
+            session = self.hydrate(state)
+            self._local.set(key, session)
+            self.reloads += 1
+        return session
+
+    def set(self, key, session: dict, ttl_seconds: float = None):
+        session['ttl_seconds'] = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        self.backend.set(self.prefix + key, self.dehydrate(session), session['ttl_seconds'])
+        self._local.set(key, session)
+        self.created += 1
+
+    def save(self, key, session: dict):
+        """Write a changed session back so the other workers see it"""
+        self.backend.set(self.prefix + key, self.dehydrate(session), session.get('ttl_seconds'))
+        self._local.set(key, session)
+
+    @contextmanager
+    def lock(self, key):
+        """Hold the session's lock in this worker and in the backend (across workers)"""
+        with self._local.lock(key):
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout_seconds
+            while not self.backend.acquire('session-lock:' + key, token, self.lock_ttl_seconds):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Session {key} is locked by another worker")
+                time.sleep(0.01)
+            try:
+                yield
+            finally:
+                self.backend.release('session-lock:' + key, token)
+
+    def loaded_sessions(self) -> list:
+        """(key, session) of the sessions this worker has loaded"""
+        return self._local.loaded_sessions()
+
+    def replace(self, key, old: dict, new: dict) -> bool:
+        """Swap in a rebuilt copy of a loaded session (its state in the backend is unchanged)"""
+        return self._local.replace(key, old, new)
+
+    def next_version(self) -> int:
+        """New session version number, unique across workers"""
+        return self.backend.incr('session-version')
+
+    def pop(self, key) -> bool:
+        session = self._local.get(key)
+        self._local.pop(key)
+        if not self.backend.delete(self.prefix + key):
+            return False
+        if self.on_remove is not None and session is not None:
+            self.on_remove(key, session)
+        self.cleared += 1
+        return True
+
+    def clear(self) -> int:
+        return sum(self.pop(key[len(self.prefix):]) for key in self.backend.keys(self.prefix))
+
+    def __contains__(self, key):
+        return self.backend.get(self.prefix + key) is not None
+
+    def __getitem__(self, key):
+        session = self.get(key)
+        if session is None:
+            raise KeyError(key)
+        return session
+
+    def __setitem__(self, key, session: dict):
+        self.set(key, session)
+
+    def __len__(self):
+        return len(self.backend.keys(self.prefix))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "live_sessions": len(self),
+            "local_sessions": len(self._local),
+            "local_bytes": self._local.total_bytes(),
+            "ttl_seconds": self.ttl_seconds,
+            "created": self.created,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "reloads": self.reloads,
+            "cleared": self.cleared,
+        }
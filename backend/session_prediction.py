@@ -0,0 +1,115 @@
+"""
+Incremental re-prediction for session edits.
+
+A session keeps the scored passenger groups of its flight: the [groups x proteins] factor
+matrices (nationality, age, destination, meal time), the blended probabilities and the
+largest remainder counts of every group, plus the per-meal-time totals. Editing one session
+row only changes the factor rows of the groups that looked that row up, so only those
+groups are re-blended and re-apportioned and their count change is applied to the totals.
+Blending and apportioning are row-wise, so the result is identical to a full /api/predict.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from scoring import PROTEINS, PROTEIN_INDEX, probability_matrix, availability_mask, blend, apportion
+
+METRICS = ['nationality', 'age', 'destination', 'mealtime']
+
+
+class SessionPrediction:
+    def __init__(self, meal_times, passenger_counts, slots: np.ndarray, factors: list,
+                 session_keys: dict, weights, proteins_by_mealtime: dict):
+        """
+        meal_times / passenger_counts: meal time and passenger count of every scored group
+        slots: available protein slots of every group (see scoring.protein_slots)
+        factors: restricted factor matrices in METRICS order (session rows already applied)
+        session_keys: {metric: session row key each group looked up, None where CSV defaults were used}
+        weights: importance weights (W1..W4 as fractions)
+        proteins_by_mealtime: {meal_time: proteins served}, the proteins reported per meal time
+        """
+        self.slots = slots
+        self.mask = availability_mask(slots)
+        self.passenger_counts = np.asarray(passenger_counts, dtype=np.int64)
+        self.factors = [np.array(factor, dtype=float) for factor in factors]
+        self.weights = [float(weight) for weight in weights]
+        self.proteins_by_mealtime = proteins_by_mealtime
+        self.mealtime_codes, self.mealtime_order = pd.factorize(pd.Series(meal_times, dtype=object).astype(str))
+        self._lock = threading.Lock()
+
+        # Groups that looked up each session row: {metric: {row_key: group indices}}
+        self._groups_by_row = {}
+        for metric in METRICS:
+            by_row = {}
+            for idx, row_key in enumerate(session_keys.get(metric, [])):
+                if row_key is not None:
+                    by_row.setdefault(row_key, []).append(idx)
+            self._groups_by_row[metric] = {row_key: np.array(idxs, dtype=np.int64) for row_key, idxs in by_row.items()}
+
+        self._score_all()
+
+    def _score_all(self):
+        self.final = blend(self.factors, self.weights, self.slots)
+        self.counts = apportion(self.final, self.passenger_counts, self.slots)
+        self.totals = np.zeros((len(self.mealtime_order), len(PROTEINS)), dtype=np.int64)
+        np.add.at(self.totals, self.mealtime_codes, self.counts)
+
+    def __len__(self):
+        return len(self.passenger_counts)
+
+    def nbytes(self) -> int:
+        """Size of the scored group arrays"""
+        arrays = [self.slots, self.mask, self.passenger_counts, self.final, self.counts, self.totals,
+                  self.mealtime_codes, *self.factors]
+        return int(sum(array.nbytes for array in arrays))
+
+    def groups_for_row(self, metric: str, row_key: str) -> np.ndarray:
+        """Indices of the groups scored with one session row"""
+        return self._groups_by_row.get(metric, {}).get(row_key, np.empty(0, dtype=np.int64))
+
+    def groups_for_rows(self, edits) -> np.ndarray:
+        """Indices of the groups scored with any of the (metric, row_key, ...) rows"""
+        touched = [self.groups_for_row(edit[0], edit[1]) for edit in edits]
+        return np.unique(np.concatenate(touched)) if touched else np.empty(0, dtype=np.int64)
+
+    def update_rows(self, edits) -> int:
+        """
+        Apply many (metric, row_key, probabilities) edits in order, then re-score the
+        groups that use any of them once. Returns the number of groups re-scored.
+        """
+        rows = self.groups_for_rows(edits)
+        if len(rows) == 0:
+            return 0
+        with self._lock:
+            for metric, row_key, probabilities in edits:
+                edited = self.groups_for_row(metric, row_key)
+                if len(edited):
+                    factor = self.factors[METRICS.index(metric)]
+                    factor[edited] = np.where(self.mask[edited], probability_matrix([probabilities]), 0.0)
+
+            final = blend([f[rows] for f in self.factors], self.weights, self.slots[rows])
+            counts = apportion(final, self.passenger_counts[rows], self.slots[rows])
+            np.add.at(self.totals, self.mealtime_codes[rows], counts - self.counts[rows])
+            self.final[rows] = final
+            self.counts[rows] = counts
+        return len(rows)
+
+    def set_weights(self, weights) -> bool:
+        """Re-score every group if the importance weights changed; True if they did"""
+        weights = [float(weight) for weight in weights]
+        if weights == self.weights:
+            return False
+        with self._lock:
+            self.weights = weights
+            self._score_all()
+        return True
+
+    def meal_time_counts(self) -> dict:
+        """{meal_time: {protein: count}} for every scored meal time"""
+        return {
+            meal_time: {protein: int(self.totals[k, PROTEIN_INDEX[protein]])
+                        for protein in self.proteins_by_mealtime[meal_time]}
+            for k, meal_time in enumerate(self.mealtime_order)
+        }
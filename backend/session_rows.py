@@ -0,0 +1,215 @@
+"""
+Copy-on-write session probability rows.
+
+Every session sees one row per factor row x served meal time, restricted to that meal
+time's proteins. Instead of copying all of them into per-session dicts, sessions share
+immutable defaults: the row layout of a metric for a set of meal times (cached per table
+version) and the factor table's restricted matrices (cached per protein availability).
+A session only stores the rows the user has edited.
+
+A session can also be scoped to one flight: only the rows its passengers can use (their
+nationalities on the flight's weekday, their age groups, the flight's destination region)
+are part of it. Scoped layouts are specific to one flight, so they aren't shared.
+"""
+
+import threading
+
+import numpy as np
+
+from factor_tables import FactorTable
+from result_cache import json_size
+from scoring import PROTEINS, PROTEIN_INDEX
+
+# Columns that make up a row key (besides the meal time) and are shown as row details
+DETAIL_COLUMNS = {
+    'nationality': ['nationality_code', 'day_of_week'],
+    'age': ['age_group'],
+    'destination': ['destination_region'],
+    'mealtime': [],
+}
+
+# Tolerance for treating an edited probability as different from the default
+MODIFIED_TOLERANCE = 0.001
+
+_LAYOUTS = {}  # (metric, table version, meal times) -> RowLayout
+_LAYOUTS_LOCK = threading.Lock()
+
+
+def row_prefixes(metric: str, table: FactorTable) -> list:
+    """Row key of every table row without the meal time, e.g. "CN_Monday", "31-50" (not for 'mealtime')"""
+    columns = [table.df[column] for column in DETAIL_COLUMNS[metric]]
+    return ['_'.join(str(value) for value in values) for values in zip(*columns)]
+
+
+def scoped_positions(metric: str, table: FactorTable, scope) -> list:
+    """Table positions of the rows whose key prefix is in scope (every row if scope is None)"""
+    if scope is None or metric == 'mealtime':
+        return list(range(len(table)))
+    scope = set(scope)
+    return [pos for pos, prefix in enumerate(row_prefixes(metric, table)) if prefix in scope]
+
+
+class RowLayout:
+    def __init__(self, metric: str, table: FactorTable, meal_times: tuple, scope=None):
+        """
+        Row keys of one metric for a set of meal times, e.g. "CN_Monday_Lunch", "31-50_Lunch",
+        "Lunch". Keys keep first-seen order; a repeated key points at its last table row.
+        scope: row key prefixes to keep, e.g. {"CN_Monday", "IN_Monday"} (None: every row;
+        meal time rows are already limited to meal_times)
+        """
+        self.metric = metric
+        self.table = table
+        self.meal_times = meal_times
+        self.columns = DETAIL_COLUMNS[metric]
+        index = {}  # key -> (meal time index, table position)
+        self.assignments = 0  # rows written, repeated keys included (the counts /api/initialize-session reports)
+        if metric == 'mealtime':
+            meal_time_index = {meal_time: m for m, meal_time in enumerate(meal_times)}
+            for pos, meal_time in enumerate(table.df['meal_time']):
+                if meal_time in meal_time_index:
+                    index[meal_time] = (meal_time_index[meal_time], pos)
+                    self.assignments += 1
+        else:
+            scope = set(scope) if scope is not None else None
+            for pos, prefix in enumerate(row_prefixes(metric, table)):
+                if scope is not None and prefix not in scope:
+                    continue
+                for m, meal_time in enumerate(meal_times):
+                    index[f"{prefix}_{meal_time}"] = (m, pos)
+                    self.assignments += 1
+        self.keys = list(index)
+        self.order = {key: ordinal for ordinal, key in enumerate(self.keys)}
+        self.index = index
+
+    def details(self, key: str) -> dict:
+        """Row details, e.g. {'age_group': '31-50', 'meal_time': 'Lunch'}"""
+        m, pos = self.index[key]
+        details = {column: self.table.df[column].iat[pos] for column in self.columns}
+        details['meal_time'] = self.meal_times[m]
+        return details
+
+
+def row_layout(metric: str, table: FactorTable, meal_times, scope=None) -> RowLayout:
+    """Shared layout for (metric, table version, meal times), built on first use"""
+    if scope is not None and metric != 'mealtime':
+        return RowLayout(metric, table, tuple(meal_times), scope)
+    cache_key = (metric, table.version, tuple(meal_times))
+    layout = _LAYOUTS.get(cache_key)
+    if layout is None:
+        layout = RowLayout(metric, table, tuple(meal_times))
+        with _LAYOUTS_LOCK:
+            layout = _LAYOUTS.setdefault(cache_key, layout)
+    return layout
+
+
+class SessionRows:
+    def __init__(self, metric: str, table: FactorTable, proteins_by_mealtime: dict, scope=None):
+        """One metric's rows of a session: shared defaults plus this session's edits (scope: see RowLayout)"""
+        self.layout = row_layout(metric, table, list(proteins_by_mealtime), scope)
+        self.proteins = [proteins_by_mealtime[meal_time] for meal_time in self.layout.meal_times]
+        self._cols = [[PROTEIN_INDEX[protein] for protein in proteins if protein in PROTEIN_INDEX]
+                      for proteins in self.proteins]
+        # Defaults restricted to each meal time's proteins (read-only, cached by the table)
+        self._defaults = [table.restricted(cols) for cols in self._cols]
+        self.overrides = {}  # row key -> {'current_probabilities': ..., 'marker': ...}
+        self.modified = set()  # keys of the overrides marked 'user_modified' (kept on every write)
+
+    def __contains__(self, key):
+        return key in self.layout.index
+
+    def __len__(self):
+        return len(self.layout.keys)
+
+    def __iter__(self):
+        return iter(self.layout.keys)
+
+    def default(self, key: str) -> dict:
+        """Default {protein: probability} of a row, normalized over its available proteins"""
+        m, pos = self.layout.index[key]
+        cols = self._cols[m]
+        return dict(zip([PROTEINS[col] for col in cols], self._defaults[m][pos, cols].tolist()))
+
+    def current(self, key: str) -> dict:
+        """Edited probabilities of a row, or its default"""
+        override = self.overrides.get(key)
+        return override['current_probabilities'] if override else self.default(key)
+
+    def marker(self, key: str) -> str:
+        override = self.overrides.get(key)
+        return override['marker'] if override else 'no_change'
+
+    def available_proteins(self, key: str) -> list:
+        return self.proteins[self.layout.index[key][0]]
+
+    def row(self, key: str) -> dict:
+        """A row in the session row format (details, current/default probabilities, marker, proteins)"""
+        row = self.layout.details(key)
+        row['current_probabilities'] = self.current(key)
+        row['default_probabilities'] = self.default(key)
+        row['marker'] = self.marker(key)
+        row['available_proteins'] = self.available_proteins(key)
+        return row
+
+    def defaults_matrix(self, keys) -> np.ndarray:
+        """[rows x proteins] default probabilities of many rows (0 for unavailable proteins)"""
+        located = np.array([self.layout.index[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        out = np.zeros((len(located), len(PROTEINS)))
+        for m in np.unique(located[:, 0]):
+            rows = located[:, 0] == m
+            out[rows] = self._defaults[m][located[rows, 1]]
+        return out
+
+    def update(self, key: str, probabilities: dict) -> str:
+        """
+        Set a row's current probabilities. Marked 'user_modified' if any protein differs
+        from the default by more than MODIFIED_TOLERANCE; returns the marker.
+        """
+        default = self.default(key)
+        is_different = any(abs(prob - default.get(protein, 0)) > MODIFIED_TOLERANCE
+                           for protein, prob in probabilities.items())
+        marker = 'user_modified' if is_different else 'no_change'
+        self.set_override(key, probabilities, marker)
+        return marker
+
+    def set_override(self, key: str, probabilities: dict, marker: str):
+        """Store a row's current probabilities with an already computed marker"""
+        self.overrides[key] = {'current_probabilities': probabilities, 'marker': marker}
+        if marker == 'user_modified':
+            self.modified.add(key)
+        else:
+            self.modified.discard(key)
+
+    def restore(self, overrides: dict):
+        """Replace this session's edits (e.g. loaded from a shared state backend)"""
+        self.overrides = dict(overrides)
+        self.modified = {key for key, override in self.overrides.items() if override['marker'] == 'user_modified'}
+
+    def nbytes(self) -> int:
+        """Approximate size of this session's own data (the edits; defaults are shared)"""
+        return json_size(self.overrides)
+
+    def modified_count(self) -> int:
+        return len(self.modified)
+
+    def modified_keys(self) -> list:
+        """Keys of the rows marked 'user_modified', in row order"""
+        return sorted(self.modified, key=self.layout.order.get)
+
+
+def session_state(session: dict) -> dict:
+    """JSON-able state of a session (flight fields and edits) for a shared state backend"""
+    state = {key: value for key, value in session.items()
+             if key not in DETAIL_COLUMNS and key != 'prediction'}
+    state['overrides'] = {metric: session[metric].overrides for metric in DETAIL_COLUMNS}
+    return state
+
+
+def restore_session(state: dict, factor_tables: dict) -> dict:
+    """Session from session_state(): rows re-attached to the shared defaults, edits restored"""
+    session = {key: value for key, value in state.items() if key != 'overrides'}
+    scope = state.get('scope') or {}
+    for metric in DETAIL_COLUMNS:
+        rows = SessionRows(metric, factor_tables[metric], state['available_proteins_by_mealtime'], scope.get(metric))
+        rows.restore(state['overrides'].get(metric, {}))
+        session[metric] = rows
+    return session
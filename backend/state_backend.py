@@ -0,0 +1,311 @@
+"""
+Pluggable state backend for sessions and shared result caches.
+
+With one uvicorn worker everything can live in process memory. With `--workers N` every
+worker is a separate process, so sessions and warm caches have to live somewhere all
+workers can reach. The backend is chosen with STATE_BACKEND_URL:
+
+    memory://                    in-process dict (default, single worker)
+    sqlite:///path/to/state.db   SQLite file shared by the workers on one host
+    redis://host:6379/0          any server speaking the Redis protocol (RESP)
+
+Backends store JSON-able values under string keys with an optional TTL, and provide an
+atomic counter (used for session versions, which must be unique across workers) and
+expiring locks (used to serialize the edits of one session across workers).
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+
+def _dumps(value) -> str:
+    # numpy scalars (e.g. counts from pandas) are converted to plain Python values
+    return json.dumps(value, default=lambda obj: obj.item() if hasattr(obj, 'item') else str(obj))
+
+
+class MemoryBackend:
+    """In-process dict (values are stored as-is, no serialization)"""
+    shared = False
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at)
+        self._counters = {}
+        self._locks = {}  # key -> (token, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds: float = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl_seconds if ttl_seconds else None)
+
+    def touch(self, key, ttl_seconds: float):
+        """Restart a key's TTL"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], time.time() + ttl_seconds)
+
+    def delete(self, key) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def keys(self, prefix: str = '') -> list:
+        with self._lock:
+            now = time.time()
+            return [key for key, (_, expires_at) in self._data.items()
+                    if key.startswith(prefix) and (expires_at is None or expires_at > now)]
+
+    def incr(self, key) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def acquire(self, key, token: str, ttl_seconds: float) -> bool:
+        """Take the lock key for token unless it is held (it expires after ttl_seconds)"""
+        with self._lock:
+            held = self._locks.get(key)
+            if held is not None and held[1] > time.time():
+                return False
+            self._locks[key] = (token, time.time() + ttl_seconds)
+            return True
+
+    def release(self, key, token: str):
+        """Release the lock key if token still holds it"""
+        with self._lock:
+            if self._locks.get(key, (None,))[0] == token:
+                del self._locks[key]
+
+
+class SQLiteBackend:
+    """SQLite file shared by the worker processes on one host (WAL mode)"""
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl_seconds: float = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, _dumps(value), time.time() + ttl_seconds if ttl_seconds else None)
+        )
+
+    def touch(self, key, ttl_seconds: float):
+        self._connect().execute("UPDATE state SET expires_at = ? WHERE key = ?", (time.time() + ttl_seconds, key))
+
+    def delete(self, key) -> bool:
+        return self._connect().execute("DELETE FROM state WHERE key = ?", (key,)).rowcount > 0
+
+    def keys(self, prefix: str = '') -> list:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        rows = conn.execute("SELECT key FROM state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def incr(self, key) -> int:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR IGNORE INTO counters (key, value) VALUES (?, 0)", (key,))
+            conn.execute("UPDATE counters SET value = value + 1 WHERE key = ?", (key,))
+            value = conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def acquire(self, key, token: str, ttl_seconds: float) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM locks WHERE key = ? AND expires_at <= ?", (key, now))
+            acquired = conn.execute(
+                "INSERT OR IGNORE INTO locks (key, token, expires_at) VALUES (?, ?, ?)", (key, token, now + ttl_seconds)
+            ).rowcount > 0
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def release(self, key, token: str):
+        self._connect().execute("DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend:
+    """
+    Minimal Redis protocol (RESP2) client: GET, SET PX, PEXPIRE, DEL, SCAN, INCR (and SET NX /
+    EVAL for locks).
+    One connection per thread, reconnected once if it drops.
+    """
+    shared = True
+
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None,
+                 namespace: str = 'meal-prediction:', timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.namespace = namespace
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self._roundtrip(conn, 'AUTH', self.password)
+            if self.db:
+                self._roundtrip(conn, 'SELECT', self.db)
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b''.join(parts)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(payload)
+            return None if count < 0 else [self._read_reply(reader) for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _roundtrip(self, conn, *args):
+        sock, reader = conn
+        sock.sendall(self._encode(*args))
+        return self._read_reply(reader)
+
+    def command(self, *args):
+        """Send one command and return its reply (retried once on a dropped connection)"""
+        for attempt in range(2):
+            try:
+                return self._roundtrip(self._connection(), *args)
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+
+    def get(self, key):
+        data = self.command('GET', self.namespace + key)
+        return json.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl_seconds: float = None):
+        args = ['SET', self.namespace + key, _dumps(value)]
+        if ttl_seconds:
+            args += ['PX', int(ttl_seconds * 1000)]
+        self.command(*args)
+
+    def touch(self, key, ttl_seconds: float):
+        self.command('PEXPIRE', self.namespace + key, int(ttl_seconds * 1000))
+
+    def delete(self, key) -> bool:
+        return self.command('DEL', self.namespace + key) > 0
+
+    def keys(self, prefix: str = '') -> list:
+        keys, cursor = [], '0'
+        pattern = self.namespace + prefix.replace('*', r'\*').replace('?', r'\?') + '*'
+        while True:
+            cursor, batch = self.command('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+            keys.extend(key.decode()[len(self.namespace):] for key in batch)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else str(cursor)
+            if cursor == '0':
+                return keys
+
+    def incr(self, key) -> int:
+        return self.command('INCR', self.namespace + key)
+
+    # Delete the lock only if it still holds our token (it may have expired and been re-taken)
+    _RELEASE_SCRIPT = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end return 0"
+
+    def acquire(self, key, token: str, ttl_seconds: float) -> bool:
+        return self.command('SET', self.namespace + key, token, 'NX', 'PX', int(ttl_seconds * 1000)) == 'OK'
+
+    def release(self, key, token: str):
+        self.command('EVAL', self._RELEASE_SCRIPT, 1, self.namespace + key, token)
+
+
+def create_backend(url: str = None):
+    """Backend for a STATE_BACKEND_URL (memory://, sqlite:///path, redis://[:password@]host:port/db)"""
+    url = url or os.getenv('STATE_BACKEND_URL', 'memory://')
+    parsed = urlparse(url)
+    if parsed.scheme in ('', 'memory'):
+        return MemoryBackend()
+    if parsed.scheme in ('sqlite', 'file'):
+        path = (parsed.netloc + parsed.path) if parsed.scheme == 'file' else parsed.path
+        return SQLiteBackend(path or 'state.db')
+    if parsed.scheme == 'redis':
+        db = parsed.path.lstrip('/')
+        return RedisBackend(parsed.hostname or 'localhost', parsed.port or 6379, int(db) if db else 0, parsed.password)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+import ai_summary
+from ai_summary import AISummaryUnavailable, call_bedrock_llm
+
+
+def summarize():
+    return asyncio.run(call_bedrock_llm([], {}, {"Chicken": 50.0, "Beef": 50.0}, {"Chicken": 5, "Beef": 5}))
+
+
+def test_returns_llm_text(monkeypatch):
+    async def acall_llm(self, body, headers=None, user_token=None):
+        return "Two paragraphs."
+    monkeypatch.setattr(ai_summary.CallLLM, "acall_llm", acall_llm)
+    assert summarize() == "Two paragraphs."
+
+
+def test_api_error_raises(monkeypatch):
+    async def acall_llm(self, body, headers=None, user_token=None):
+        return "Error calling Bedrock API: 403"
+    monkeypatch.setattr(ai_summary.CallLLM, "acall_llm", acall_llm)
+    with pytest.raises(AISummaryUnavailable, match="API error"):
+        summarize()
+
+
+def test_connection_error_raises(monkeypatch):
+    async def acall_llm(self, body, headers=None, user_token=None):
+        raise ConnectionError("refused")
+    monkeypatch.setattr(ai_summary.CallLLM, "acall_llm", acall_llm)
+    with pytest.raises(AISummaryUnavailable, match="connection error"):
+        summarize()
@@ -0,0 +1,197 @@
+"""
+The vectorized scoring kernel must give exactly the results of the per-group dict loops it
+replaced (main.py / validate_predictions.py, and meal_planning.py for meal lists that name a
+protein more than once). Probabilities are compared bit for bit, not approximately.
+"""
+
+import numpy as np
+import pytest
+
+from scoring import (PROTEINS, apportion, availability_mask, blend, probability_matrix, protein_slots, restrict,
+                     row_probabilities)
+
+WEIGHTS = [0.4, 0.2, 0.25, 0.15]
+
+
+def loop_restrict(row_dict, available_proteins):
+    """The original normalize_probabilities_for_proteins()"""
+    available_probs = {}
+    total = 0.0
+    for protein in available_proteins:
+        prob = float(row_dict.get(protein, 0))
+        available_probs[protein] = prob
+        total += prob
+    if total > 0:
+        return {protein: prob / total for protein, prob in available_probs.items()}
+    equal_prob = 1.0 / len(available_proteins)
+    return {protein: equal_prob for protein in available_proteins}
+
+
+def loop_blend(factor_dicts, weights, available_proteins):
+    """The original weighted blend and renormalization of one group"""
+    weighted_probs = {}
+    for protein in available_proteins:
+        weighted_probs[protein] = (
+            factor_dicts[0].get(protein, 0) * weights[0] +
+            factor_dicts[1].get(protein, 0) * weights[1] +
+            factor_dicts[2].get(protein, 0) * weights[2] +
+            factor_dicts[3].get(protein, 0) * weights[3]
+        )
+    total = sum(weighted_probs.values())
+    if total > 0:
+        return {protein: prob / total for protein, prob in weighted_probs.items()}
+    return {protein: 1.0 / len(available_proteins) for protein in available_proteins}
+
+
+def random_groups(rng, n_groups, duplicates=0.2):
+    """Protein lists (sometimes naming a protein twice) and raw factor rows, often with zeros"""
+    protein_lists, raw_dicts = [], []
+    for _ in range(n_groups):
+        size = int(rng.integers(1, 5))
+        protein_lists.append([PROTEINS[col] for col in rng.choice(len(PROTEINS), size=size, replace=rng.random() < duplicates)])
+        values = rng.integers(0, 5, size=len(PROTEINS)) * rng.choice([0.1, 0.05, 1 / 3, 0.123456789])
+        if rng.random() < 0.1:
+            values[:] = 0.0
+        raw_dicts.append(dict(zip(PROTEINS, values.tolist())))
+    return protein_lists, raw_dicts
+
+
+def assert_restricted(matrix, protein_lists, expected_dicts):
+    mask = availability_mask(protein_slots(protein_lists))
+    assert not matrix[~mask].any()
+    for i, proteins in enumerate(protein_lists):
+        assert row_probabilities(matrix, i, list(expected_dicts[i])) == expected_dicts[i], (i, proteins)
+
+
+def test_restrict_handcrafted():
+    protein_lists = [['Beef', 'Chicken'], ['Chicken', 'Lamb', 'Chicken'], ['Pork', 'Seafood'], ['Vegetarian']]
+    raw_dicts = [
+        {'Beef': 0.1, 'Chicken': 0.2, 'Pork': 0.7},
+        {'Chicken': 0.3, 'Lamb': 0.3},
+        {'Beef': 1.0},  # all available proteins zero: equal split
+        {'Vegetarian': 0.0},
+    ]
+    restricted = restrict(probability_matrix(raw_dicts), protein_slots(protein_lists))
+    assert_restricted(restricted, protein_lists, [loop_restrict(d, p) for d, p in zip(raw_dicts, protein_lists)])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_restrict_random(seed):
+    rng = np.random.default_rng(seed)
+    protein_lists, raw_dicts = random_groups(rng, 400)
+    restricted = restrict(probability_matrix(raw_dicts), protein_slots(protein_lists))
+    assert_restricted(restricted, protein_lists, [loop_restrict(d, p) for d, p in zip(raw_dicts, protein_lists)])
+
+
+def test_restrict_selected_rows_only():
+    # Rows not selected (e.g. already-restricted session rows) are only masked, not renormalized
+    protein_lists = [['Beef', 'Chicken'], ['Beef', 'Chicken']]
+    raw = probability_matrix([{'Beef': 0.2, 'Chicken': 0.2, 'Pork': 0.6}] * 2)
+    slots = protein_slots(protein_lists)
+    restricted = restrict(raw, slots, rows=np.array([True, False]))
+    assert row_probabilities(restricted, 0, ['Beef', 'Chicken']) == {'Beef': 0.5, 'Chicken': 0.5}
+    assert row_probabilities(restricted, 1, PROTEINS) == {'Beef': 0.2, 'Chicken': 0.2, 'Lamb': 0.0,
+                                                         'Pork': 0.0, 'Seafood': 0.0, 'Vegetarian': 0.0}
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('weights', [WEIGHTS, [0.3, 0.3, 0.2, 0.2], [1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0]])
+def test_blend_random(seed, weights):
+    rng = np.random.default_rng(seed)
+    protein_lists, _ = random_groups(rng, 300)
+    slots = protein_slots(protein_lists)
+    factor_dicts = []
+    factors = []
+    for _ in range(4):
+        _, raw_dicts = random_groups(rng, len(protein_lists))
+        restricted = [loop_restrict(d, p) for d, p in zip(raw_dicts, protein_lists)]
+        factor_dicts.append(restricted)
+        factors.append(restrict(probability_matrix(raw_dicts), slots))
+
+    final = blend(factors, weights, slots)
+    expected = [loop_blend([factor[i] for factor in factor_dicts], weights, proteins)
+                for i, proteins in enumerate(protein_lists)]
+    assert_restricted(final, protein_lists, expected)
+
+
+def loop_counts(passenger_count, final_probs, available_proteins):
+    """The original per-group loop (meal_planning.py variant, which also handles duplicate proteins)"""
+    protein_counts = {}
+    remainders = {}
+    for protein in available_proteins:
+        count_exact = passenger_count * final_probs[protein]
+        floor_count = int(count_exact)
+        protein_counts[protein] = floor_count
+        remainders[protein] = count_exact - floor_count
+
+    total_allocated = sum(protein_counts[p] for p in available_proteins)
+    remaining = passenger_count - total_allocated
+    if remaining > 0:
+        # Stable sort: ties keep the order of available_proteins
+        sorted_proteins = sorted(available_proteins, key=lambda p: remainders[p], reverse=True)
+        for i in range(min(remaining, len(sorted_proteins))):
+            protein_counts[sorted_proteins[i]] += 1
+    return protein_counts
+
+
+def assert_same_counts(protein_lists, prob_dicts, passenger_counts):
+    matrix = probability_matrix(prob_dicts)
+    slots = protein_slots(protein_lists)
+    counts = apportion(matrix, np.array(passenger_counts), slots)
+    for i, proteins in enumerate(protein_lists):
+        probs = row_probabilities(matrix, i, list(dict.fromkeys(proteins)))
+        expected = loop_counts(passenger_counts[i], probs, proteins)
+        got = {protein: int(counts[i, PROTEINS.index(protein)]) for protein in proteins}
+        assert got == expected, (i, proteins, probs, passenger_counts[i])
+        assert counts[i].sum() == sum(expected.values())
+
+
+def test_exact_ties_break_in_slot_order():
+    # 1/3 each for 4 passengers: three equal remainders, the first slot gets the extra passenger
+    proteins = [['Beef', 'Chicken', 'Seafood'], ['Seafood', 'Chicken', 'Beef'], ['Chicken', 'Lamb']]
+    probs = [{p: 1 / 3 for p in proteins[0]}, {p: 1 / 3 for p in proteins[1]}, {'Chicken': 0.5, 'Lamb': 0.5}]
+    assert_same_counts(proteins, probs, [4, 4, 7])
+
+
+def test_near_ties_one_ulp_apart():
+    proteins = ['Beef', 'Chicken', 'Pork', 'Vegetarian']
+    base = 0.5562323079263828
+    cases = []
+    for a, b in [(base, np.nextafter(base, 1)), (np.nextafter(base, 1), base),
+                 (base, np.nextafter(base, 0)), (base, base)]:
+        rest = (1.0 - a / 2 - b / 2) / 2
+        cases.append({'Beef': rest, 'Chicken': a / 2, 'Pork': b / 2, 'Vegetarian': rest})
+    assert_same_counts([proteins] * len(cases), cases, [3, 7, 11, 101])
+
+
+def test_duplicate_protein_slots():
+    # Batch meal lists can name a protein twice; every slot gets its own share
+    proteins = [['Chicken', 'Beef', 'Chicken'], ['Seafood', 'Seafood'], ['Lamb', 'Pork', 'Lamb', 'Pork']]
+    probs = [{'Chicken': 0.3, 'Beef': 0.4}, {'Seafood': 0.5}, {'Lamb': 0.25, 'Pork': 0.25}]
+    assert_same_counts(proteins, probs, [5, 3, 9])
+
+
+def test_zero_passengers_and_empty_groups():
+    assert_same_counts([['Beef', 'Chicken'], ['Chicken']], [{'Beef': 0.5, 'Chicken': 0.5}, {'Chicken': 1.0}], [0, 0])
+    assert apportion(np.zeros((0, len(PROTEINS))), np.array([], dtype=np.int64), np.zeros((0, 0), dtype=np.int64)).shape == (0, len(PROTEINS))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_groups_with_quantized_probabilities(seed):
+    # Probabilities on a coarse grid (plus one-ulp nudges) make exact and near remainder ties common
+    rng = np.random.default_rng(seed)
+    protein_lists, prob_dicts, passenger_counts = [], [], []
+    for _ in range(500):
+        size = int(rng.integers(1, 5))
+        proteins = [PROTEINS[col] for col in rng.choice(len(PROTEINS), size=size, replace=rng.random() < 0.2)]
+        unique = list(dict.fromkeys(proteins))
+        weights = rng.integers(0, 9, size=len(unique)).astype(float)
+        if weights.sum() == 0:
+            weights[:] = 1.0
+        values = weights / weights.sum()
+        nudge = rng.integers(-1, 2, size=len(unique))
+        values = np.where(nudge > 0, np.nextafter(values, 1), np.where(nudge < 0, np.nextafter(values, 0), values))
+        protein_lists.append(proteins)
+        prob_dicts.append(dict(zip(unique, values.tolist())))
+        passenger_counts.append(int(rng.integers(0, 60)))
+    assert_same_counts(protein_lists, prob_dicts, passenger_counts)
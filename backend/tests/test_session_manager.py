@@ -0,0 +1,89 @@
+"""
+SessionManager (in-process sessions): running size totals and byte-limit eviction, replacing
+a session object and per-session locks.
+"""
+
+import threading
+
+from session_manager import SessionManager, session_size
+
+
+class Sized:
+    """Stand-in for an array-backed session part (SessionRows / SessionPrediction)"""
+    def __init__(self, size):
+        self.size = size
+
+    def nbytes(self):
+        return self.size
+
+
+def test_running_size_total():
+    sessions = SessionManager()
+    sessions['a'] = {'rows': Sized(100)}
+    sessions['b'] = {'rows': Sized(200)}
+    assert sessions.total_bytes() == 300
+
+    # Attaching the scored groups counts once the session is saved
+    session = sessions['a']
+    session['prediction'] = Sized(50)
+    assert sessions.total_bytes() == 300
+    sessions.save('a', session)
+    assert sessions.total_bytes() == 350 == sum(session_size(s) for _, s in sessions.loaded_sessions())
+
+    sessions['b'] = {'rows': Sized(10)}
+    assert sessions.total_bytes() == 160
+    sessions.pop('a')
+    assert sessions.total_bytes() == 10
+    sessions.clear()
+    assert sessions.total_bytes() == 0
+
+
+def test_max_bytes_evicts_least_recently_used():
+    sessions = SessionManager(max_bytes=250)
+    sessions['a'] = {'rows': Sized(100)}
+    sessions['b'] = {'rows': Sized(100)}
+    sessions['a']  # 'b' is now least recently used
+    session = sessions['a']
+    session['prediction'] = Sized(100)
+    sessions.save('a', session)
+    assert 'b' not in sessions and 'a' in sessions
+    assert sessions.evictions == 1 and sessions.total_bytes() == 200
+
+    # The session just stored is kept even on its own above the limit
+    sessions['big'] = {'rows': Sized(1000)}
+    assert [key for key, _ in sessions.loaded_sessions()] == ['big']
+    assert sessions.total_bytes() == 1000
+
+
+def test_measured_once_per_change():
+    calls = []
+    sessions = SessionManager(max_bytes=10 ** 9, sizeof=lambda session: calls.append(session) or 1)
+    for i in range(20):
+        sessions[str(i)] = {'i': i}
+    assert len(calls) == 20
+
+
+def test_replace_keeps_entry():
+    sessions = SessionManager(ttl_seconds=60, max_entries=2)
+    old = {'version': 1}
+    sessions['a'] = old
+    sessions['b'] = {'version': 2}
+    new = {'version': 1, 'refreshed': True}
+    assert sessions.replace('a', old, new) is True
+    assert sessions['a'] is new
+    # A session re-initialized meanwhile is not overwritten by a rebuilt copy of the old one
+    assert sessions.replace('a', old, {'version': 0}) is False
+    assert sessions.replace('missing', old, new) is False
+    assert sessions.created == 2
+
+
+def test_lock_per_key():
+    sessions = SessionManager()
+    assert sessions.lock('a') is sessions.lock('a')
+    assert sessions.lock('a') is not sessions.lock('b')
+    results = []
+    with sessions.lock('a'):
+        other = threading.Thread(target=lambda: results.append(sessions.lock('a').acquire(timeout=0.01)))
+        other.start()
+        other.join()
+    assert results == [False]
@@ -0,0 +1,152 @@
+"""
+Round trips through the memory and SQLite state backends, and two SharedSessionStores
+(two "workers") sharing one SQLite file.
+"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from session_manager import SharedSessionStore
+from state_backend import MemoryBackend, SQLiteBackend, create_backend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return create_backend('memory://')
+    return create_backend(f"sqlite:///{tmp_path / 'state.db'}")
+
+
+def test_create_backend(tmp_path):
+    assert isinstance(create_backend('memory://'), MemoryBackend)
+    assert isinstance(create_backend(f"sqlite:///{tmp_path / 'state.db'}"), SQLiteBackend)
+    with pytest.raises(ValueError):
+        create_backend('ftp://example')
+
+
+def test_get_set_delete(backend):
+    value = {"flight": "SQ 0286", "counts": [1, 2, 3], "nested": {"a": 0.5}}
+    assert backend.get('missing') is None
+    backend.set('k', value)
+    assert backend.get('k') == value
+    backend.set('k', {"replaced": True})
+    assert backend.get('k') == {"replaced": True}
+    assert backend.delete('k') is True
+    assert backend.delete('k') is False
+    assert backend.get('k') is None
+
+
+def test_numpy_scalars_round_trip(backend):
+    backend.set('n', {"count": np.int64(7), "share": np.float64(0.25)})
+    assert backend.get('n') == {"count": 7, "share": 0.25}
+
+
+def test_ttl_and_touch(backend):
+    backend.set('short', 1, ttl_seconds=0.05)
+    backend.set('touched', 2, ttl_seconds=0.05)
+    backend.set('forever', 3)
+    backend.touch('touched', 60)
+    time.sleep(0.1)
+    assert backend.get('short') is None
+    assert backend.get('touched') == 2
+    assert backend.get('forever') == 3
+    assert 'short' not in backend.keys()
+
+
+def test_keys_by_prefix(backend):
+    for key in ['session:a', 'session:b', 'cache:x']:
+        backend.set(key, key)
+    assert sorted(backend.keys('session:')) == ['session:a', 'session:b']
+    assert sorted(backend.keys()) == ['cache:x', 'session:a', 'session:b']
+
+
+def test_incr(backend):
+    assert [backend.incr('version') for _ in range(3)] == [1, 2, 3]
+    assert backend.incr('other') == 1
+
+
+def test_locks(backend):
+    assert backend.acquire('lock', 'a', 60) is True
+    assert backend.acquire('lock', 'b', 60) is False
+    backend.release('lock', 'b')  # not the holder: no effect
+    assert backend.acquire('lock', 'b', 60) is False
+    backend.release('lock', 'a')
+    assert backend.acquire('lock', 'b', 60) is True
+
+
+def test_lock_expires(backend):
+    assert backend.acquire('lock', 'a', 0.05) is True
+    time.sleep(0.1)
+    assert backend.acquire('lock', 'b', 60) is True
+    backend.release('lock', 'a')  # expired holder can't release the new one
+    assert backend.acquire('lock', 'c', 60) is False
+
+
+def test_sqlite_counter_shared_between_connections(tmp_path):
+    path = tmp_path / 'state.db'
+    first, second = SQLiteBackend(str(path)), SQLiteBackend(str(path))
+    assert [first.incr('v'), second.incr('v'), first.incr('v')] == [1, 2, 3]
+
+
+def session_store(backend):
+    # Sessions are plain dicts here; the state is the session itself
+    return SharedSessionStore(backend, hydrate=dict, dehydrate=dict, ttl_seconds=60)
+
+
+def test_shared_sessions_between_workers(tmp_path):
+    path = str(tmp_path / 'state.db')
+    worker_a, worker_b = session_store(SQLiteBackend(path)), session_store(SQLiteBackend(path))
+
+    worker_a.set('SQ 0286|2024-06-01', {'version': worker_a.next_version(), 'edits': {}})
+    assert 'SQ 0286|2024-06-01' in worker_b
+    assert worker_b['SQ 0286|2024-06-01']['edits'] == {}
+
+    # An edit saved by one worker is re-loaded by the other
+    session = worker_a['SQ 0286|2024-06-01']
+    session['edits'] = {'age': {'18-30_Lunch': {'Chicken': 1.0}}}
+    session['version'] = worker_a.next_version()
+    worker_a.save('SQ 0286|2024-06-01', session)
+    assert worker_b['SQ 0286|2024-06-01']['edits'] == {'age': {'18-30_Lunch': {'Chicken': 1.0}}}
+    assert worker_b.reloads == 2
+
+    assert worker_b.pop('SQ 0286|2024-06-01') is True
+    assert worker_a.get('SQ 0286|2024-06-01') is None
+    assert len(worker_a) == 0
+
+
+def test_session_lock_serializes_workers(tmp_path):
+    path = str(tmp_path / 'state.db')
+    worker_a, worker_b = session_store(SQLiteBackend(path)), session_store(SQLiteBackend(path))
+    worker_a.set('SQ 0286|2024-06-01', {'version': worker_a.next_version(), 'edits': []})
+
+    # Both workers append an edit (read, change, save) at the same time; neither edit is lost
+    def edit(worker, name):
+        for i in range(10):
+            with worker.lock('SQ 0286|2024-06-01'):
+                session = worker['SQ 0286|2024-06-01']
+                session['edits'] = session['edits'] + [f"{name}{i}"]
+                time.sleep(0.001)
+                session['version'] = worker.next_version()
+                worker.save('SQ 0286|2024-06-01', session)
+
+    threads = [threading.Thread(target=edit, args=(worker, name)) for worker, name in [(worker_a, 'a'), (worker_b, 'b')]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(worker_a['SQ 0286|2024-06-01']['edits']) == sorted([f"a{i}" for i in range(10)] + [f"b{i}" for i in range(10)])
+
+
+def test_session_lock_timeout(tmp_path):
+    path = str(tmp_path / 'state.db')
+    worker_a, worker_b = session_store(SQLiteBackend(path)), session_store(SQLiteBackend(path))
+    worker_b.lock_timeout_seconds = 0.05
+    with worker_a.lock('SQ 0286|2024-06-01'):
+        with pytest.raises(TimeoutError):
+            with worker_b.lock('SQ 0286|2024-06-01'):
+                pass
+    with worker_b.lock('SQ 0286|2024-06-01'):
+        pass
@@ -20,10 +20,14 @@ function FlightSelectionScreen({ selectedFlight, setSelectedFlight, flightDate,
   const [loading, setLoading] = useState(true);
   const [availableDates, setAvailableDates] = useState([]);
 
-  // Clear session memory when returning to flight selection
+  // Clear this user's session (the flight+date being left) when returning to flight selection
   useEffect(() => {
-    console.log('🗑️  Clearing session memory (returned to flight selection)');
-    axios.post(`${API_BASE_URL}/api/clear-session`)
+    if (!selectedFlight || !flightDate) {
+      return;
+    }
+    const sessionKey = `${selectedFlight.flightNumber} (${selectedFlight.origin} → ${selectedFlight.destination})|${flightDate}`;
+    console.log('🗑️  Clearing session memory (returned to flight selection):', sessionKey);
+    axios.post(`${API_BASE_URL}/api/clear-session`, null, { params: { session_key: sessionKey } })
       .then(response => {
         console.log('✅ Session cleared:', response.data);
       })
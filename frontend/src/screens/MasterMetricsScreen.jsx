@@ -180,6 +180,7 @@ function MasterMetricsScreen({ selectedFlight, flightDate, masterMetrics, setMas
     if (flightLabel && flightDate) {
       params.flight_number = flightLabel;
       params.flight_date = flightDate;
+      params.scope = 'flight';  // Only the rows this flight's passengers use
     }
     
     axios.get(`${API_BASE_URL}/api/master-metrics`, { params })
@@ -251,7 +252,8 @@ function MasterMetricsScreen({ selectedFlight, flightDate, masterMetrics, setMas
         if (flightLabel && flightDate && !sessionInitialized) {
           axios.post(`${API_BASE_URL}/api/initialize-session`, {
             flight_number: flightLabel,
-            flight_date: flightDate
+            flight_date: flightDate,
+            scope: 'flight'
           })
             .then(sessionResponse => {
               console.log('✅ Session initialized');
@@ -287,11 +289,19 @@ function MasterMetricsScreen({ selectedFlight, flightDate, masterMetrics, setMas
   // Load modified rows from session memory
   useEffect(() => {
     if (sessionKey && sessionInitialized) {
+      // Session version of the last fetch; the backend answers "unchanged" while it matches
+      let lastVersion = null;
       const loadModifiedRows = () => {
-        axios.get(`${API_BASE_URL}/api/get-modified-rows`, {
-          params: { session_key: sessionKey }
-        })
+        const params = { session_key: sessionKey };
+        if (lastVersion !== null) {
+          params.since_version = lastVersion;
+        }
+        axios.get(`${API_BASE_URL}/api/get-modified-rows`, { params })
           .then(response => {
+            lastVersion = response.data.version || null;
+            if (response.data.unchanged) {
+              return;
+            }
             setModifiedRows(response.data.modified_rows || []);
             if (response.data.count > 0) {
               console.log(`📊 ${response.data.count} modified rows`);
@@ -539,6 +549,7 @@ function MasterMetricsScreen({ selectedFlight, flightDate, masterMetrics, setMas
     if (flightLabel && flightDate) {
       params.flight_number = flightLabel;
       params.flight_date = flightDate;
+      params.scope = 'flight';  // Only the rows this flight's passengers use
     }
     
     try {
@@ -553,7 +564,8 @@ function MasterMetricsScreen({ selectedFlight, flightDate, masterMetrics, setMas
       if (flightLabel && flightDate) {
         const sessionResponse = await axios.post(`${API_BASE_URL}/api/initialize-session`, {
           flight_number: flightLabel,
-          flight_date: flightDate
+          flight_date: flightDate,
+          scope: 'flight'
         });
         console.log('✅ Session reset to defaults');
         setSessionKey(sessionResponse.data.session_key);
@@ -1263,7 +1275,9 @@ function MasterMetricsScreen({ selectedFlight, flightDate, masterMetrics, setMas
                       value={selectedWeekday}
                       onChange={(e) => setSelectedWeekday(e.target.value)}
                     >
-                      {['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'].map((day) => (
+                      {['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+                        .filter(day => dataForMealTime.some(row => row.day_of_week === day))
+                        .map((day) => (
                         <option key={day} value={day}>{day}</option>
                       ))}
                     </Select>
@@ -12,6 +12,9 @@ from datetime import datetime
 # Add backend to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
+from customer_store import CustomerStore
+from scoring import PROTEIN_INDEX, protein_slots, probability_matrix, apportion
+
 def load_prediction_results():
     """Load all PredictionResults CSV files"""
     results_dir = 'PredictionResults'
@@ -35,28 +38,15 @@ def load_prediction_results():
     
     return all_results
 
-def simulate_main_py_prediction(segment, date_str, cabin_class, meal_time, customers_df, 
+def simulate_main_py_prediction(segment, date_str, cabin_class, meal_time, customer_store,
                                 nationality_probs, age_probs, dest_probs, meal_probs,
                                 available_proteins):
     """
     Simulate the prediction logic from main.py
     Returns: dict of {protein: count}
     """
-    # Parse date
-    target_date = pd.to_datetime(date_str).date()
-    
-    # Filter customers
-    flight_data = customers_df[customers_df['segment'] == segment].copy()
-    
-    # Parse dates
-    flight_data['parsed_date'] = pd.to_datetime(
-        flight_data['segment_local_departure_datetime'].str.split().str[0],
-        format='%d/%m/%Y',
-        dayfirst=True,
-        errors='coerce'
-    ).dt.date
-    
-    flight_data = flight_data[flight_data['parsed_date'] == target_date]
+    # Slice this segment+date out of the indexed manifest (dates pre-parsed at load)
+    flight_data = customer_store.segment_rows(segment, date_str)
     
     # Remove Under 2
     flight_data = flight_data[flight_data['age_group'] != 'Under 2']
@@ -76,12 +66,7 @@ def simulate_main_py_prediction(segment, date_str, cabin_class, meal_time, custo
     if cabin_data.empty:
         return {}
     
-    # Add weekday
-    cabin_data['weekday'] = pd.to_datetime(
-        cabin_data['segment_local_departure_datetime'],
-        format='%d/%m/%Y %H:%M',
-        dayfirst=True
-    ).dt.day_name()
+    # Weekday is pre-computed from the departure date by the store
     
     # Create feature_set (matching meal_planning.py)
     cabin_data['feature_set'] = (
@@ -94,7 +79,7 @@ def simulate_main_py_prediction(segment, date_str, cabin_class, meal_time, custo
     # Group passengers (matching meal_planning.py exactly - include segment, cabin_class, parsed_date)
     grouped = cabin_data.groupby([
         'segment', 'cabin_class', 'parsed_date', 'weekday', 'feature_set'
-    ]).size().reset_index(name='passenger_count')
+    ], observed=True).size().reset_index(name='passenger_count')
     
     # Get feature details
     feature_details = cabin_data.groupby('feature_set').agg({
@@ -112,14 +97,13 @@ def simulate_main_py_prediction(segment, date_str, cabin_class, meal_time, custo
     W3 = 0.25  # Destination
     W4 = 0.15  # Meal time
     
-    results_by_protein = {p: 0 for p in available_proteins}
+    group_probs = []
     
     for _, group in grouped.iterrows():
         nationality = group['nationality_code']
         age_group = group['age_group']
         destination = group['destination_region']
         weekday = group['weekday']
-        passenger_count = group['passenger_count']
         
         # Get probabilities
         nat_key = f"{nationality}_{weekday}"
@@ -146,29 +130,13 @@ def simulate_main_py_prediction(segment, date_str, cabin_class, meal_time, custo
         else:
             final_probs = {p: 1.0/len(available_proteins) for p in available_proteins}
         
-        # Calculate counts using largest remainder method
-        protein_counts = {}
-        remainders = {}
-        
-        for protein in available_proteins:
-            exact = passenger_count * final_probs[protein]
-            floor_count = int(exact)
-            protein_counts[protein] = floor_count
-            remainders[protein] = exact - floor_count
-        
-        # Distribute remaining
-        total_allocated = sum(protein_counts.values())
-        remaining = passenger_count - total_allocated
-        
-        if remaining > 0:
-            # Use stable sort (preserves input order on ties) - matches meal_planning.py
-            sorted_proteins = sorted(available_proteins, key=lambda p: remainders[p], reverse=True)
-            for i in range(remaining):
-                protein_counts[sorted_proteins[i]] += 1
-        
-        # Add to results
-        for protein, count in protein_counts.items():
-            results_by_protein[protein] += count
+        group_probs.append(final_probs)
+    
+    # Calculate counts for every group in one pass (largest remainder method, shared with main.py)
+    slots = protein_slots([available_proteins] * len(grouped))
+    protein_counts = apportion(probability_matrix(group_probs), grouped['passenger_count'].to_numpy(), slots)
+    totals = protein_counts.sum(axis=0)
+    results_by_protein = {p: int(totals[PROTEIN_INDEX[p]]) for p in available_proteins}
     
     return results_by_protein
 
@@ -267,11 +235,10 @@ def run_validation():
     # Load data
     print("[*] Loading data...")
     prediction_results = load_prediction_results()
-    customers_df = pd.read_csv('customers.csv', dtype={'age_group': str}, low_memory=False)
-    customers_df['age_group'] = customers_df['age_group'].replace('Feb-18', '2-18')
+    customer_store = CustomerStore('customers.csv').load()
     meal_df = pd.read_csv('meal_df_new.csv')
     
-    print(f"[OK] Loaded customers.csv: {len(customers_df)} rows")
+    print(f"[OK] Loaded customers.csv: {len(customer_store.df)} rows")
     print(f"[OK] Loaded meal_df_new.csv: {len(meal_df)} rows")
     print()
     
@@ -351,7 +318,7 @@ def run_validation():
         
         # Run main.py simulation
         predicted = simulate_main_py_prediction(
-            segment, date, cabin, meal_time, customers_df,
+            segment, date, cabin, meal_time, customer_store,
             normalized_nat_probs, normalized_age_probs, normalized_dest_probs, normalized_meal_probs,
             available_proteins
         )